@@ -55,6 +55,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'notifications.context_processors.inbox',
             ],
         },
     },
@@ -86,6 +87,20 @@ else:
         }
     }
 
+if DEBUG:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': '/var/tmp/ashignet_cache',
+        }
+    }
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -112,6 +127,13 @@ if DEBUG:
 else:
     MEDIA_ROOT = '/home/ps0jc8heuqta/public_html/media'
 
+# Кто отдаёт защищённые медиафайлы (скриншоты) после проверки прав:
+# 'nginx' — X-Accel-Redirect на internal location PROTECTED_MEDIA_INTERNAL_URL,
+# 'apache' — X-Sendfile (mod_xsendfile), пусто — сам Django (разработка).
+# Прямую раздачу MEDIA_ROOT/screenshots/ веб-сервером нужно закрыть.
+PROTECTED_MEDIA_SERVER = config('PROTECTED_MEDIA_SERVER', default='')
+PROTECTED_MEDIA_INTERNAL_URL = '/protected-media/'
+
 # TIME_ZONE = 'UTC'
 TIME_ZONE = 'Asia/Ulaanbaatar'
 
@@ -133,6 +155,9 @@ ANYMAIL = {
 
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL')
 
+# Домен для ссылок в письмах, которые отправляются вне запроса
+SITE_DOMAIN = config('SITE_DOMAIN', default='sharga42.info')
+
 DEFAULT_CHARSET = 'utf-8'
 
 # EMAIL_BACKEND = 'anymail.backends.mailjet.EmailBackend'
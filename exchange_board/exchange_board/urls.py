@@ -2,6 +2,7 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
+from transactions.views import protected_screenshot
 
 urlpatterns = [
     path('', include('offers.urls')),
@@ -11,6 +12,12 @@ urlpatterns = [
     path('transaction/', include('transactions.urls')),
     path('request/', include('requests_for_transaction.urls')),
     path('tic-tac-toe/', include('tic_tac.urls')),
+    path('notifications/', include('notifications.urls')),
+    # Скриншоты переводов отдаются только через проверку прав,
+    # раньше общей раздачи MEDIA_ROOT
+    path(settings.MEDIA_URL.lstrip('/') + 'screenshots/<path:path>',
+         protected_screenshot,
+         name='protected_screenshot'),
 ]
 
 
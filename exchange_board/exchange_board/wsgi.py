@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'exchange_board.settings')
 
 application = get_wsgi_application()
+
+# Книга заявок строится в фоне при старте процесса, а не на первом
+# запросе. В AppConfig.ready() этого не делаем: ready() выполняется
+# и для migrate, и для тестов
+from offers.order_book import schedule_order_book_rebuild  # noqa: E402
+
+schedule_order_book_rebuild()
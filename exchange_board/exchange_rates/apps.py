@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class ExchangeRatesConfig(AppConfig):
     name = 'exchange_rates'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,103 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.core.management.base import BaseCommand
+from logging_app.loguru_config import logger
+
+from exchange_rates.matrix import CURRENCY_CODES
+from exchange_rates.models import ExchangeRate
+from exchange_rates.views import (get_required_amount_to_be_exchanged,
+                                  get_required_amounts)
+
+
+def make_offers(count):
+    random.seed(count)
+    currencies = {code: SimpleNamespace(code=code, name=code)
+                  for code in CURRENCY_CODES}
+    offers = []
+    for offer_id in range(1, count + 1):
+        offered, needed = random.sample(CURRENCY_CODES, 2)
+        offers.append(SimpleNamespace(
+            id=offer_id,
+            amount_offered=Decimal(random.randint(100, 1000000)) / 100,
+            currency_offered=currencies[offered],
+            currency_needed=currencies[needed],
+        ))
+    return offers
+
+
+def convert_per_offer(offers, rate):
+    # Прежний путь: отдельный вызов get_required_amount_to_be_exchanged
+    # на каждую карточку ленты
+    return {
+        offer.id: get_required_amount_to_be_exchanged(offer)['required_amount']
+        for offer in offers
+    }
+
+
+def convert_matrix_per_offer(offers, rate):
+    matrix = rate.get_matrix()
+    return {
+        offer.id: matrix.convert(
+            offer.amount_offered,
+            offer.currency_offered.code,
+            offer.currency_needed.code
+        )
+        for offer in offers
+    }
+
+
+def convert_batch(offers, rate):
+    return get_required_amounts(offers, rate.get_matrix())
+
+
+class Command(BaseCommand):
+    help = ("Compares per-offer and batch conversion of required amounts "
+            "on in-memory offers.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--offers', type=int, default=10000)
+        parser.add_argument('--rounds', type=int, default=7)
+
+    def handle(self, *args, **options):
+        offers = make_offers(options['offers'])
+        rate = ExchangeRate(
+            base_currency='USD',
+            rates='{"RUB": "90.15", "MNT": "3420.5"}'
+        )
+
+        # Курс подставляется в памяти, чтобы не трогать общий кэш,
+        # а запись логов на каждую карточку не измеряется
+        logger.disable('exchange_rates')
+        try:
+            with patch.object(ExchangeRate, 'latest', return_value=rate):
+                expected = convert_per_offer(offers, rate)
+                if convert_batch(offers, rate) != expected:
+                    self.stderr.write(
+                        "Batch conversion differs from per-offer results"
+                    )
+                    return
+                for label, convert in (
+                        ('per-offer', convert_per_offer),
+                        ('matrix per-offer', convert_matrix_per_offer),
+                        ('batch', convert_batch)):
+                    self.report(label, convert, offers, rate,
+                                options['rounds'])
+        finally:
+            logger.enable('exchange_rates')
+
+    def report(self, label, convert, offers, rate, rounds):
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            convert(offers, rate)
+            timings.append(time.perf_counter() - started)
+        self.stdout.write(
+            f"{label}: {len(offers)} offers, "
+            f"median {statistics.median(timings) * 1000:.2f}ms, "
+            f"best {min(timings) * 1000:.2f}ms"
+        )
@@ -0,0 +1,94 @@
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import requests
+from django.core.management.base import BaseCommand
+
+from exchange_rates.views import (fetch_exchange_rates, get_exchange_rate,
+                                  get_exchange_rate_from_alternative_api)
+
+
+def make_handler(latency):
+
+    class FakeProviderHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(latency)
+            if self.path.startswith('/latest'):
+                body = {'base': 'USD', 'rates': {'RUB': 90.0, 'MNT': 3420.0}}
+            elif self.path.startswith('/convert'):
+                body = {'result': 1.5}
+            else:
+                body = {'rub': 90.0}
+            payload = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeProviderHandler
+
+
+def fetch_sequentially():
+    # Прежнее поведение: отдельный запрос на каждую пару подряд через
+    # requests.get, каждый со своим новым соединением
+    return {
+        'usd_to_rub': get_exchange_rate("USD", "RUB", session=requests),
+        'mnt_to_rub': get_exchange_rate("RUB", "MNT", session=requests),
+        'mnt_to_usd': get_exchange_rate("USD", "MNT", session=requests),
+        'usd_to_rub_alternative': get_exchange_rate_from_alternative_api(
+            "usd", "rub", session=requests
+        ),
+    }
+
+
+class Command(BaseCommand):
+    help = ("Compares sequential and concurrent exchange rate fetching "
+            "against a local fake provider.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--latency', type=float, default=0.2,
+                            help='Simulated provider latency in seconds.')
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        server = ThreadingHTTPServer(
+            ('127.0.0.1', 0), make_handler(options['latency'])
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            # Адреса провайдеров — константы модуля, подменяем их
+            # на локальный фейковый сервер
+            with patch.multiple(
+                'exchange_rates.views',
+                EXCHANGE_API_URL=f"{base_url}/convert",
+                EXCHANGE_RATES_API_URL=f"{base_url}/latest",
+                ALTERNATIVE_API_URL=f"{base_url}/currencies/{{base}}/{{target}}.json"
+            ):
+                for label, fetch in (('sequential', fetch_sequentially),
+                                     ('concurrent', fetch_exchange_rates)):
+                    timings = []
+                    for _ in range(options['rounds']):
+                        started = time.perf_counter()
+                        rates = fetch()
+                        timings.append(time.perf_counter() - started)
+                        if not all(rates.values()):
+                            self.stderr.write(f"{label}: missing rates {rates}")
+                    self.stdout.write(
+                        f"{label}: median "
+                        f"{statistics.median(timings) * 1000:.1f} ms"
+                    )
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.stdout.write(self.style.SUCCESS('Benchmark finished.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from exchange_rates.views import refresh_exchange_rates
+
+
+class Command(BaseCommand):
+    help = "Refreshes exchange rates if they are stale and no other worker is fetching them."
+
+    def handle(self, *args, **kwargs):
+        if refresh_exchange_rates():
+            self.stdout.write(self.style.SUCCESS('Exchange rates updated.'))
+        else:
+            self.stdout.write('Exchange rates are fresh or already being updated.')
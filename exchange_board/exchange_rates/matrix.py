@@ -0,0 +1,78 @@
+from decimal import Decimal, InvalidOperation
+
+from bank_details.models import CURRENCY_CHOICES
+
+CURRENCY_CODES = tuple(code for code, name in CURRENCY_CHOICES)
+BASE_CURRENCY = 'USD'
+
+
+class RateMatrix:
+    """
+    Кросс-курсы всех валют из CURRENCY_CHOICES, полученные триангуляцией
+    через один вектор курсов базовой валюты. Матрица хранится плоским
+    списком n*n, поэтому конвертация — это одно обращение по индексу.
+    """
+
+    def __init__(self, codes, table):
+        self.codes = tuple(codes)
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.table = table
+
+    @classmethod
+    def from_vector(cls, base_currency, vector, codes=CURRENCY_CODES):
+        """
+        `vector` — сколько единиц каждой валюты дают за одну единицу
+        базовой: {'RUB': 90.1, 'MNT': 3400}.
+        """
+        units = {base_currency: Decimal(1)}
+        for code, rate in vector.items():
+            try:
+                rate = Decimal(str(rate))
+            except (InvalidOperation, TypeError, ValueError):
+                continue
+            if rate > 0:
+                units[code.upper()] = rate
+
+        size = len(codes)
+        table = [None] * (size * size)
+        for i, from_code in enumerate(codes):
+            if from_code not in units:
+                continue
+            for j, to_code in enumerate(codes):
+                if to_code in units:
+                    table[i * size + j] = units[to_code] / units[from_code]
+        return cls(codes, table)
+
+    def rate(self, from_code, to_code):
+        i = self.index.get(from_code)
+        j = self.index.get(to_code)
+        if i is None or j is None:
+            return None
+        return self.table[i * len(self.codes) + j]
+
+    def convert(self, amount, from_code, to_code):
+        rate = self.rate(from_code, to_code)
+        if rate is None:
+            return None
+        return Decimal(amount) * rate
+
+    def convert_batch(self, rows):
+        """
+        Пакетная конвертация: `rows` — кортежи (ключ, сумма Decimal, из, в).
+        Строки группируются по валютной паре, курс каждой пары берётся
+        из таблицы один раз. Возвращает {ключ: сумма или None}.
+        """
+        by_pair = {}
+        for key, amount, from_code, to_code in rows:
+            by_pair.setdefault((from_code, to_code), []).append((key, amount))
+
+        result = {}
+        for (from_code, to_code), pair_rows in by_pair.items():
+            rate = self.rate(from_code, to_code)
+            if rate is None:
+                result.update((key, None) for key, amount in pair_rows)
+            else:
+                result.update(
+                    (key, amount * rate) for key, amount in pair_rows
+                )
+        return result
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.19 on 2026-10-18 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchange_rates', '0002_exchangerate_usd_to_rub_alternative'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefreshLock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
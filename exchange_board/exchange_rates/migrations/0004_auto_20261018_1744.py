@@ -0,0 +1,23 @@
+# Generated by Django 2.2.19 on 2026-10-18 09:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchange_rates', '0003_refreshlock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exchangerate',
+            name='base_currency',
+            field=models.CharField(default='USD', max_length=3),
+        ),
+        migrations.AddField(
+            model_name='exchangerate',
+            name='rates',
+            field=models.TextField(blank=True, default='', help_text='JSON vector of units per one unit of the base currency.'),
+        ),
+    ]
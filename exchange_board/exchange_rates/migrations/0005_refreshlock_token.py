@@ -0,0 +1,18 @@
+# Generated by Django 2.2.19 on 2026-10-18 10:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchange_rates', '0004_auto_20261018_1744'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='refreshlock',
+            name='token',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
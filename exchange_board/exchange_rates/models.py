@@ -1,8 +1,29 @@
+import json
+import threading
+import time
+import uuid
 from datetime import timedelta
 
+from django.core.cache import cache
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 
+from .matrix import BASE_CURRENCY, RateMatrix
+
+RATE_VERSION_CACHE_KEY = 'exchange_rate:version'
+RATE_CACHE_TIMEOUT = 60 * 60 * 24
+# Как долго процесс доверяет своей копии курса, не сверяя версию
+# с общим кэшем
+LOCAL_RATE_TTL = 5
+
+_local_rate_lock = threading.Lock()
+_local_rate = {'rate': None, 'checked_at': 0}
+
+
+def _rate_cache_key(version):
+    return f'exchange_rate:{version}'
+
 
 class ExchangeRate(models.Model):
     usd_to_rub = models.FloatField("USD to RUB")
@@ -10,10 +31,73 @@ class ExchangeRate(models.Model):
     mnt_to_usd = models.FloatField("MNT to USD")
     date_updated = models.DateTimeField(auto_now=True)
     usd_to_rub_alternative = models.FloatField("USD to RUB (alternative)")
+    base_currency = models.CharField(max_length=3, default=BASE_CURRENCY)
+    rates = models.TextField(
+        blank=True,
+        default='',
+        help_text="JSON vector of units per one unit of the base currency."
+    )
+
+    def get_matrix(self):
+        if not hasattr(self, '_matrix'):
+            if self.rates:
+                vector = json.loads(self.rates)
+            else:
+                # Записи до появления вектора курсов: восстанавливаем его
+                # из отдельных колонок
+                vector = {'RUB': self.usd_to_rub, 'MNT': self.mnt_to_usd}
+            self._matrix = RateMatrix.from_vector(self.base_currency, vector)
+        return self._matrix
+
+    @property
+    def version(self):
+        return f'{self.id}:{self.date_updated.timestamp()}'
 
     @classmethod
     def latest(cls):
-        return cls.objects.latest('date_updated')
+        """
+        Последний курс без обращения к БД: копия в памяти процесса,
+        сверяемая с версией в общем кэше Django не чаще раза в
+        LOCAL_RATE_TTL секунд. Версия меняется при каждой записи курса.
+        """
+        now = time.monotonic()
+        with _local_rate_lock:
+            local_rate = _local_rate['rate']
+            if (local_rate is not None
+                    and now - _local_rate['checked_at'] < LOCAL_RATE_TTL):
+                return local_rate
+
+        version = cache.get(RATE_VERSION_CACHE_KEY)
+        if local_rate is not None and local_rate.version == version:
+            rate = local_rate
+        else:
+            rate = cache.get(_rate_cache_key(version)) if version else None
+            if rate is None:
+                rate = cls.objects.latest('date_updated')
+                cls.publish(rate)
+
+        with _local_rate_lock:
+            _local_rate['rate'] = rate
+            _local_rate['checked_at'] = now
+        return rate
+
+    @classmethod
+    def publish(cls, rate):
+        rate.get_matrix()
+        cache.set_many({
+            _rate_cache_key(rate.version): rate,
+            RATE_VERSION_CACHE_KEY: rate.version,
+        }, RATE_CACHE_TIMEOUT)
+        with _local_rate_lock:
+            _local_rate['rate'] = rate
+            _local_rate['checked_at'] = time.monotonic()
+
+    @classmethod
+    def invalidate_cache(cls):
+        cache.delete(RATE_VERSION_CACHE_KEY)
+        with _local_rate_lock:
+            _local_rate['rate'] = None
+            _local_rate['checked_at'] = 0
 
     @staticmethod
     def needs_update():
@@ -23,3 +107,38 @@ class ExchangeRate(models.Model):
             return time_since_last_update > timedelta(hours=12)
         except ExchangeRate.DoesNotExist:
             return True
+
+
+class RefreshLock(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    # Владелец текущей блокировки: снять её может только он
+    token = models.CharField(max_length=32, blank=True)
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def acquire(cls, name, timeout):
+        """Возвращает токен владельца или None, если блокировка занята."""
+        # Захват одним условным UPDATE: из всех процессов его выиграет
+        # только один, пока блокировка не истечёт
+        now = timezone.now()
+        token = uuid.uuid4().hex
+        cls.objects.get_or_create(name=name)
+        taken = cls.objects.filter(name=name).filter(
+            Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+        ).update(locked_until=now + timeout, token=token)
+        return token if taken == 1 else None
+
+    @classmethod
+    def release(cls, name, token, hold=None):
+        """
+        Снимает блокировку, только если она всё ещё принадлежит `token`:
+        после истечения срока её мог захватить другой процесс. С `hold`
+        блокировка держится ещё столько же — пауза перед повтором.
+        """
+        locked_until = timezone.now() + hold if hold else None
+        return cls.objects.filter(name=name, token=token).update(
+            locked_until=locked_until
+        ) == 1
@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ExchangeRate
+
+
+@receiver(post_save, sender=ExchangeRate)
+def publish_new_exchange_rate(sender, instance, **kwargs):
+    ExchangeRate.publish(instance)
+
+
+@receiver(post_delete, sender=ExchangeRate)
+def invalidate_exchange_rate_cache(sender, instance, **kwargs):
+    ExchangeRate.invalidate_cache()
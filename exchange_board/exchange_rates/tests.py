@@ -1,24 +1,42 @@
-from unittest.mock import patch
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import Mock, patch
 
+import requests
+
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from users.models import CustomUser
 
-from .models import ExchangeRate
-from .views import (get_exchange_rate, get_required_amount_to_be_exchanged,
-                    update_exchange_rates)
+from .matrix import RateMatrix
+from .models import ExchangeRate, RefreshLock
+from .views import (REFRESH_LOCK_NAME, REFRESH_LOCK_TIMEOUT,
+                    fetch_exchange_rates, fetch_with_retries,
+                    get_exchange_rate, get_required_amount_to_be_exchanged,
+                    refresh_exchange_rates, update_exchange_rates)
 
 
 class ExchangeRateTests(TestCase):
 
-    @patch('exchange_rates.views.get_exchange_rate')
-    def test_update_exchange_rates(self, mock_get_rate):
-        mock_get_rate.return_value = 1.5
+    @patch('exchange_rates.views.get_exchange_rate_from_alternative_api')
+    @patch('exchange_rates.views.get_exchange_rates')
+    def test_update_exchange_rates(self, mock_get_rates, mock_alternative):
+        mock_get_rates.return_value = {'RUB': 90.0, 'MNT': 3420.0}
+        mock_alternative.return_value = 91.0
         update_exchange_rates()
+        mock_get_rates.assert_called_once()
         rate = ExchangeRate.objects.first()
-        self.assertEqual(rate.usd_to_rub, 1.5)
-        self.assertEqual(rate.mnt_to_rub, 1.5)
-        self.assertEqual(rate.mnt_to_usd, 1.5)
+        self.assertEqual(rate.usd_to_rub, 90.0)
+        self.assertEqual(rate.mnt_to_rub, 38.0)
+        self.assertEqual(rate.mnt_to_usd, 3420.0)
+        self.assertEqual(rate.usd_to_rub_alternative, 91.0)
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_get_exchange_rate(self, mock_get):
         mock_get.return_value.json.return_value = {'result': 1.5}
         mock_get.return_value.status_code = 200
@@ -33,6 +51,7 @@ class ExchangeRateTests(TestCase):
             class MockCurrency:
                 def __init__(self, name):
                     self.name = name
+                    self.code = name
 
             def __init__(self, currency_offered_name, currency_needed_name, amount_offered):
                 self.currency_offered = self.MockCurrency(currency_offered_name)
@@ -42,3 +61,249 @@ class ExchangeRateTests(TestCase):
         offer = MockOffer("RUB", "USD", 150)
         result = get_required_amount_to_be_exchanged(offer)
         self.assertEqual(result['required_amount'], 100)
+
+
+class RateMatrixTests(TestCase):
+
+    def setUp(self):
+        self.matrix = RateMatrix.from_vector(
+            'USD', {'RUB': 90, 'MNT': 3420}, codes=('USD', 'RUB', 'MNT', 'KZT')
+        )
+
+    def test_triangulates_cross_rates(self):
+        self.assertEqual(self.matrix.rate('USD', 'RUB'), Decimal(90))
+        self.assertEqual(self.matrix.rate('RUB', 'MNT'), Decimal(38))
+        self.assertEqual(self.matrix.rate('USD', 'USD'), Decimal(1))
+        self.assertEqual(
+            self.matrix.convert(Decimal('100'), 'RUB', 'MNT'), Decimal(3800)
+        )
+
+    def test_batch_conversion_groups_pairs(self):
+        rows = [
+            (1, Decimal('100'), 'RUB', 'MNT'),
+            (2, Decimal('2'), 'USD', 'RUB'),
+            (3, Decimal('50'), 'RUB', 'MNT'),
+            (4, Decimal('1'), 'KZT', 'USD'),
+        ]
+        self.assertEqual(self.matrix.convert_batch(rows), {
+            1: Decimal(3800), 2: Decimal(180), 3: Decimal(1900), 4: None,
+        })
+
+    def test_missing_currency_has_no_rate(self):
+        self.assertIsNone(self.matrix.rate('KZT', 'USD'))
+        self.assertIsNone(self.matrix.convert(10, 'USD', 'CNY'))
+
+    @patch('exchange_rates.views.get_exchange_rate_from_alternative_api')
+    @patch('exchange_rates.views.get_exchange_rates')
+    def test_new_currency_needs_no_extra_calls(self, mock_get_rates,
+                                               mock_alternative):
+        mock_get_rates.return_value = {'RUB': 90, 'MNT': 3420, 'KZT': 450}
+        mock_alternative.return_value = 91.0
+        with patch('exchange_rates.views.CURRENCY_CODES',
+                   ('USD', 'RUB', 'MNT', 'KZT')):
+            fetch_exchange_rates()
+        mock_get_rates.assert_called_once()
+        self.assertEqual(mock_get_rates.call_args.args[1],
+                         ['RUB', 'MNT', 'KZT'])
+
+    def test_legacy_rows_build_matrix_from_columns(self):
+        rate = ExchangeRate(usd_to_rub=90, mnt_to_rub=38, mnt_to_usd=3420)
+        self.assertEqual(rate.get_matrix().rate('RUB', 'MNT'), Decimal(38))
+
+
+@patch('exchange_rates.views.RETRY_BACKOFF', 0)
+class ExchangeRateFetchingTests(TestCase):
+
+    def test_retries_until_success(self):
+        fetch = Mock(side_effect=[requests.ConnectionError(), None, 1.5])
+        result = fetch_with_retries(
+            fetch, "USD", "RUB", deadline=time.monotonic() + 5
+        )
+        self.assertEqual(result, 1.5)
+        self.assertEqual(fetch.call_count, 3)
+
+    def test_gives_up_after_retries(self):
+        fetch = Mock(side_effect=requests.Timeout())
+        result = fetch_with_retries(
+            fetch, "USD", "RUB", deadline=time.monotonic() + 5, retries=1
+        )
+        self.assertIsNone(result)
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_per_call_timeout_respects_deadline(self):
+        fetch = Mock(return_value=1.5)
+        fetch_with_retries(fetch, "USD", "RUB",
+                           deadline=time.monotonic() + 0.5)
+        self.assertLessEqual(fetch.call_args.kwargs['timeout'], 0.5)
+
+    def test_fetches_rates_concurrently(self):
+        def slow_rate(*args, timeout):
+            time.sleep(0.2)
+            return 1.5
+
+        started = time.monotonic()
+        with patch('exchange_rates.views.get_exchange_rates', slow_rate), \
+                patch('exchange_rates.views.'
+                      'get_exchange_rate_from_alternative_api', slow_rate):
+            rates = fetch_exchange_rates(budget=5)
+        self.assertLess(time.monotonic() - started, 0.6)
+        self.assertEqual(set(rates.values()), {1.5})
+
+    def test_budget_bounds_total_time(self):
+        def hanging_rate(*args, timeout):
+            time.sleep(timeout)
+            return None
+
+        started = time.monotonic()
+        with patch('exchange_rates.views.get_exchange_rates', hanging_rate), \
+                patch('exchange_rates.views.'
+                      'get_exchange_rate_from_alternative_api', hanging_rate):
+            rates = fetch_exchange_rates(budget=0.3)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(set(rates.values()), {None})
+
+
+class ExchangeRateRefreshTests(TestCase):
+
+    def setUp(self):
+        self.rate = ExchangeRate.objects.create(
+            usd_to_rub=70.00,
+            mnt_to_rub=250.00,
+            mnt_to_usd=0.035,
+            usd_to_rub_alternative=74.5,
+        )
+        ExchangeRate.objects.filter(id=self.rate.id).update(
+            date_updated=timezone.now() - timedelta(hours=13)
+        )
+        ExchangeRate.invalidate_cache()
+
+    def test_lock_is_exclusive_until_released(self):
+        token = RefreshLock.acquire('test', timedelta(minutes=1))
+        self.assertTrue(token)
+        self.assertIsNone(RefreshLock.acquire('test', timedelta(minutes=1)))
+        self.assertTrue(RefreshLock.release('test', token))
+        self.assertTrue(RefreshLock.acquire('test', timedelta(minutes=1)))
+
+    def test_expired_lock_can_be_taken_over(self):
+        self.assertTrue(RefreshLock.acquire('test', timedelta(minutes=-1)))
+        self.assertTrue(RefreshLock.acquire('test', timedelta(minutes=1)))
+
+    def test_late_release_keeps_new_owner_lock(self):
+        stale = RefreshLock.acquire('test', timedelta(minutes=-1))
+        RefreshLock.acquire('test', timedelta(minutes=1))
+        self.assertFalse(RefreshLock.release('test', stale))
+        self.assertIsNone(RefreshLock.acquire('test', timedelta(minutes=1)))
+
+    @patch('exchange_rates.views.update_exchange_rates')
+    def test_refresh_is_single_flight(self, mock_update):
+        token = RefreshLock.acquire(REFRESH_LOCK_NAME, REFRESH_LOCK_TIMEOUT)
+        self.assertFalse(refresh_exchange_rates())
+        mock_update.assert_not_called()
+
+        RefreshLock.release(REFRESH_LOCK_NAME, token)
+        self.assertTrue(refresh_exchange_rates())
+        mock_update.assert_called_once()
+        self.assertTrue(RefreshLock.acquire(REFRESH_LOCK_NAME,
+                                            REFRESH_LOCK_TIMEOUT))
+
+    @patch('exchange_rates.views.update_exchange_rates',
+           side_effect=requests.ConnectionError)
+    def test_failed_refresh_backs_off(self, mock_update):
+        with self.assertRaises(requests.ConnectionError):
+            refresh_exchange_rates()
+        # Следующий запрос со старыми курсами не идёт к провайдеру снова
+        self.assertFalse(refresh_exchange_rates())
+        mock_update.assert_called_once()
+        lock = RefreshLock.objects.get(name=REFRESH_LOCK_NAME)
+        self.assertGreater(lock.locked_until,
+                           timezone.now() + timedelta(minutes=4))
+
+    @patch('exchange_rates.views.update_exchange_rates')
+    def test_refresh_skips_fresh_rates(self, mock_update):
+        ExchangeRate.objects.filter(id=self.rate.id).update(
+            date_updated=timezone.now()
+        )
+        ExchangeRate.invalidate_cache()
+        self.assertFalse(refresh_exchange_rates())
+        mock_update.assert_not_called()
+
+    @patch('offers.views.schedule_exchange_rate_refresh')
+    @patch('exchange_rates.views.update_exchange_rates')
+    def test_index_serves_stale_rate_without_fetching(self, mock_update,
+                                                       mock_schedule):
+        CustomUser.objects.create_user(
+            username='user', email='user@email.com', password='password'
+        )
+        self.client.login(username='user', password='password')
+
+        response = self.client.get(reverse('index'))
+
+        self.assertContains(response, 'RUB to USD: 70.0')
+        mock_schedule.assert_called_once()
+        mock_update.assert_not_called()
+
+
+class ExchangeRateCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        ExchangeRate.invalidate_cache()
+        self.rate = ExchangeRate.objects.create(
+            usd_to_rub=70.00,
+            mnt_to_rub=250.00,
+            mnt_to_usd=0.035,
+            usd_to_rub_alternative=74.5,
+        )
+
+    def test_latest_is_served_without_queries(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(ExchangeRate.latest().id, self.rate.id)
+            self.assertFalse(ExchangeRate.needs_update())
+
+    def test_new_rate_invalidates_cached_version(self):
+        ExchangeRate.latest()
+        new_rate = ExchangeRate.objects.create(
+            usd_to_rub=80.00,
+            mnt_to_rub=260.00,
+            mnt_to_usd=0.036,
+            usd_to_rub_alternative=81.0,
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(ExchangeRate.latest().id, new_rate.id)
+
+    def test_other_process_picks_up_shared_version(self):
+        new_rate = ExchangeRate.objects.create(
+            usd_to_rub=80.00,
+            mnt_to_rub=260.00,
+            mnt_to_usd=0.036,
+            usd_to_rub_alternative=81.0,
+        )
+        # Процесс, в котором запись не происходила, помнит старый курс
+        with patch('exchange_rates.models._local_rate',
+                   {'rate': self.rate, 'checked_at': 0}):
+            with self.assertNumQueries(0):
+                self.assertEqual(ExchangeRate.latest().id, new_rate.id)
+
+    def test_cold_cache_loads_from_db_once(self):
+        cache.clear()
+        ExchangeRate.invalidate_cache()
+        with self.assertNumQueries(1):
+            ExchangeRate.latest()
+            ExchangeRate.latest()
+
+    def test_deleting_rate_invalidates_cache(self):
+        self.rate.delete()
+        with self.assertRaises(ExchangeRate.DoesNotExist):
+            ExchangeRate.latest()
+
+    def test_feed_renders_without_rate_queries(self):
+        CustomUser.objects.create_user(
+            username='user', email='user@email.com', password='password'
+        )
+        self.client.login(username='user', password='password')
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('index'))
+        self.assertFalse(any(
+            'exchange_rates_exchangerate' in query['sql']
+            for query in context.captured_queries
+        ))
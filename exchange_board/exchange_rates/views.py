@@ -1,37 +1,216 @@
-from decimal import Decimal
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
 
 import requests
 from decouple import config
+from django.db import connection
+from django.db.models import QuerySet
 from logging_app.loguru_config import logger
+from requests.adapters import HTTPAdapter
 
-from .models import ExchangeRate
+from .matrix import BASE_CURRENCY, CURRENCY_CODES, RateMatrix
+from .models import ExchangeRate, RefreshLock
 
 API_KEY = config('EXCHANGE_API_KEY')
 ALTERNATIVE_API_KEY = config('CURRENCY_LAYER_API_KEY')
 
+EXCHANGE_API_URL = "https://api.apilayer.com/exchangerates_data/convert"
+EXCHANGE_RATES_API_URL = "https://api.apilayer.com/exchangerates_data/latest"
+ALTERNATIVE_API_URL = ("https://cdn.jsdelivr.net/gh/fawazahmed0/"
+                       "currency-api@1/latest/currencies/{base}/{target}.json")
+
+REQUEST_TIMEOUT = 10
+FETCH_BUDGET = 20
+FETCH_RETRIES = 2
+RETRY_BACKOFF = 0.5
+FETCH_WORKERS = 4
+
+REFRESH_LOCK_NAME = 'exchange_rates'
+REFRESH_LOCK_TIMEOUT = timedelta(minutes=2)
+# После неудачной загрузки блокировка держится ещё столько, чтобы во
+# время сбоя провайдера не обращаться к нему на каждом запросе
+REFRESH_FAILURE_BACKOFF = timedelta(minutes=5)
+
+_refresh_thread = None
+_refresh_thread_lock = threading.Lock()
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """
+    Общая сессия с пулом соединений: повторные запросы к провайдеру
+    не тратят время на новое TCP/TLS-рукопожатие.
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2,
+                                  pool_maxsize=FETCH_WORKERS)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _http_session = session
+    return _http_session
+
+
+def fetch_with_retries(fetch, *args, deadline, retries=FETCH_RETRIES):
+    for attempt in range(retries + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            result = fetch(*args, timeout=min(REQUEST_TIMEOUT, remaining))
+            if result:
+                return result
+        except requests.RequestException as error:
+            logger.error(f"Ошибка запроса курса {args}: {error}")
+        if attempt < retries:
+            # Полный джиттер, чтобы воркеры не повторяли запросы синхронно
+            delay = random.uniform(0, RETRY_BACKOFF * 2 ** attempt)
+            time.sleep(max(0, min(delay, deadline - time.monotonic())))
+    logger.error(f"Не удалось получить курс {args}")
+    return None
+
+
+def fetch_exchange_rates(budget=FETCH_BUDGET):
+    """
+    Запрашивает все курсы параллельно. Каждый запрос ограничен своим
+    таймаутом, а вся загрузка — общим бюджетом времени: незавершённые
+    к его концу запросы считаются неудачными.
+    """
+    deadline = time.monotonic() + budget
+    symbols = [code for code in CURRENCY_CODES if code != BASE_CURRENCY]
+    requested = {
+        'rates': (get_exchange_rates, BASE_CURRENCY, symbols),
+        'usd_to_rub_alternative': (
+            get_exchange_rate_from_alternative_api, "usd", "rub"
+        ),
+    }
+    executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+    try:
+        futures = {
+            name: executor.submit(fetch_with_retries, *call,
+                                  deadline=deadline)
+            for name, call in requested.items()
+        }
+        wait(futures.values(), timeout=budget)
+    finally:
+        executor.shutdown(wait=False)
+    return {
+        name: future.result() if future.done() else None
+        for name, future in futures.items()
+    }
+
 
 def update_exchange_rates():
     logger.info("Обновление обменных курсов начато")
-    usd_to_rub = get_exchange_rate("USD", "RUB")
-    mnt_to_rub = get_exchange_rate("RUB", "MNT")
-    mnt_to_usd = get_exchange_rate("USD", "MNT")
-    usd_to_rub_alternative = get_exchange_rate_from_alternative_api("usd", "rub")
+    rates = fetch_exchange_rates()
+    vector = rates['rates'] or {}
+    matrix = RateMatrix.from_vector(BASE_CURRENCY, vector)
+    usd_to_rub = matrix.rate("USD", "RUB")
+    mnt_to_rub = matrix.rate("RUB", "MNT")
+    mnt_to_usd = matrix.rate("USD", "MNT")
+    usd_to_rub_alternative = rates['usd_to_rub_alternative'] or 0
 
-    if usd_to_rub and mnt_to_rub:
+    if usd_to_rub and mnt_to_rub and mnt_to_usd:
         ExchangeRate.objects.create(
-            usd_to_rub=usd_to_rub,
-            mnt_to_rub=mnt_to_rub,
-            mnt_to_usd=mnt_to_usd,
-            usd_to_rub_alternative=usd_to_rub_alternative
+            usd_to_rub=float(usd_to_rub),
+            mnt_to_rub=float(mnt_to_rub),
+            mnt_to_usd=float(mnt_to_usd),
+            usd_to_rub_alternative=usd_to_rub_alternative,
+            base_currency=BASE_CURRENCY,
+            rates=json.dumps(vector)
         )
         logger.info("Обновление обменных курсов завершено")
-    else:
-        logger.error("Не завершено обновление обменных курсов")
+        return True
+    logger.error("Не завершено обновление обменных курсов")
+    return False
+
 
+def refresh_exchange_rates():
+    """
+    Обновляет курсы, только если они устарели и ни один другой процесс
+    уже не занят их загрузкой. Возвращает True, если загрузку выполнил
+    текущий вызов.
+    """
+    token = RefreshLock.acquire(REFRESH_LOCK_NAME, REFRESH_LOCK_TIMEOUT)
+    if token is None:
+        logger.info("Обновление курсов уже выполняется другим процессом")
+        return False
+    hold = REFRESH_FAILURE_BACKOFF
+    try:
+        if not ExchangeRate.needs_update():
+            hold = None
+            return False
+        if update_exchange_rates():
+            hold = None
+        return True
+    finally:
+        if hold:
+            logger.warning(f"Повтор обновления курсов не раньше чем "
+                           f"через {hold}")
+        RefreshLock.release(REFRESH_LOCK_NAME, token, hold=hold)
 
-def get_exchange_rate(base_currency, target_currency):
+
+def _refresh_in_background():
+    try:
+        refresh_exchange_rates()
+    except Exception:
+        logger.exception("Ошибка фонового обновления обменных курсов")
+    finally:
+        connection.close()
+
+
+def schedule_exchange_rate_refresh():
+    """
+    Запускает фоновое обновление курсов, не дожидаясь его окончания:
+    запрос обслуживается последними сохранёнными курсами.
+    """
+    global _refresh_thread
+    with _refresh_thread_lock:
+        if _refresh_thread is not None and _refresh_thread.is_alive():
+            return False
+        _refresh_thread = threading.Thread(
+            target=_refresh_in_background,
+            name='exchange-rate-refresh',
+            daemon=True
+        )
+        _refresh_thread.start()
+    return True
+
+
+def get_exchange_rates(base_currency, symbols, timeout=REQUEST_TIMEOUT,
+                       session=None):
+    """
+    Один запрос на весь вектор курсов базовой валюты: новая валюта в
+    CURRENCY_CHOICES не добавляет запросов к API.
+    """
+    logger.info(f"Отправка АПИ запроса курсов {base_currency} к {symbols}")
+    session = session or get_http_session()
+    response = session.get(
+        EXCHANGE_RATES_API_URL,
+        headers={"apikey": API_KEY},
+        params={"base": base_currency, "symbols": ",".join(symbols)},
+        timeout=timeout
+    )
+    if response.status_code != 200:
+        logger.error(f"Ошибка API при запросе курсов {base_currency}: "
+                     f"{response.status_code}")
+        return None
+    rates = response.json().get("rates") or None
+    logger.info(f"Получены курсы обмена для {base_currency}: {rates}")
+    return rates
+
+
+def get_exchange_rate(base_currency, target_currency,
+                      timeout=REQUEST_TIMEOUT, session=None):
     logger.info(f"Отправка АПИ запроса курса {base_currency} к {target_currency}")
-    API_URL = "https://api.apilayer.com/exchangerates_data/convert"
     headers = {
         "apikey": API_KEY
     }
@@ -41,7 +220,13 @@ def get_exchange_rate(base_currency, target_currency):
         "amount": 1
     }
 
-    response = requests.get(API_URL, headers=headers, params=params)
+    session = session or get_http_session()
+    response = session.get(
+        EXCHANGE_API_URL,
+        headers=headers,
+        params=params,
+        timeout=timeout
+    )
     response_data = response.json()
     if response.status_code != 200:
         logger.error(
@@ -54,17 +239,19 @@ def get_exchange_rate(base_currency, target_currency):
     return response_data.get("result", None)
 
 
-def get_exchange_rate_from_alternative_api(base_currency, target_currency):
+def get_exchange_rate_from_alternative_api(base_currency, target_currency,
+                                           timeout=REQUEST_TIMEOUT,
+                                           session=None):
     logger.info(
         f"Отправка альтернативного API запроса курса"
         f"{base_currency} к {target_currency}"
     )
 
-    API_URL = (f"https://cdn.jsdelivr.net/gh/fawazahmed0/"
-               f"currency-api@1/latest/currencies/{base_currency}/"
-               f"{target_currency}.json")
+    API_URL = ALTERNATIVE_API_URL.format(base=base_currency,
+                                         target=target_currency)
 
-    response = requests.get(API_URL)
+    session = session or get_http_session()
+    response = session.get(API_URL, timeout=timeout)
     try:
         response_data = response.json()
     except requests.exceptions.JSONDecodeError:
@@ -94,22 +281,11 @@ def get_required_amount_to_be_exchanged(offer):
     mnt_to_usd = latest_rate.mnt_to_usd
     logger.info(f"Расчет требуемой суммы обмена для предложения: {offer}")
 
-    required_amount = None
-    if offer.currency_offered.name == 'RUB':
-        if offer.currency_needed.name == 'USD':
-            required_amount = offer.amount_offered / Decimal(rub_to_usd)
-        elif offer.currency_needed.name == 'MNT':
-            required_amount = offer.amount_offered * Decimal(mnt_to_rub)
-    elif offer.currency_offered.name == 'MNT':
-        if offer.currency_needed.name == 'RUB':
-            required_amount = offer.amount_offered / Decimal(mnt_to_rub)
-        elif offer.currency_needed.name == 'USD':
-            required_amount = offer.amount_offered / Decimal(mnt_to_usd)
-    elif offer.currency_offered.name == 'USD':
-        if offer.currency_needed.name == 'RUB':
-            required_amount = offer.amount_offered * Decimal(rub_to_usd)
-        elif offer.currency_needed.name == 'MNT':
-            required_amount = offer.amount_offered * Decimal(mnt_to_usd)
+    required_amount = latest_rate.get_matrix().convert(
+        offer.amount_offered,
+        offer.currency_offered.code,
+        offer.currency_needed.code
+    )
 
     if required_amount is None:
         logger.error(f"Ошибка при расчете требуемой "
@@ -122,3 +298,39 @@ def get_required_amount_to_be_exchanged(offer):
         'mnt_to_usd': mnt_to_usd,
         'required_amount': required_amount
     }
+
+
+def get_required_amounts(offers, matrix=None):
+    """
+    Требуемые суммы для страницы или queryset предложений за один проход
+    по таблице курсов. Queryset читается через values_list без создания
+    моделей. Возвращает {offer.id: сумма или None}.
+    """
+    if matrix is None:
+        try:
+            matrix = ExchangeRate.latest().get_matrix()
+        except ExchangeRate.DoesNotExist:
+            logger.error("Ошибка: не удалось получить последние "
+                         "курсы обмена валют")
+            return {}
+
+    if isinstance(offers, QuerySet):
+        rows = offers.values_list(
+            'id', 'amount_offered',
+            'currency_offered__code', 'currency_needed__code'
+        ).order_by().iterator()
+    else:
+        rows = (
+            (offer.id, offer.amount_offered,
+             offer.currency_offered.code, offer.currency_needed.code)
+            for offer in offers
+        )
+    return matrix.convert_batch(rows)
+
+
+def attach_required_amounts(offers, matrix=None):
+    """Проставляет `required_amount` каждому предложению страницы."""
+    amounts = get_required_amounts(offers, matrix)
+    for offer in offers:
+        offer.required_amount = amounts.get(offer.id)
+    return offers
@@ -0,0 +1,26 @@
+from django.contrib import admin
+
+from .models import OutboxMessage
+from .outbox import requeue_dead
+
+
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'channel', 'status', 'attempts', 'next_attempt_at', 'sent_at'
+    )
+    list_filter = (
+        'status', 'channel'
+    )
+    readonly_fields = (
+        'channel', 'payload', 'attempts', 'last_error', 'created_at',
+        'sent_at'
+    )
+    actions = ['retry_dead']
+
+    def retry_dead(self, request, queryset):
+        count = requeue_dead(queryset)
+        self.message_user(request, f"{count} messages queued again.")
+    retry_dead.short_description = 'Retry dead messages'
+
+
+admin.site.register(OutboxMessage, OutboxMessageAdmin)
@@ -0,0 +1,8 @@
+from .inbox import unread_count
+
+
+def inbox(request):
+    """Счётчик входящих для шапки; считается, только если шаблон его выводит."""
+    if not request.user.is_authenticated:
+        return {}
+    return {'inbox_unread': lambda: unread_count(request.user)}
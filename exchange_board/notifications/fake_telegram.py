@@ -0,0 +1,100 @@
+import json
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class FakeTelegramAPI:
+    """
+    Локальная замена Bot API для тестов и бенчмарков: принимает
+    sendMessage и, как настоящий Telegram, отвечает 429 с retry_after,
+    если в чат пришло больше `limit` сообщений за `period` секунд.
+
+        with FakeTelegramAPI(limit=20, period=1) as api:
+            TelegramSender('token', api_url=api.url).send_message(1, 'hi')
+    """
+
+    def __init__(self, limit=None, period=1.0, latency=0.0,
+                 integer_retry_after=True):
+        self.limit = limit
+        self.period = period
+        self.latency = latency
+        self.integer_retry_after = integer_retry_after
+        self.messages = []
+        self.rejected = 0
+        self.sent_at = defaultdict(deque)
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                          self.make_handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def accept(self, chat_id, text):
+        """Возвращает (код ответа, тело) для одного sendMessage."""
+        with self.lock:
+            now = time.monotonic()
+            recent = self.sent_at[chat_id]
+            while recent and recent[0] <= now - self.period:
+                recent.popleft()
+            if self.limit is not None and len(recent) >= self.limit:
+                self.rejected += 1
+                wait = recent[0] + self.period - now
+                if self.integer_retry_after:
+                    wait = max(1, math.ceil(wait))
+                return 429, {
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f'Too Many Requests: retry after {wait}',
+                    'parameters': {'retry_after': wait},
+                }
+            recent.append(now)
+            self.messages.append((chat_id, text))
+            return 200, {
+                'ok': True,
+                'result': {'message_id': len(self.messages),
+                           'chat': {'id': chat_id}, 'text': text},
+            }
+
+    def make_handler(self):
+        api = self
+
+        class FakeTelegramHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                form = parse_qs(self.rfile.read(length).decode())
+                time.sleep(api.latency)
+                if self.path.endswith('/sendMessage'):
+                    status, body = api.accept(form.get('chat_id', [''])[0],
+                                              form.get('text', [''])[0])
+                else:
+                    status, body = 404, {'ok': False, 'error_code': 404,
+                                         'description': 'Not Found'}
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return FakeTelegramHandler
@@ -0,0 +1,234 @@
+import heapq
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from logging_app.loguru_config import logger
+from offers.models import Offer
+from requests_for_transaction.models import RequestForTransaction
+from users.models import CustomUser, UserFollow
+
+from .models import InboxItem
+
+INBOX_DAYS = 30
+INBOX_PAGE_SIZE = 50
+COUNTER_TIMEOUT = 60 * 60
+PULLED_KEEP = 100
+
+
+def fan_out_limit():
+    return getattr(settings, 'INBOX_FAN_OUT_LIMIT', 10000)
+
+
+def inbox_since():
+    return timezone.now() - timedelta(days=INBOX_DAYS)
+
+
+def counter_key(user_id):
+    return f'inbox:unread:{user_id}'
+
+
+def pushed_key(user_id):
+    # Отдельным целым ключом, чтобы наращивать его атомарным cache.incr
+    return f'inbox:pushed:{user_id}'
+
+
+def pulled_key(author_id):
+    return f'inbox:pulled:{author_id}'
+
+
+def fan_out_offer(offer):
+    """
+    Раскладывает новое предложение во входящие подписчиков автора одним
+    bulk_create. Если подписчиков больше INBOX_FAN_OUT_LIMIT, строки не
+    пишутся: предложение помечается fan_out_on_read и подмешивается при
+    чтении. Вызывается в транзакции создания предложения, счётчики
+    в кэше обновляются после её фиксации. Возвращает число строк.
+    """
+    limit = fan_out_limit()
+    follower_ids = list(UserFollow.objects.filter(
+        author_id=offer.author_id
+    ).values_list('user_id', flat=True)[:limit + 1])
+    if len(follower_ids) > limit:
+        Offer.objects.filter(id=offer.id).update(fan_out_on_read=True)
+        offer.fan_out_on_read = True
+        transaction.on_commit(
+            lambda: remember_pulled(offer.author_id, offer.publishing_date)
+        )
+        logger.info(f"Предложение {offer.id}: больше {limit} подписчиков, "
+                    f"входящие собираются при чтении")
+        return 0
+    InboxItem.objects.bulk_create([
+        InboxItem(user_id=user_id, offer_id=offer.id,
+                  created_at=offer.publishing_date)
+        for user_id in follower_ids
+    ])
+    transaction.on_commit(lambda: bump_counters(follower_ids))
+    return len(follower_ids)
+
+
+def bump_counters(user_ids):
+    """
+    +1 к закэшированным счётчикам подписчиков через cache.incr, чтобы
+    параллельные раскладки не теряли приращения. Отсутствующие в кэше
+    счётчики не создаются — их посчитает первое чтение.
+    """
+    for user_id in user_ids:
+        try:
+            cache.incr(pushed_key(user_id))
+        except ValueError:
+            pass
+
+
+def remember_pulled(author_id, published_at):
+    key = pulled_key(author_id)
+    times = cache.get(key)
+    # Без записи в кэше время загрузится из БД при первом чтении
+    if times is not None:
+        times = (times + [published_at])[-PULLED_KEEP:]
+        cache.set(key, times, COUNTER_TIMEOUT)
+
+
+def pulled_times(author_ids):
+    """
+    Времена публикации предложений с fan_out_on_read по авторам:
+    {author_id: [дата, ...]}. Из кэша, недостающее — одним запросом.
+    """
+    keys = {author_id: pulled_key(author_id) for author_id in author_ids}
+    cached = cache.get_many(keys.values())
+    times = {author_id: cached[key] for author_id, key in keys.items()
+             if key in cached}
+    missing = [author_id for author_id in author_ids
+               if author_id not in times]
+    if missing:
+        loaded = {author_id: [] for author_id in missing}
+        rows = Offer.objects.filter(
+            author_id__in=missing,
+            fan_out_on_read=True,
+            publishing_date__gte=inbox_since()
+        ).order_by('publishing_date').values_list(
+            'author_id', 'publishing_date'
+        )
+        for author_id, published_at in rows:
+            loaded[author_id].append(published_at)
+        loaded = {author_id: dates[-PULLED_KEEP:]
+                  for author_id, dates in loaded.items()}
+        cache.set_many({keys[author_id]: dates
+                        for author_id, dates in loaded.items()},
+                       COUNTER_TIMEOUT)
+        times.update(loaded)
+    return times
+
+
+def load_counter(user):
+    """Счётчик непрочитанного из БД; кэшируется до COUNTER_TIMEOUT."""
+    read_at = max(user.inbox_read_at or inbox_since(), inbox_since())
+    entry = {
+        'pushed': InboxItem.objects.filter(
+            user=user, created_at__gt=read_at
+        ).count(),
+        'read_at': read_at,
+        'authors': list(UserFollow.objects.filter(
+            user=user
+        ).values_list('author_id', flat=True)),
+    }
+    cache.set_many({
+        counter_key(user.id): {'read_at': entry['read_at'],
+                               'authors': entry['authors']},
+        pushed_key(user.id): entry['pushed'],
+    }, COUNTER_TIMEOUT)
+    return entry
+
+
+def unread_count(user):
+    """
+    Число непрочитанных во входящих. При тёплом кэше — без запросов
+    к БД: счётчик разложенных предложений плюс предложения подписок
+    с fan_out_on_read новее последнего прочтения.
+    """
+    keys = (counter_key(user.id), pushed_key(user.id))
+    cached = cache.get_many(keys)
+    if len(cached) == len(keys):
+        entry = dict(cached[keys[0]], pushed=cached[keys[1]])
+    else:
+        entry = load_counter(user)
+    times = pulled_times(entry['authors'])
+    pulled = sum(
+        1
+        for author_id in entry['authors']
+        for published_at in times.get(author_id, ())
+        if published_at > entry['read_at']
+    )
+    return entry['pushed'] + pulled
+
+
+def mark_read(user):
+    now = timezone.now()
+    CustomUser.objects.filter(id=user.id).update(inbox_read_at=now)
+    user.inbox_read_at = now
+    cache.delete_many([counter_key(user.id), pushed_key(user.id)])
+
+
+def following_changed(user_id, unfollowed_author_id=None):
+    """
+    Подписки пользователя изменились: счётчик пересчитается при чтении,
+    а после отписки из входящих убираются предложения бывшего автора.
+    """
+    if unfollowed_author_id is not None:
+        InboxItem.objects.filter(
+            user_id=user_id,
+            offer__author_id=unfollowed_author_id
+        ).delete()
+    cache.delete_many([counter_key(user_id), pushed_key(user_id)])
+
+
+def inbox_offers(user, limit=INBOX_PAGE_SIZE):
+    """
+    Последние предложения подписок: разложенные строки InboxItem
+    сливаются с предложениями авторов с fan_out_on_read по дате.
+    """
+    since = inbox_since()
+    pushed = InboxItem.objects.filter(
+        user=user,
+        created_at__gte=since
+    ).order_by('-created_at').values_list('offer_id', 'created_at')[:limit]
+    pulled = Offer.objects.filter(
+        fan_out_on_read=True,
+        author__following__user=user,
+        publishing_date__gte=since
+    ).order_by('-publishing_date').values_list(
+        'id', 'publishing_date'
+    )[:limit]
+
+    offer_ids = []
+    for offer_id, created_at in heapq.merge(
+        pushed, pulled, key=lambda row: row[1], reverse=True
+    ):
+        if offer_id not in offer_ids:
+            offer_ids.append(offer_id)
+        if len(offer_ids) == limit:
+            break
+    offers = Offer.objects.select_related(
+        'author',
+        'currency_offered',
+        'currency_needed',
+        'transaction',
+        'transaction__accepting_user',
+    ).annotate(
+        has_requests=Exists(RequestForTransaction.objects.filter(
+            offer=OuterRef('pk')
+        ))
+    ).in_bulk(offer_ids)
+    return [offers[offer_id] for offer_id in offer_ids
+            if offer_id in offers]
+
+
+def prune_inbox(days=INBOX_DAYS):
+    """Удаляет строки входящих старше `days` дней."""
+    deleted, _ = InboxItem.objects.filter(
+        created_at__lt=timezone.now() - timedelta(days=days)
+    ).delete()
+    return deleted
@@ -0,0 +1,147 @@
+from datetime import timedelta
+from functools import lru_cache
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.template.loader import get_template
+from django.utils import timezone
+from logging_app.loguru_config import logger
+from offers.models import OPEN, Offer
+from requests_for_transaction.models import RequestForTransaction
+
+from .models import OutboxMessage
+
+EMAIL_BATCH_SIZE = 100
+MISSED_OFFERS_LIMIT = 10
+
+
+@lru_cache(maxsize=None)
+def compiled_template(name):
+    """Шаблон письма разбирается один раз на процесс."""
+    return get_template(name)
+
+
+def render_email(name, context):
+    """Тема и текст письма из notifications/email/<name>[_subject].txt."""
+    subject = compiled_template(
+        f'notifications/email/{name}_subject.txt'
+    ).render(context)
+    body = compiled_template(f'notifications/email/{name}.txt').render(context)
+    return ' '.join(subject.split()), body.strip() + '\n'
+
+
+def queue_email(name, context, recipients):
+    """Ставит письмо из шаблона в outbox (внутри транзакции изменения)."""
+    subject, body = render_email(name, context)
+    return OutboxMessage.enqueue_email(subject, body, recipients)
+
+
+def build_email(name, context, to):
+    subject, body = render_email(name, context)
+    return EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, to)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def send_batches(messages, batch_size=EMAIL_BATCH_SIZE, connection=None):
+    """
+    Отправляет письма пачками по `batch_size` через одно соединение
+    с почтовым сервисом. `messages` может быть генератором: в памяти
+    держится только текущая пачка. Возвращает число отправленных писем.
+    """
+    connection = connection or get_connection()
+    sent = 0
+    with connection:
+        for batch in chunked(messages, batch_size):
+            sent += connection.send_messages(batch) or 0
+            logger.info(f"Отправлена пачка писем: {len(batch)}")
+    return sent
+
+
+def missed_offers_emails(since, days, mailed_before=None):
+    """
+    Письма «предложения, которые вы пропустили»: открытые предложения,
+    опубликованные после `since`, кроме своих и тех, на которые
+    пользователь уже откликнулся. Пользователи, которым письмо ушло
+    позже `mailed_before`, пропускаются. Предложения и отклики читаются
+    по одному разу, пользователи — потоком. Отдаёт пары
+    (id пользователя, OutboxMessage без сохранения).
+    """
+    offers = list(Offer.objects.filter(
+        status=OPEN,
+        publishing_date__gte=since
+    ).select_related(
+        'author', 'currency_offered', 'currency_needed'
+    ).order_by('-publishing_date'))
+    if not offers:
+        return
+    applied = {}
+    for applicant_id, offer_id in RequestForTransaction.objects.filter(
+        offer__in=offers
+    ).values_list('applicant_id', 'offer_id'):
+        applied.setdefault(applicant_id, set()).add(offer_id)
+
+    site_url = f"https://{settings.SITE_DOMAIN}"
+    users = get_user_model().objects.filter(
+        is_active=True,
+        is_email_confirmed=True
+    ).exclude(email='').only('id', 'username', 'email').order_by('id')
+    if mailed_before is not None:
+        users = users.filter(
+            Q(missed_offers_sent_at__isnull=True)
+            | Q(missed_offers_sent_at__lt=mailed_before)
+        )
+    for user in users.iterator(chunk_size=2000):
+        skipped = applied.get(user.id, ())
+        missed = [offer for offer in offers
+                  if offer.author_id != user.id and offer.id not in skipped]
+        if not missed:
+            continue
+        subject, body = render_email('missed_offers', {
+            'username': user.username,
+            'offers': missed[:MISSED_OFFERS_LIMIT],
+            'more': max(0, len(missed) - MISSED_OFFERS_LIMIT),
+            'total': len(missed),
+            'days': days,
+            'site_url': site_url,
+        })
+        yield user.id, OutboxMessage.build_email(subject, body, [user.email])
+
+
+def queue_missed_offers_digest(days=7, batch_size=EMAIL_BATCH_SIZE):
+    """
+    Ставит письма о пропущенных предложениях в outbox: отправляет их
+    run_outbox, с повтором каждого письма отдельно. Пачка писем и отметка
+    missed_offers_sent_at у её получателей пишутся в одной транзакции,
+    поэтому повторный запуск после сбоя не пишет тем, кому письмо уже
+    поставлено. Повтором считается запуск в пределах половины окна
+    `days`: следующий плановый запуск пишет всем снова.
+    """
+    now = timezone.now()
+    since = now - timedelta(days=days)
+    mailed_before = now - timedelta(days=days) / 2
+    queued = 0
+    for batch in chunked(missed_offers_emails(since, days, mailed_before),
+                         batch_size):
+        with transaction.atomic():
+            OutboxMessage.objects.bulk_create(
+                [message for user_id, message in batch]
+            )
+            get_user_model().objects.filter(
+                id__in=[user_id for user_id, message in batch]
+            ).update(missed_offers_sent_at=now)
+        queued += len(batch)
+        logger.info(f"В очередь поставлена пачка писем: {len(batch)}")
+    logger.info(f"Письма о пропущенных предложениях в очереди: {queued}")
+    return queued
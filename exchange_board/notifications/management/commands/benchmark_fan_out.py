@@ -0,0 +1,105 @@
+import time
+
+from bank_details.models import Currency
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from offers.models import Offer
+from users.models import CustomUser, UserFollow
+
+from notifications.inbox import (bump_counters, counter_key, fan_out_offer,
+                                 inbox_offers, load_counter, pushed_key,
+                                 unread_count)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Measures fan-out of a new offer to the inboxes of an author "
+            "with many followers (write and read paths). Test data is "
+            "created inside a transaction that is rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--followers', type=int, default=50000)
+
+    def measure(self, label, function):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - started
+        self.stdout.write(f"{label:>28}: {elapsed * 1000:9.1f} ms, "
+                          f"{len(context):3} queries")
+        return result
+
+    def create_followers(self, count):
+        author = CustomUser.objects.create(
+            username='bench-author', email='bench-author@bench.local',
+            password='!', referral_code='bench'
+        )
+        CustomUser.objects.bulk_create([
+            CustomUser(username=f'bench-{number}',
+                       email=f'bench-{number}@bench.local',
+                       password='!',
+                       referral_code=f'bench-{number}')
+            for number in range(count)
+        ])
+        followers = list(CustomUser.objects.filter(
+            username__startswith='bench-'
+        ).exclude(id=author.id).values_list('id', flat=True))
+        UserFollow.objects.bulk_create([
+            UserFollow(user_id=user_id, author=author)
+            for user_id in followers
+        ])
+        return author, followers
+
+    def publish(self, author, currency):
+        return Offer.objects.create(author=author, currency_offered=currency,
+                                    amount_offered=100,
+                                    currency_needed=currency)
+
+    def handle(self, *args, **options):
+        count = options['followers']
+        try:
+            with transaction.atomic():
+                self.run(count)
+                raise Rollback
+        except Rollback:
+            self.stdout.write("Benchmark data rolled back.")
+
+    def run(self, count):
+        currency, _ = Currency.objects.get_or_create(
+            code='USD', defaults={'name': 'US Dollar'}
+        )
+        author, followers = self.measure(
+            f'create {count} followers',
+            lambda: self.create_followers(count)
+        )
+        reader = CustomUser.objects.get(id=followers[0])
+
+        with override_settings(INBOX_FAN_OUT_LIMIT=count):
+            offer = self.publish(author, currency)
+            written = self.measure('fan-out on write',
+                                   lambda: fan_out_offer(offer))
+        self.stdout.write(f"{'':>28}  {written} inbox rows")
+        cache.set_many({pushed_key(user_id): 0 for user_id in followers})
+        self.measure('bump cached counters',
+                     lambda: bump_counters(followers))
+
+        with override_settings(INBOX_FAN_OUT_LIMIT=count - 1):
+            offer = self.publish(author, currency)
+            self.measure('fan-out on read (write)',
+                         lambda: fan_out_offer(offer))
+
+        cache.delete_many([counter_key(reader.id), pushed_key(reader.id)])
+        self.measure('unread counter, cold', lambda: load_counter(reader))
+        # Первое чтение загружает в кэш даты предложений автора
+        self.measure('unread counter, first read',
+                     lambda: unread_count(reader))
+        unread = self.measure('unread counter, cached',
+                              lambda: unread_count(reader))
+        offers = self.measure('inbox page', lambda: inbox_offers(reader))
+        self.stdout.write(f"{'':>28}  {unread} unread, "
+                          f"{len(offers)} offers in inbox")
@@ -0,0 +1,85 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand
+
+from notifications.fake_telegram import FakeTelegramAPI
+from notifications.telegram import TelegramError, TelegramSender
+from notifications.views import new_offers_digest
+
+CHAT_ID = '-100'
+
+
+def send_naively(api, text):
+    # Прежнее поведение: новое соединение на каждое сообщение, 429 только
+    # логируется, и сообщение теряется
+    response = requests.post(f"{api.url}/bottoken/sendMessage",
+                             data={'chat_id': CHAT_ID, 'text': text},
+                             timeout=10)
+    return response.ok
+
+
+def send_with_sender(sender, text):
+    try:
+        sender.send_message(CHAT_ID, text)
+    except TelegramError:
+        return False
+    return True
+
+
+class Command(BaseCommand):
+    help = ("Sends a burst of messages to a local fake Telegram API with "
+            "per-chat limits, once with plain requests.post and once with "
+            "the rate-limited sender, and shows how many new-offer "
+            "messages a digest saves.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=60)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--limit', type=int, default=20,
+                            help='Messages the fake API accepts per period.')
+        parser.add_argument('--period', type=float, default=1.0,
+                            help='Fake API limit period in seconds.')
+        parser.add_argument('--latency', type=float, default=0.02)
+
+    def run(self, label, api, send, count, workers):
+        texts = [f'message {number}' for number in range(count)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(send, texts))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{label:>10}: delivered {results.count(True)}/{count}, "
+            f"429 responses {api.rejected}, {elapsed:.2f} s, "
+            f"{results.count(True) / elapsed:.1f} msg/s"
+        )
+
+    def handle(self, *args, **options):
+        count = options['messages']
+        workers = options['workers']
+        fake = dict(limit=options['limit'], period=options['period'],
+                    latency=options['latency'])
+
+        with FakeTelegramAPI(**fake) as api:
+            self.run('naive', api, lambda text: send_naively(api, text),
+                     count, workers)
+
+        with FakeTelegramAPI(**fake) as api:
+            # Ведро с запасом 1 не превышает лимит ни в одном окне
+            sender = TelegramSender(
+                'token',
+                api_url=api.url,
+                rate=(options['limit'] - 1) / options['period'],
+                burst=1,
+            )
+            self.run('sender', api,
+                     lambda text: send_with_sender(sender, text),
+                     count, workers)
+
+        summaries = [f"user{number} sells 100 USD for MNT: offer № {number}"
+                     for number in range(count)]
+        self.stdout.write(
+            f"{'digest':>10}: {count} new offers in one window -> "
+            f"{len(new_offers_digest(summaries))} message(s)"
+        )
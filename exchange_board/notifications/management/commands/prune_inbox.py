@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from notifications.inbox import INBOX_DAYS, prune_inbox
+
+
+class Command(BaseCommand):
+    help = "Deletes inbox entries older than the inbox window."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=INBOX_DAYS)
+
+    def handle(self, *args, **options):
+        deleted = prune_inbox(options['days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} inbox entries."
+        ))
@@ -0,0 +1,45 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from notifications.outbox import drain
+
+
+class Command(BaseCommand):
+    help = ("Sends queued email and Telegram notifications from the outbox "
+            "table with a bounded pool of worker threads. Failed messages "
+            "are retried with exponential backoff and marked dead after "
+            "too many attempts.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--poll-interval', type=float, default=2.0)
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Send everything that is due and exit.'
+        )
+
+    def handle(self, *args, **options):
+        totals = {}
+        with ThreadPoolExecutor(max_workers=options['workers'],
+                                thread_name_prefix='outbox') as executor:
+            while True:
+                results = drain(executor, options['batch_size'])
+                for status, count in results.items():
+                    totals[status] = totals.get(status, 0) + count
+                if results:
+                    continue
+                if options['once']:
+                    break
+                # Между опросами не держим соединение с БД открытым
+                connection.close()
+                time.sleep(options['poll_interval'])
+        self.stdout.write(self.style.SUCCESS(
+            ', '.join(f"{status}: {count}"
+                      for status, count in sorted(totals.items()))
+            or 'Outbox is empty.'
+        ))
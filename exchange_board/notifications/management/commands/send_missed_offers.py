@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from notifications.mail import EMAIL_BATCH_SIZE, queue_missed_offers_digest
+
+
+class Command(BaseCommand):
+    help = ("Queues an email to every confirmed user listing the open offers "
+            "published in the last days that they have not applied to. "
+            "The run_outbox worker sends them; users already queued by an "
+            "earlier run in the same window are skipped, so a failed run "
+            "can simply be repeated. Run it weekly from cron.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7)
+        parser.add_argument('--batch-size', type=int,
+                            default=EMAIL_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        queued = queue_missed_offers_digest(options['days'],
+                                            options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Queued {queued} emails."))
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.19 on 2026-10-18 10:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='digest_key',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
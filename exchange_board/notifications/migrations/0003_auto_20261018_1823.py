@@ -0,0 +1,30 @@
+# Generated by Django 2.2.19 on 2026-10-18 10:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0006_offer_fan_out_on_read'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notifications', '0002_outboxmessage_digest_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboxItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('offer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='offers.Offer')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_items', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='inboxitem',
+            index=models.Index(fields=['user', 'created_at'], name='inbox_user_time_idx'),
+        ),
+    ]
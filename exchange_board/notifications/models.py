@@ -0,0 +1,126 @@
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+EMAIL = 'email'
+TELEGRAM = 'telegram'
+
+CHANNEL_CHOICES = [
+    (EMAIL, 'Email'),
+    (TELEGRAM, 'Telegram'),
+]
+
+PENDING = 'pending'
+SENT = 'sent'
+DEAD = 'dead'
+
+OUTBOX_STATUS_CHOICES = [
+    (PENDING, 'Pending'),
+    (SENT, 'Sent'),
+    (DEAD, 'Dead'),
+]
+
+
+class OutboxMessage(models.Model):
+    """
+    Уведомление, ожидающее отправки. Запись создаётся в той же транзакции
+    БД, что и изменение, о котором оно сообщает: откат отменяет и письмо,
+    а фиксация гарантирует, что воркер его когда-нибудь отправит.
+    """
+    channel = models.CharField(max_length=8, choices=CHANNEL_CHOICES)
+    # JSONField в Django 2.2 есть только для PostgreSQL
+    payload = models.TextField()
+    status = models.CharField(
+        max_length=7,
+        choices=OUTBOX_STATUS_CHOICES,
+        default=PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # Срок, до которого сообщение захвачено воркером
+    locked_until = models.DateTimeField(null=True, blank=True)
+    claim_token = models.CharField(max_length=32, blank=True)
+    # Сообщения с одним ключом, готовые одновременно, уходят одной сводкой
+    digest_key = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'],
+                         name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.channel} #{self.id} ({self.status})"
+
+    @property
+    def data(self):
+        return json.loads(self.payload)
+
+    @classmethod
+    def build(cls, channel, digest_key='', delay=0, **data):
+        """Несохранённое сообщение — для bulk_create пачкой."""
+        return cls(
+            channel=channel,
+            payload=json.dumps(data),
+            digest_key=digest_key,
+            next_attempt_at=timezone.now() + timedelta(seconds=delay),
+        )
+
+    @classmethod
+    def enqueue(cls, channel, digest_key='', delay=0, **data):
+        message = cls.build(channel, digest_key, delay, **data)
+        message.save()
+        return message
+
+    @classmethod
+    def build_email(cls, subject, body, recipients):
+        return cls.build(EMAIL, subject=subject, body=body,
+                         recipients=list(recipients))
+
+    @classmethod
+    def enqueue_email(cls, subject, body, recipients):
+        message = cls.build_email(subject, body, recipients)
+        message.save()
+        return message
+
+    @classmethod
+    def enqueue_telegram(cls, text, digest_key='', summary='', delay=0):
+        """
+        `summary` — строка для сводки: если за время `delay` накопится
+        несколько сообщений с тем же `digest_key`, в канал уйдёт одно
+        сообщение из их строк вместо отдельных `text`.
+        """
+        return cls.enqueue(TELEGRAM, digest_key=digest_key, delay=delay,
+                           text=text, summary=summary)
+
+
+class InboxItem(models.Model):
+    """
+    Предложение автора, на которого подписан пользователь. Строки
+    создаются одной пачкой при публикации (fan-out при записи); для
+    авторов с очень большим числом подписчиков строк нет, и их
+    предложения подмешиваются при чтении.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='inbox_items'
+    )
+    offer = models.ForeignKey(
+        'offers.Offer',
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'],
+                         name='inbox_user_time_idx'),
+        ]
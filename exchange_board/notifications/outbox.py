@@ -0,0 +1,239 @@
+import random
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+from logging_app.loguru_config import logger
+
+from .mail import chunked
+from .models import DEAD, EMAIL, PENDING, SENT, TELEGRAM, OutboxMessage
+from .telegram import RateLimited
+from .views import DIGESTS, send_telegram_notification
+
+MAX_ATTEMPTS = 8
+BASE_DELAY = 30
+MAX_DELAY = 6 * 60 * 60
+LEASE_SECONDS = 5 * 60
+EMAILS_PER_CONNECTION = 10
+
+
+class DeliveryError(Exception):
+    pass
+
+
+def retry_delay(attempts):
+    """Экспоненциальная пауза перед повтором с разбросом ±20%."""
+    delay = min(MAX_DELAY, BASE_DELAY * 2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def due_messages(now):
+    return OutboxMessage.objects.filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lt=now),
+        status=PENDING,
+        next_attempt_at__lte=now,
+    )
+
+
+def claim_batch(limit, lease=LEASE_SECONDS):
+    """
+    Захватывает до `limit` готовых к отправке сообщений. Захват — условный
+    UPDATE по тем же условиям, поэтому два воркера не получат одно
+    сообщение; если воркер упал, сообщение освободится по истечении lease.
+    Вместе с первым сообщением сводки захватываются и остальные с тем же
+    digest_key, даже если их окно ещё не истекло.
+    """
+    now = timezone.now()
+    ids = list(due_messages(now).order_by(
+        'next_attempt_at', 'id'
+    ).values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    claim = {'locked_until': now + timedelta(seconds=lease),
+             'claim_token': token}
+    due_messages(now).filter(id__in=ids).update(**claim)
+    digest_keys = set(OutboxMessage.objects.filter(
+        claim_token=token
+    ).exclude(digest_key='').values_list('digest_key', flat=True))
+    if digest_keys:
+        OutboxMessage.objects.filter(
+            Q(locked_until__isnull=True) | Q(locked_until__lt=now),
+            status=PENDING,
+            digest_key__in=digest_keys,
+        ).update(**claim)
+    return list(OutboxMessage.objects.filter(claim_token=token).order_by(
+        'created_at', 'id'
+    ))
+
+
+def group_batch(batch):
+    """
+    Разбивает пачку на единицы отправки: письма — группами по
+    EMAILS_PER_CONNECTION (одно соединение на группу), сообщения
+    сводок — по ключу, остальное поодиночке.
+    """
+    units = []
+    emails = []
+    digests = {}
+    for message in batch:
+        if message.digest_key:
+            digests.setdefault(message.digest_key, []).append(message)
+        elif message.channel == EMAIL:
+            emails.append(message)
+        else:
+            units.append([message])
+    units.extend(chunked(emails, EMAILS_PER_CONNECTION))
+    return units + list(digests.values())
+
+
+def deliver(message, mail_connection=None):
+    data = message.data
+    if message.channel == EMAIL:
+        EmailMessage(
+            data['subject'],
+            data['body'],
+            settings.DEFAULT_FROM_EMAIL,
+            data['recipients'],
+            connection=mail_connection,
+        ).send()
+    elif message.channel == TELEGRAM:
+        if not send_telegram_notification(data['text']):
+            raise DeliveryError('Telegram API rejected the message')
+    else:
+        raise DeliveryError(f'Unknown channel {message.channel}')
+
+
+def deliver_digest(messages):
+    render = DIGESTS[messages[0].digest_key]
+    for text in render([message.data['summary'] for message in messages]):
+        if not send_telegram_notification(text):
+            raise DeliveryError('Telegram API rejected the digest')
+
+
+def record_failure(messages, error):
+    ids = [message.id for message in messages]
+    attempts = max(message.attempts for message in messages) + 1
+    if attempts >= MAX_ATTEMPTS:
+        status = DEAD
+        logger.error(f"Уведомления {ids} не отправлены после "
+                     f"{attempts} попыток: {error!r}")
+    else:
+        status = PENDING
+        logger.warning(f"Уведомления {ids} не отправлены "
+                       f"(попытка {attempts}): {error!r}")
+    OutboxMessage.objects.filter(id__in=ids).update(
+        status=status,
+        attempts=F('attempts') + 1,
+        next_attempt_at=timezone.now() + retry_delay(attempts),
+        locked_until=None,
+        claim_token='',
+        last_error=repr(error),
+    )
+    return status
+
+
+def record_throttled(messages, delay):
+    """
+    Сообщения упёрлись в наш же лимит скорости и не уходили в Telegram:
+    откладываем их на `delay` секунд, не засчитывая попытку.
+    """
+    OutboxMessage.objects.filter(
+        id__in=[message.id for message in messages]
+    ).update(
+        next_attempt_at=timezone.now() + timedelta(seconds=delay),
+        locked_until=None,
+        claim_token='',
+    )
+    return PENDING
+
+
+def record_sent(messages):
+    OutboxMessage.objects.filter(
+        id__in=[message.id for message in messages]
+    ).update(
+        status=SENT,
+        attempts=F('attempts') + 1,
+        sent_at=timezone.now(),
+        locked_until=None,
+        claim_token='',
+    )
+    return SENT
+
+
+def process_messages(messages, mail_connection=None):
+    """
+    Отправляет сообщение (или сводку из нескольких сообщений) и записывает
+    результат. Возвращает статус.
+    """
+    try:
+        if len(messages) == 1:
+            deliver(messages[0], mail_connection)
+        else:
+            deliver_digest(messages)
+    except RateLimited as error:
+        return record_throttled(messages, error.delay)
+    except Exception as error:
+        return record_failure(messages, error)
+    return record_sent(messages)
+
+
+def process_emails(messages):
+    """
+    Письма группы уходят через одно открытое соединение с почтовым
+    сервисом, но результат у каждого письма свой.
+    """
+    results = {}
+    mail_connection = get_connection()
+    try:
+        mail_connection.open()
+    except Exception as error:
+        for message in messages:
+            status = record_failure([message], error)
+            results[status] = results.get(status, 0) + 1
+        return results
+    try:
+        for message in messages:
+            status = process_messages([message], mail_connection)
+            results[status] = results.get(status, 0) + 1
+    finally:
+        mail_connection.close()
+    return results
+
+
+def _process_in_worker(messages):
+    try:
+        if messages[0].channel == EMAIL and not messages[0].digest_key:
+            return process_emails(messages)
+        return {process_messages(messages): len(messages)}
+    finally:
+        connection.close()
+
+
+def drain(executor, batch_size=50):
+    """
+    Один проход: захватить пачку и отправить её в пуле `executor`.
+    Возвращает {статус: число сообщений}.
+    """
+    units = group_batch(claim_batch(batch_size))
+    results = {}
+    for unit_results in executor.map(_process_in_worker, units):
+        for status, count in unit_results.items():
+            results[status] = results.get(status, 0) + count
+    return results
+
+
+def requeue_dead(queryset=None):
+    """Возвращает мёртвые сообщения в очередь с обнулёнными попытками."""
+    if queryset is None:
+        queryset = OutboxMessage.objects.all()
+    return queryset.filter(status=DEAD).update(
+        status=PENDING,
+        attempts=0,
+        next_attempt_at=timezone.now(),
+        last_error='',
+    )
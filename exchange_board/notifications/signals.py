@@ -0,0 +1,10 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from .inbox import load_counter
+
+
+@receiver(user_logged_in)
+def warm_inbox_counter(sender, request, user, **kwargs):
+    # Счётчик в шапке дальше читается из кэша без запросов
+    load_counter(user)
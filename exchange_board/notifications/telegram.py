@@ -0,0 +1,173 @@
+import threading
+import time
+
+import requests
+from django.conf import settings
+from logging_app.loguru_config import logger
+from requests.adapters import HTTPAdapter
+
+API_URL = 'https://api.telegram.org'
+REQUEST_TIMEOUT = 10
+# Telegram пропускает в один канал или группу около 20 сообщений в минуту;
+# ведро с запасом B и скоростью r даёт за минуту не больше B + 60r
+CHAT_RATE = 19 / 60
+CHAT_BURST = 1
+MAX_RETRIES = 3
+# Дольше не ждём: сообщение вернётся в очередь outbox и уйдёт позже,
+# а поток воркера не висит дольше срока захвата
+MAX_WAIT = 60
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+class TelegramError(Exception):
+    pass
+
+
+class RateLimited(TelegramError):
+    """
+    Сообщение не отправлялось: следующая отправка в чат возможна только
+    через `delay` секунд. Это не ошибка доставки — outbox откладывает
+    сообщение, не засчитывая попытку.
+    """
+
+    def __init__(self, delay):
+        super().__init__(f"Rate limit: next slot in {delay:.0f} s")
+        self.delay = delay
+
+
+class TokenBucket:
+    """
+    Ведро токенов: `rate` токенов в секунду, не больше `capacity` про
+    запас. Потокобезопасно в пределах процесса.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Берёт токен и возвращает, сколько секунд ждать до отправки."""
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate,
+                       self.blocked_until - now)
+
+    def pause(self, seconds):
+        """После 429: ничего не отправлять `seconds` секунд."""
+        with self.lock:
+            now = self.clock()
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.tokens = min(self.tokens, 0)
+            self.updated = now
+
+    def release(self):
+        """Возвращает токен, взятый reserve(), если отправка не состоялась."""
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+    def blocked_for(self):
+        with self.lock:
+            return max(0.0, self.blocked_until - self.clock())
+
+
+def retry_after(response):
+    """Пауза из ответа 429: parameters.retry_after или Retry-After."""
+    try:
+        value = response.json()['parameters']['retry_after']
+    except (ValueError, KeyError, TypeError):
+        value = response.headers.get('Retry-After', 1)
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class TelegramSender:
+    """
+    Отправка через Bot API с постоянной сессией (без нового TLS-рукопожатия
+    на каждое сообщение), ведром токенов на каждый чат и повтором после
+    429 через указанный Telegram retry_after.
+    """
+
+    def __init__(self, token, api_url=API_URL, rate=CHAT_RATE,
+                 burst=CHAT_BURST, max_retries=MAX_RETRIES,
+                 max_wait=MAX_WAIT, timeout=REQUEST_TIMEOUT, session=None,
+                 sleep=time.sleep):
+        self.token = token
+        self.api_url = api_url.rstrip('/')
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.sleep = sleep
+        self.session = session or self.create_session()
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+
+    @staticmethod
+    def create_session():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=8)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def bucket(self, chat_id):
+        with self.buckets_lock:
+            if chat_id not in self.buckets:
+                self.buckets[chat_id] = TokenBucket(self.rate, self.burst)
+            return self.buckets[chat_id]
+
+    def wait(self, bucket):
+        delay = bucket.reserve()
+        if delay > self.max_wait:
+            bucket.release()
+            raise RateLimited(delay)
+        self.sleep(delay)
+        # Пока ждали, другой поток мог получить 429 по этому чату
+        self.sleep(bucket.blocked_for())
+
+    def send_message(self, chat_id, text, parse_mode='HTML'):
+        url = f"{self.api_url}/bot{self.token}/sendMessage"
+        data = {'chat_id': chat_id, 'text': text, 'parse_mode': parse_mode}
+        bucket = self.bucket(chat_id)
+        for attempt in range(self.max_retries + 1):
+            self.wait(bucket)
+            response = self.session.post(url, data=data,
+                                         timeout=self.timeout)
+            if response.status_code != 429:
+                break
+            delay = retry_after(response)
+            logger.warning(f"Telegram ограничил отправку в чат {chat_id}, "
+                           f"повтор через {delay} с")
+            bucket.pause(delay)
+        if response.status_code == 429:
+            raise RateLimited(bucket.blocked_for())
+        if not response.ok:
+            raise TelegramError(f"{response.status_code}: {response.text}")
+        return response.json().get('result')
+
+
+def get_sender():
+    global _sender
+    with _sender_lock:
+        if _sender is None:
+            _sender = TelegramSender(
+                settings.TELEGRAM_BOT_TOKEN,
+                api_url=getattr(settings, 'TELEGRAM_API_URL', API_URL),
+                rate=getattr(settings, 'TELEGRAM_CHAT_RATE', CHAT_RATE),
+                burst=getattr(settings, 'TELEGRAM_CHAT_BURST', CHAT_BURST),
+            )
+        return _sender
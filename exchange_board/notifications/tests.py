@@ -0,0 +1,423 @@
+import threading
+from datetime import timedelta
+from unittest.mock import patch
+
+from bank_details.models import BankDetail, Currency
+from django.core import mail
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from offers.models import CLOSED, Offer
+from requests_for_transaction.models import RequestForTransaction
+from users.models import CustomUser, UserFollow
+
+from .fake_telegram import FakeTelegramAPI
+from .inbox import (bump_counters, fan_out_offer, following_changed,
+                    inbox_offers, mark_read, unread_count)
+from .mail import (compiled_template, missed_offers_emails,
+                   queue_missed_offers_digest, render_email, send_batches)
+from .models import DEAD, PENDING, SENT, InboxItem, OutboxMessage
+from .outbox import (MAX_ATTEMPTS, claim_batch, group_batch,
+                     process_emails, process_messages, requeue_dead)
+from .telegram import RateLimited, TelegramSender, TokenBucket
+from .views import NEW_OFFERS_DIGEST, new_offers_digest
+
+
+class OutboxTests(TestCase):
+
+    def test_rolled_back_change_sends_nothing(self):
+        try:
+            with transaction.atomic():
+                OutboxMessage.enqueue_email('Subject', 'Body',
+                                            ['user@mail.com'])
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_email_is_sent(self):
+        message = OutboxMessage.enqueue_email('Subject', 'Body',
+                                              ['user@mail.com'])
+        self.assertEqual(process_messages([message]), SENT)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['user@mail.com'])
+        message.refresh_from_db()
+        self.assertEqual(message.status, SENT)
+        self.assertIsNotNone(message.sent_at)
+
+    @patch('notifications.outbox.send_telegram_notification',
+           return_value=False)
+    def test_failure_is_retried_later(self, mock_telegram):
+        message = OutboxMessage.enqueue_telegram('text')
+        self.assertEqual(process_messages([message]), PENDING)
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, 1)
+        self.assertGreater(message.next_attempt_at, timezone.now())
+        self.assertIn('Telegram', message.last_error)
+        # До истечения паузы сообщение не захватывается
+        self.assertEqual(claim_batch(10), [])
+
+    @patch('notifications.outbox.send_telegram_notification',
+           side_effect=OSError('timeout'))
+    def test_message_is_dead_after_max_attempts(self, mock_telegram):
+        message = OutboxMessage.enqueue_telegram('text')
+        OutboxMessage.objects.filter(id=message.id).update(
+            attempts=MAX_ATTEMPTS - 1
+        )
+        message.refresh_from_db()
+        self.assertEqual(process_messages([message]), DEAD)
+        self.assertEqual(requeue_dead(), 1)
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), (PENDING, 0))
+
+    @patch('notifications.outbox.send_telegram_notification',
+           side_effect=RateLimited(90))
+    def test_rate_limited_message_keeps_its_attempts(self, mock_telegram):
+        message = OutboxMessage.enqueue_telegram('text')
+        OutboxMessage.objects.filter(id=message.id).update(
+            attempts=MAX_ATTEMPTS - 1
+        )
+        message = claim_batch(10)[0]
+        self.assertEqual(process_messages([message]), PENDING)
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts),
+                         (PENDING, MAX_ATTEMPTS - 1))
+        self.assertIsNone(message.locked_until)
+        self.assertGreater(message.next_attempt_at,
+                           timezone.now() + timedelta(seconds=60))
+
+    def test_claimed_message_is_not_claimed_twice(self):
+        first = OutboxMessage.enqueue_telegram('first')
+        OutboxMessage.enqueue_telegram('second')
+        OutboxMessage.objects.filter(id=first.id).update(
+            next_attempt_at=timezone.now() - timedelta(minutes=1)
+        )
+        self.assertEqual([message.id for message in claim_batch(1)],
+                         [first.id])
+        claimed = claim_batch(10)
+        self.assertEqual(len(claimed), 1)
+        self.assertNotEqual(claimed[0].id, first.id)
+        self.assertEqual(claim_batch(10), [])
+
+    def test_expired_lease_is_claimed_again(self):
+        message = OutboxMessage.enqueue_telegram('text')
+        claim_batch(10)
+        OutboxMessage.objects.filter(id=message.id).update(
+            locked_until=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual([claimed.id for claimed in claim_batch(10)],
+                         [message.id])
+
+
+class DigestTests(TestCase):
+
+    def enqueue_offer(self, number, delay=60):
+        return OutboxMessage.enqueue_telegram(
+            f'full text {number}',
+            digest_key=NEW_OFFERS_DIGEST,
+            summary=f'offer {number}',
+            delay=delay,
+        )
+
+    @patch('notifications.outbox.send_telegram_notification',
+           return_value=True)
+    def test_burst_is_sent_as_one_digest(self, mock_telegram):
+        self.enqueue_offer(1, delay=0)
+        self.enqueue_offer(2)
+        self.enqueue_offer(3)
+        OutboxMessage.enqueue_telegram('unrelated')
+        units = group_batch(claim_batch(10))
+        self.assertEqual(sorted(len(unit) for unit in units), [1, 3])
+        for unit in units:
+            self.assertEqual(process_messages(unit), SENT)
+        texts = [call.args[0] for call in mock_telegram.call_args_list]
+        self.assertEqual(texts[0], 'unrelated')
+        self.assertIn('<b>3 NEW OFFERS!</b>', texts[1])
+        self.assertIn('offer 3', texts[1])
+        self.assertFalse(OutboxMessage.objects.exclude(status=SENT).exists())
+
+    @patch('notifications.outbox.send_telegram_notification',
+           return_value=True)
+    def test_single_offer_keeps_full_message(self, mock_telegram):
+        self.enqueue_offer(1, delay=0)
+        for unit in group_batch(claim_batch(10)):
+            process_messages(unit)
+        mock_telegram.assert_called_once_with('full text 1')
+
+    def test_long_digest_is_split(self):
+        texts = new_offers_digest(['x' * 1000] * 10)
+        self.assertEqual(len(texts), 3)
+        self.assertTrue(all(len(text) <= 4096 for text in texts))
+        self.assertEqual(sum(text.count('x' * 1000) for text in texts), 10)
+
+
+class TelegramSenderTests(SimpleTestCase):
+
+    def test_token_bucket_spaces_out_messages(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0])
+        self.assertEqual([bucket.reserve() for _ in range(4)],
+                         [0.0, 0.0, 0.5, 1.0])
+        now[0] = 10.0
+        bucket.pause(3)
+        self.assertEqual(bucket.reserve(), 3.0)
+
+    def test_retry_after_is_honored(self):
+        with FakeTelegramAPI(limit=2, period=0.3,
+                             integer_retry_after=False) as api:
+            # Ведро не ограничивает: упираемся в лимит «Telegram»
+            sender = TelegramSender('token', api_url=api.url, rate=1000,
+                                    burst=1000, max_retries=5)
+            for number in range(5):
+                sender.send_message(42, f'message {number}')
+        self.assertGreater(api.rejected, 0)
+        self.assertEqual([text for chat, text in api.messages],
+                         [f'message {number}' for number in range(5)])
+
+    def test_token_bucket_avoids_429(self):
+        with FakeTelegramAPI(limit=5, period=0.5) as api:
+            # За любые 0.5 с ведро пропустит не больше 1 + 6 * 0.5 = 4
+            sender = TelegramSender('token', api_url=api.url, rate=6,
+                                    burst=1)
+            for number in range(10):
+                sender.send_message(42, f'message {number}')
+        self.assertEqual(api.rejected, 0)
+        self.assertEqual(len(api.messages), 10)
+
+    def test_long_wait_is_refused(self):
+        sender = TelegramSender('token', rate=1, burst=1, max_wait=5,
+                                sleep=lambda seconds: None)
+        sender.bucket(42).pause(30)
+        with self.assertRaises(RateLimited) as context:
+            sender.send_message(42, 'message')
+        self.assertGreater(context.exception.delay, 5)
+
+
+class BulkMailTests(TestCase):
+
+    def test_templates_are_compiled_once(self):
+        compiled_template.cache_clear()
+        for code in ('111111', '222222'):
+            subject, body = render_email('confirmation', {
+                'username': 'dorj',
+                'confirmation_code': code,
+            })
+            self.assertIn(code, body)
+        self.assertEqual(subject, 'Complete Your Registration with Ashignet')
+        self.assertEqual(compiled_template.cache_info().misses, 2)
+
+    def test_batches_share_one_connection(self):
+        connection = get_connection()
+        messages = (EmailMessage('Subject', 'Body', to=[f'{number}@mail.com'])
+                    for number in range(25))
+        with patch.object(connection, 'send_messages',
+                          wraps=connection.send_messages) as send_messages:
+            with patch('notifications.mail.get_connection',
+                       return_value=connection) as mock_get_connection:
+                self.assertEqual(send_batches(messages, batch_size=10), 25)
+        mock_get_connection.assert_called_once()
+        self.assertEqual(send_messages.call_count, 3)
+        self.assertEqual(len(mail.outbox), 25)
+
+    def test_outbox_emails_share_one_connection(self):
+        for number in range(3):
+            OutboxMessage.enqueue_email('Subject', 'Body',
+                                        [f'{number}@mail.com'])
+        units = group_batch(claim_batch(10))
+        self.assertEqual([len(unit) for unit in units], [3])
+        with patch('notifications.outbox.get_connection',
+                   wraps=get_connection) as mock_get_connection:
+            self.assertEqual(process_emails(units[0]), {SENT: 3})
+        mock_get_connection.assert_called_once()
+        self.assertEqual(len(mail.outbox), 3)
+
+
+class MissedOffersDigestTests(TestCase):
+
+    def create_user(self, name, confirmed=True):
+        return CustomUser.objects.create_user(
+            username=name,
+            email=f'{name}@mail.com',
+            password='12345',
+            referral_code=name,
+            is_email_confirmed=confirmed,
+        )
+
+    def setUp(self):
+        usd = Currency.objects.create(name="US Dollar", code="USD")
+        mnt = Currency.objects.create(name="Mongolian Tugrik", code="MNT")
+        self.author = self.create_user('author')
+        self.applicant = self.create_user('applicant')
+        self.reader = self.create_user('reader')
+        self.create_user('unconfirmed', confirmed=False)
+        self.offer = Offer.objects.create(author=self.author,
+                                          currency_offered=usd,
+                                          amount_offered=100,
+                                          currency_needed=mnt)
+        old = Offer.objects.create(author=self.author,
+                                   currency_offered=usd,
+                                   amount_offered=200,
+                                   currency_needed=mnt)
+        Offer.objects.filter(id=old.id).update(
+            publishing_date=timezone.now() - timedelta(days=30)
+        )
+        Offer.objects.create(author=self.author, currency_offered=usd,
+                             amount_offered=300, currency_needed=mnt,
+                             status=CLOSED)
+        RequestForTransaction.objects.create(
+            offer=self.offer,
+            applicant=self.applicant,
+            bank_detail=BankDetail.objects.create(user=self.applicant,
+                                                  bank_name='Bank',
+                                                  currency=usd)
+        )
+
+    def test_only_users_who_missed_offers_get_email(self):
+        self.assertEqual(queue_missed_offers_digest(days=7), 1)
+        self.assertEqual(mail.outbox, [])
+        for unit in group_batch(claim_batch(10)):
+            process_emails(unit)
+        self.assertEqual(len(mail.outbox), 1)
+        email = mail.outbox[0]
+        self.assertEqual(email.to, ['reader@mail.com'])
+        self.assertEqual(email.subject, '1 offer you missed this week')
+        self.assertIn('author sells 100.00 USD for MNT', email.body)
+        self.assertIn(f'/offer/{self.offer.id}/', email.body)
+
+    def test_repeated_run_skips_users_already_queued(self):
+        self.assertEqual(queue_missed_offers_digest(days=7), 1)
+        self.create_user('newcomer')
+        self.assertEqual(queue_missed_offers_digest(days=7), 1)
+        self.assertEqual(
+            sorted(message.data['recipients'][0]
+                   for message in OutboxMessage.objects.all()),
+            ['newcomer@mail.com', 'reader@mail.com']
+        )
+        # Следующий плановый запуск снова пишет всем
+        CustomUser.objects.update(
+            missed_offers_sent_at=timezone.now() - timedelta(days=7)
+        )
+        self.assertEqual(queue_missed_offers_digest(days=7), 2)
+
+    def test_wording_follows_window(self):
+        queue_missed_offers_digest(days=3)
+        data = OutboxMessage.objects.get().data
+        self.assertEqual(data['subject'],
+                         '1 offer you missed in the last 3 days')
+        self.assertIn('published on Ashignet in the last 3 days',
+                      data['body'])
+
+    def test_queries_do_not_grow_with_users(self):
+        for number in range(5):
+            self.create_user(f'reader{number}')
+        since = timezone.now() - timedelta(days=7)
+        with self.assertNumQueries(3):
+            emails = list(missed_offers_emails(since, 7))
+        self.assertEqual(len(emails), 6)
+
+
+@patch('notifications.inbox.transaction.on_commit',
+       side_effect=lambda callback: callback())
+class InboxTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.usd = Currency.objects.create(name="US Dollar", code="USD")
+        self.author = CustomUser.objects.create_user(
+            username='author', email='author@mail.com', password='12345',
+            referral_code='1',
+        )
+        self.followers = []
+        for number in range(3):
+            follower = CustomUser.objects.create_user(
+                username=f'follower{number}',
+                email=f'follower{number}@mail.com',
+                password='12345',
+                referral_code=f'1-{number}',
+            )
+            UserFollow.objects.create(user=follower, author=self.author)
+            self.followers.append(follower)
+
+    def publish(self):
+        offer = Offer.objects.create(author=self.author,
+                                     currency_offered=self.usd,
+                                     amount_offered=100,
+                                     currency_needed=self.usd)
+        fan_out_offer(offer)
+        return offer
+
+    def test_fan_out_is_one_bulk_insert(self, mock_on_commit):
+        offer = Offer.objects.create(author=self.author,
+                                     currency_offered=self.usd,
+                                     amount_offered=100,
+                                     currency_needed=self.usd)
+        with self.assertNumQueries(2):
+            self.assertEqual(fan_out_offer(offer), 3)
+        self.assertEqual(
+            set(InboxItem.objects.values_list('user_id', flat=True)),
+            {follower.id for follower in self.followers}
+        )
+
+    def test_unread_counter_is_served_from_cache(self, mock_on_commit):
+        follower = self.followers[0]
+        self.publish()
+        self.assertEqual(unread_count(follower), 1)
+        self.publish()
+        with self.assertNumQueries(0):
+            self.assertEqual(unread_count(follower), 2)
+        mark_read(follower)
+        self.assertEqual(unread_count(follower), 0)
+
+    def test_overlapping_bumps_are_not_lost(self, mock_on_commit):
+        follower = self.followers[0]
+        self.assertEqual(unread_count(follower), 0)
+        follower_ids = [follower.id]
+        barrier = threading.Barrier(2)
+
+        def bump_many():
+            barrier.wait()
+            for _ in range(50):
+                bump_counters(follower_ids)
+
+        threads = [threading.Thread(target=bump_many) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with self.assertNumQueries(0):
+            self.assertEqual(unread_count(follower), 100)
+
+    @override_settings(INBOX_FAN_OUT_LIMIT=2)
+    def test_large_following_is_merged_on_read(self, mock_on_commit):
+        follower = self.followers[0]
+        first = self.publish()
+        self.assertFalse(InboxItem.objects.exists())
+        self.assertTrue(Offer.objects.get(id=first.id).fan_out_on_read)
+        self.assertEqual(unread_count(follower), 1)
+        second = self.publish()
+        with self.assertNumQueries(0):
+            self.assertEqual(unread_count(follower), 2)
+        self.assertEqual([offer.id for offer in inbox_offers(follower)],
+                         [second.id, first.id])
+
+    def test_unfollow_clears_inbox(self, mock_on_commit):
+        follower = self.followers[0]
+        self.publish()
+        self.assertEqual(unread_count(follower), 1)
+        UserFollow.objects.filter(user=follower).delete()
+        following_changed(follower.id, unfollowed_author_id=self.author.id)
+        self.assertEqual(unread_count(follower), 0)
+        self.assertEqual(inbox_offers(follower), [])
+
+    def test_inbox_page_marks_offers_read(self, mock_on_commit):
+        follower = self.followers[0]
+        offer = self.publish()
+        self.client.login(username=follower.username, password='12345')
+        response = self.client.get(reverse('inbox'))
+        self.assertContains(
+            response, reverse('offer_detail', kwargs={'offer_id': offer.id})
+        )
+        self.assertEqual(unread_count(follower), 0)
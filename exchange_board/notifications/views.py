@@ -1,32 +1,44 @@
 import requests
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.decorators import login_required
 from django.contrib.sites.shortcuts import get_current_site
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404
+from django.shortcuts import render
 from django.urls import reverse
 from exchange_rates.models import ExchangeRate
 from logging_app.loguru_config import logger
-from offers.models import Offer
+
+from .inbox import inbox_offers, mark_read
+from .mail import queue_email, render_email
+from .models import OutboxMessage
+from .telegram import RateLimited, TelegramError, get_sender
+
+
+NEW_OFFERS_DIGEST = 'new_offers'
+# Лимит длины текста сообщения в Telegram
+MESSAGE_LIMIT = 4096
 
 
 def send_telegram_notification(message):
     logger.info("Отправка сообщения в Telegram")
-    telegram_url = f"https://api.telegram.org/bot{settings.TELEGRAM_BOT_TOKEN}/sendMessage"
-    data = {
-        "chat_id": settings.TELEGRAM_CHANNEL_ID,
-        "text": message,
-        "parse_mode": "HTML"
-    }
-    response = requests.post(telegram_url, data=data)
-    if response.ok:
-        logger.info("Сообщение в Telegram успешно отправлено")
-    else:
-        logger.error("Ошибка при отправке сообщения в Telegram")
-    return response.ok
-
-
-def notify_new_offer(request, offer_id):
-    offer = get_object_or_404(Offer, id=offer_id)
+    try:
+        get_sender().send_message(settings.TELEGRAM_CHANNEL_ID, message)
+    except RateLimited as error:
+        logger.info(f"Отправка в Telegram отложена: {error}")
+        raise
+    except (TelegramError, requests.RequestException) as error:
+        logger.error(f"Ошибка при отправке сообщения в Telegram: {error}")
+        return False
+    logger.info("Сообщение в Telegram успешно отправлено")
+    return True
+
+
+def notify_new_offer(request, offer):
+    """
+    Ставит в очередь сообщение о новом предложении. Вызывается в одной
+    транзакции с созданием предложения, отправляет воркер run_outbox
+    не раньше чем через TELEGRAM_DIGEST_WINDOW секунд.
+    """
     domain = get_current_site(request).domain
     offer_url = reverse('offer_detail', kwargs={'offer_id': offer.id})
     offer_link = f"http://{domain}{offer_url}"
@@ -43,12 +55,44 @@ def notify_new_offer(request, offer_id):
         f"1 USD = {mnt_to_usd} MNT.\n\n"
         f"Click <a href='{offer_link}'>here</a> to check (you need to be logged in!!!)."
     )
-    if send_telegram_notification(message):
-        logger.info(f"Уведомление о новом предложении с ID {offer_id} успешно отправлено")
-        return JsonResponse({"success": True})
-    else:
-        logger.error(f"Не удалось отправить уведомление о новом предложении с ID {offer_id}")
-        return JsonResponse({"success": False})
+    summary = (
+        f"{offer.author.username} sells {offer.amount_offered} "
+        f"{offer.currency_offered} for {offer.currency_needed}: "
+        f"<a href='{offer_link}'>offer № {offer.id}</a>"
+    )
+    logger.info(f"Уведомление о новом предложении с ID {offer.id} "
+                f"поставлено в очередь")
+    # Всплеск новых предложений за окно уйдёт в канал одной сводкой
+    return OutboxMessage.enqueue_telegram(
+        message,
+        digest_key=NEW_OFFERS_DIGEST,
+        summary=summary,
+        delay=getattr(settings, 'TELEGRAM_DIGEST_WINDOW', 60),
+    )
+
+
+def new_offers_digest(summaries):
+    """Сводка о нескольких новых предложениях, разбитая по лимиту длины."""
+    footer = "\n\nOpen an offer to check it (you need to be logged in!!!)."
+    # Запас под заголовок "<b>N NEW OFFERS!</b>"
+    budget = MESSAGE_LIMIT - len(footer) - 32
+    chunks = [[]]
+    length = 0
+    for summary in summaries:
+        if chunks[-1] and length + len(summary) + 1 > budget:
+            chunks.append([])
+            length = 0
+        chunks[-1].append(summary)
+        length += len(summary) + 1
+    return [
+        f"<b>{len(chunk)} NEW OFFERS!</b>\n\n" + "\n".join(chunk) + footer
+        for chunk in chunks if chunk
+    ]
+
+
+DIGESTS = {
+    NEW_OFFERS_DIGEST: new_offers_digest,
+}
 
 
 def send_acceptance_notification(applicant, offer):
@@ -59,4 +103,33 @@ def send_acceptance_notification(applicant, offer):
         "you can always create your own currency exchange offer, "
         "and you'll surely find your counterpart!"
     )
-    send_telegram_notification(message)
+    OutboxMessage.enqueue_telegram(message)
+
+
+def queue_request_decision_notifications(offer, applicant,
+                                         rejected_user_ids):
+    """
+    Уведомления после принятия заявки: письмо принятому заявителю,
+    сообщение в канал и по письму каждому отклонённому. Вызывается
+    внутри транзакции принятия, так что уведомления уходят в очередь
+    только вместе с самим решением.
+    """
+    if applicant.email:
+        queue_email('application_accepted', {}, [applicant.email])
+    rejected_emails = get_user_model().objects.filter(
+        id__in=rejected_user_ids
+    ).exclude(email='').values_list('email', flat=True)
+    # Текст у всех отклонённых одинаковый: шаблон рендерится один раз
+    subject, body = render_email('application_declined', {})
+    OutboxMessage.objects.bulk_create([
+        OutboxMessage.build_email(subject, body, [email])
+        for email in rejected_emails
+    ])
+    send_acceptance_notification(applicant, offer)
+
+
+@login_required
+def inbox(request):
+    offers = inbox_offers(request.user)
+    mark_read(request.user)
+    return render(request, 'notifications/inbox.html', {'offers': offers})
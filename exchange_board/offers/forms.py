@@ -1,9 +1,13 @@
+from datetime import datetime, time, timedelta
+
 from bank_details.models import BankDetail, Currency
 from django import forms
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from requests_for_transaction.models import RequestForTransaction
+from users.handshakes import within_handshakes
 
-from .models import Offer
+from .models import STATUS_CHOICES_OFFER, Offer
 
 
 class OfferForm(forms.ModelForm):
@@ -66,3 +70,87 @@ class OfferForm(forms.ModelForm):
             ) > 150000:
                 raise ValidationError("Limit exceeded for tugrugs!")
         return cleaned_data
+
+
+class OfferSearchForm(forms.Form):
+    currency_offered = forms.ModelChoiceField(
+        queryset=Currency.objects.all(),
+        to_field_name='code',
+        required=False
+    )
+    currency_needed = forms.ModelChoiceField(
+        queryset=Currency.objects.all(),
+        to_field_name='code',
+        required=False
+    )
+    amount_min = forms.DecimalField(
+        max_digits=15, decimal_places=2, min_value=0, required=False
+    )
+    amount_max = forms.DecimalField(
+        max_digits=15, decimal_places=2, min_value=0, required=False
+    )
+    status = forms.ChoiceField(
+        choices=[('', 'Any')] + STATUS_CHOICES_OFFER,
+        required=False
+    )
+    author = forms.CharField(max_length=150, required=False)
+    date_from = forms.DateField(required=False)
+    date_to = forms.DateField(required=False)
+    max_handshakes = forms.IntegerField(min_value=0, required=False)
+
+    def __init__(self, *args, **kwargs):
+        self.user = kwargs.pop('user', None)
+        super(OfferSearchForm, self).__init__(*args, **kwargs)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        amount_min = cleaned_data.get('amount_min')
+        amount_max = cleaned_data.get('amount_max')
+        if (amount_min is not None and amount_max is not None
+                and amount_min > amount_max):
+            raise ValidationError("Minimum amount cannot exceed "
+                                  "the maximum amount.")
+        date_from = cleaned_data.get('date_from')
+        date_to = cleaned_data.get('date_to')
+        if date_from and date_to and date_from > date_to:
+            raise ValidationError("Start date cannot be after the end date.")
+        return cleaned_data
+
+    def filter(self, queryset):
+        data = self.cleaned_data
+        if data.get('status'):
+            queryset = queryset.filter(status=data['status'])
+        if data.get('currency_offered'):
+            queryset = queryset.filter(
+                currency_offered=data['currency_offered']
+            )
+        if data.get('currency_needed'):
+            queryset = queryset.filter(currency_needed=data['currency_needed'])
+        if data.get('amount_min') is not None:
+            queryset = queryset.filter(amount_offered__gte=data['amount_min'])
+        if data.get('amount_max') is not None:
+            queryset = queryset.filter(amount_offered__lte=data['amount_max'])
+        if data.get('author'):
+            queryset = queryset.filter(author__username=data['author'])
+        # Границы дат переводятся в диапазон datetime, чтобы
+        # сравнение шло по индексу, а не по функции от publishing_date
+        if data.get('date_from'):
+            queryset = queryset.filter(
+                publishing_date__gte=self._start_of_day(data['date_from'])
+            )
+        if data.get('date_to'):
+            queryset = queryset.filter(
+                publishing_date__lt=self._start_of_day(
+                    data['date_to'] + timedelta(days=1)
+                )
+            )
+        if data.get('max_handshakes') is not None and self.user:
+            queryset = within_handshakes(
+                queryset, self.user, data['max_handshakes'],
+                user_field='author'
+            )
+        return queryset
+
+    @staticmethod
+    def _start_of_day(day):
+        return timezone.make_aware(datetime.combine(day, time.min))
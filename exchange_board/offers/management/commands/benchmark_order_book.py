@@ -0,0 +1,75 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from offers.order_book import BookEntry, OrderBook
+
+CURRENCY_IDS = (1, 2, 3)
+
+
+class Command(BaseCommand):
+    help = "Measures order book match latency on synthetic open offers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--offers', type=int, default=100000)
+        parser.add_argument('--matches', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+        pairs = [(offered, needed) for offered in CURRENCY_IDS
+                 for needed in CURRENCY_IDS if offered != needed]
+
+        def make_entry(offer_id):
+            offered, needed = rng.choice(pairs)
+            return BookEntry(
+                offer_id=offer_id,
+                author_id=rng.randrange(1, options['offers'] // 10 + 2),
+                currency_offered_id=offered,
+                currency_needed_id=needed,
+                amount=round(rng.uniform(10, 150000), 2),
+                publishing_date=now - timedelta(seconds=offer_id),
+            )
+
+        entries = [make_entry(offer_id)
+                   for offer_id in range(1, options['offers'] + 1)]
+        started = time.perf_counter()
+        book = OrderBook(entries)
+        build_time = time.perf_counter() - started
+
+        probes = [make_entry(options['offers'] + i + 1)
+                  for i in range(options['matches'])]
+        match_times = []
+        for probe in probes:
+            started = time.perf_counter()
+            book.match(probe, rng.uniform(10, 150000))
+            match_times.append(time.perf_counter() - started)
+
+        insert_times = []
+        cancel_times = []
+        for probe in probes:
+            started = time.perf_counter()
+            book.add(probe)
+            insert_times.append(time.perf_counter() - started)
+        for probe in probes:
+            started = time.perf_counter()
+            book.cancel(probe.offer_id)
+            cancel_times.append(time.perf_counter() - started)
+
+        self.stdout.write(
+            f"Open offers: {len(book)}, build: {build_time * 1000:.1f} ms"
+        )
+        for label, timings in (('match', match_times),
+                               ('insert', insert_times),
+                               ('cancel', cancel_times)):
+            timings.sort()
+            self.stdout.write(
+                f"{label}: median {statistics.median(timings) * 1e6:.1f} us, "
+                f"p99 {timings[int(len(timings) * 0.99)] * 1e6:.1f} us"
+            )
+        self.stdout.write(self.style.SUCCESS('Benchmark finished.'))
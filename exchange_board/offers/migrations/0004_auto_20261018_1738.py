@@ -0,0 +1,17 @@
+# Generated by Django 2.2.19 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0003_delete_requestfortransaction'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['publishing_date', 'id'], name='offer_feed_cursor_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.19 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0004_auto_20261018_1738'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['status', 'publishing_date'], name='offer_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['status', 'currency_offered', 'currency_needed', 'publishing_date'], name='offer_status_pair_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['currency_offered', 'currency_needed', 'amount_offered'], name='offer_pair_amount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(fields=['author', 'publishing_date'], name='offer_author_date_idx'),
+        ),
+    ]
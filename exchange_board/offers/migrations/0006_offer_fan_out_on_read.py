@@ -0,0 +1,18 @@
+# Generated by Django 2.2.19 on 2026-10-18 10:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('offers', '0005_auto_20261018_1740'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='offer',
+            name='fan_out_on_read',
+            field=models.BooleanField(default=False),
+        ),
+    ]
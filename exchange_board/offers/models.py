@@ -56,6 +56,35 @@ class Offer(models.Model):
         blank=True,
         related_name='related_offers'
     )
+    # Подписчиков слишком много для записи во входящие: предложение
+    # подмешивается во входящие подписчиков при чтении
+    fan_out_on_read = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['publishing_date', 'id'],
+                name='offer_feed_cursor_idx'
+            ),
+            models.Index(
+                fields=['status', 'publishing_date'],
+                name='offer_status_date_idx'
+            ),
+            models.Index(
+                fields=['status', 'currency_offered',
+                        'currency_needed', 'publishing_date'],
+                name='offer_status_pair_date_idx'
+            ),
+            models.Index(
+                fields=['currency_offered', 'currency_needed',
+                        'amount_offered'],
+                name='offer_pair_amount_idx'
+            ),
+            models.Index(
+                fields=['author', 'publishing_date'],
+                name='offer_author_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return (f"{self.author} - {self.amount_offered:.2f} "
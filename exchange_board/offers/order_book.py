@@ -0,0 +1,234 @@
+import heapq
+import threading
+import time
+from collections import namedtuple
+from operator import attrgetter
+
+from django.db import connection
+from logging_app.loguru_config import logger
+from sortedcontainers import SortedKeyList
+
+from .models import OPEN, Offer
+
+DEFAULT_TOLERANCE = 0.05
+DEFAULT_MATCH_LIMIT = 5
+ORDER_BOOK_MAX_AGE = 60
+
+BookEntry = namedtuple('BookEntry', [
+    'offer_id',
+    'author_id',
+    'currency_offered_id',
+    'currency_needed_id',
+    'amount',
+    'publishing_date',
+])
+
+
+class OrderBook:
+    """
+    Открытые предложения, разложенные по валютным парам и отсортированные
+    по сумме: вставка и отмена за O(log n), поиск встречных предложений —
+    диапазонный запрос по сумме в книге обратной пары.
+    """
+
+    def __init__(self, entries=()):
+        self._lock = threading.Lock()
+        self._books = {}
+        self._entries = {}
+        self.load(entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, offer_id):
+        return offer_id in self._entries
+
+    def load(self, entries):
+        by_pair = {}
+        for entry in entries:
+            by_pair.setdefault(self._pair(entry), []).append(entry)
+        with self._lock:
+            self._books = {
+                pair: SortedKeyList(pair_entries, key=attrgetter('amount'))
+                for pair, pair_entries in by_pair.items()
+            }
+            self._entries = {
+                entry.offer_id: entry
+                for pair_entries in by_pair.values()
+                for entry in pair_entries
+            }
+
+    def add(self, entry):
+        with self._lock:
+            self._discard(entry.offer_id)
+            book = self._books.get(self._pair(entry))
+            if book is None:
+                book = SortedKeyList(key=attrgetter('amount'))
+                self._books[self._pair(entry)] = book
+            book.add(entry)
+            self._entries[entry.offer_id] = entry
+
+    def cancel(self, offer_id):
+        with self._lock:
+            return self._discard(offer_id)
+
+    def match(self, entry, required_amount, tolerance=DEFAULT_TOLERANCE,
+              limit=DEFAULT_MATCH_LIMIT):
+        """
+        Встречные предложения (RUB→MNT против MNT→RUB), сумма которых
+        отличается от требуемой не больше чем на `tolerance`. Приоритет:
+        сначала ближайшая сумма, затем более раннее предложение.
+        """
+        required_amount = float(required_amount)
+        low = required_amount * (1 - tolerance)
+        high = required_amount * (1 + tolerance)
+        with self._lock:
+            book = self._books.get(
+                (entry.currency_needed_id, entry.currency_offered_id)
+            )
+            if not book:
+                return []
+            candidates = [
+                candidate for candidate in book.irange_key(low, high)
+                if candidate.author_id != entry.author_id
+            ]
+        return heapq.nsmallest(limit, candidates, key=lambda candidate: (
+            abs(candidate.amount - required_amount),
+            candidate.publishing_date,
+            candidate.offer_id,
+        ))
+
+    @staticmethod
+    def _pair(entry):
+        return entry.currency_offered_id, entry.currency_needed_id
+
+    def _discard(self, offer_id):
+        entry = self._entries.pop(offer_id, None)
+        if entry is None:
+            return False
+        self._books[self._pair(entry)].remove(entry)
+        return True
+
+
+def entry_from_offer(offer):
+    return BookEntry(
+        offer_id=offer.id,
+        author_id=offer.author_id,
+        currency_offered_id=offer.currency_offered_id,
+        currency_needed_id=offer.currency_needed_id,
+        amount=float(offer.amount_offered),
+        publishing_date=offer.publishing_date,
+    )
+
+
+_order_book = None
+_order_book_built_at = 0
+_order_book_lock = threading.Lock()
+_build_lock = threading.Lock()
+_rebuild_thread = None
+_rebuild_thread_lock = threading.Lock()
+
+
+def rebuild_order_book():
+    global _order_book, _order_book_built_at
+    logger.info("Перестроение книги заявок из базы данных")
+    rows = Offer.objects.filter(status=OPEN).values_list(
+        'id', 'author_id', 'currency_offered_id', 'currency_needed_id',
+        'amount_offered', 'publishing_date'
+    ).iterator()
+    book = OrderBook(
+        BookEntry(offer_id, author_id, offered_id, needed_id,
+                  float(amount), publishing_date)
+        for (offer_id, author_id, offered_id, needed_id,
+             amount, publishing_date) in rows
+    )
+    with _order_book_lock:
+        _order_book = book
+        _order_book_built_at = time.monotonic()
+    logger.info(f"Книга заявок перестроена: {len(book)} открытых предложений")
+    return book
+
+
+def _rebuild_in_background():
+    global _order_book_built_at
+    try:
+        # Под той же блокировкой, что и первая сборка: запрос, пришедший
+        # до окончания прогрева, дождётся этой книги, а не строит свою
+        with _build_lock:
+            rebuild_order_book()
+    except Exception:
+        logger.exception("Ошибка фонового перестроения книги заявок")
+        # Следующая попытка — не раньше чем через ORDER_BOOK_MAX_AGE,
+        # а не на каждом запросе
+        with _order_book_lock:
+            _order_book_built_at = time.monotonic()
+    finally:
+        connection.close()
+
+
+def schedule_order_book_rebuild():
+    """
+    Запускает перестроение книги в фоне, если оно ещё не идёт. Запросы
+    тем временем обслуживает текущая книга. При старте веб-процесса
+    (wsgi.py) так же прогревается первая книга.
+    """
+    global _rebuild_thread
+    with _rebuild_thread_lock:
+        if _rebuild_thread is not None and _rebuild_thread.is_alive():
+            return False
+        _rebuild_thread = threading.Thread(
+            target=_rebuild_in_background,
+            name='order-book-rebuild',
+            daemon=True
+        )
+        _rebuild_thread.start()
+    return True
+
+
+def get_order_book():
+    """
+    Книга заявок текущего процесса. Её прогревает wsgi.py при старте;
+    если книги ещё нет, первое обращение ждёт прогрева или строит её
+    само, дальше её поддерживают сигналы. Чтобы подхватить изменения других процессов, устаревшая
+    книга перестраивается в фоне, а запрос получает текущую.
+    """
+    book = _order_book
+    if book is None:
+        with _build_lock:
+            if _order_book is None:
+                return rebuild_order_book()
+            return _order_book
+    if time.monotonic() - _order_book_built_at > ORDER_BOOK_MAX_AGE:
+        schedule_order_book_rebuild()
+    return book
+
+
+def sync_offer(offer):
+    if _order_book is None:
+        return
+    if offer.status == OPEN:
+        _order_book.add(entry_from_offer(offer))
+    else:
+        _order_book.cancel(offer.id)
+
+
+def discard_offer(offer_id):
+    if _order_book is not None:
+        _order_book.cancel(offer_id)
+
+
+def propose_matches(offer, required_amount, tolerance=DEFAULT_TOLERANCE,
+                    limit=DEFAULT_MATCH_LIMIT):
+    if offer.status != OPEN or required_amount is None:
+        return []
+    matches = get_order_book().match(
+        entry_from_offer(offer),
+        required_amount,
+        tolerance=tolerance,
+        limit=limit
+    )
+    offers = Offer.objects.select_related(
+        'author', 'currency_offered', 'currency_needed'
+    ).in_bulk([match.offer_id for match in matches])
+    return [offers[match.offer_id] for match in matches
+            if match.offer_id in offers]
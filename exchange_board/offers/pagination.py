@@ -0,0 +1,121 @@
+import base64
+import json
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+FEED_COUNT_CACHE_KEY = 'offers_feed_count'
+FEED_COUNT_CACHE_TIMEOUT = 60
+
+
+def encode_cursor(offer):
+    payload = json.dumps([offer.publishing_date.isoformat(), offer.id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        payload = base64.urlsafe_b64decode(cursor + padding).decode()
+        publishing_date, offer_id = json.loads(payload)
+        publishing_date = parse_datetime(publishing_date)
+        offer_id = int(offer_id)
+    except (ValueError, TypeError):
+        return None
+    if publishing_date is None:
+        return None
+    return publishing_date, offer_id
+
+
+class CursorPage:
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def paginate_by_cursor(queryset, after=None, before=None, per_page=10):
+    """
+    Keyset-пагинация по (publishing_date, id) от новых к старым без
+    COUNT(*) и OFFSET: `after` ведёт к более старым предложениям,
+    `before` — к более новым.
+    """
+    after = decode_cursor(after) if after else None
+    before = decode_cursor(before) if before else None
+
+    if before:
+        publishing_date, offer_id = before
+        queryset = queryset.filter(
+            Q(publishing_date__gt=publishing_date)
+            | Q(publishing_date=publishing_date, id__gt=offer_id)
+        ).order_by('publishing_date', 'id')
+        rows = list(queryset[:per_page + 1])
+        has_more = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        has_newer, has_older = has_more, True
+    else:
+        if after:
+            publishing_date, offer_id = after
+            queryset = queryset.filter(
+                Q(publishing_date__lt=publishing_date)
+                | Q(publishing_date=publishing_date, id__lt=offer_id)
+            )
+        queryset = queryset.order_by('-publishing_date', '-id')
+        rows = list(queryset[:per_page + 1])
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        has_newer, has_older = after is not None, has_more
+
+    if not rows:
+        return CursorPage([], None, None)
+
+    return CursorPage(
+        rows,
+        next_cursor=encode_cursor(rows[-1]) if has_older else None,
+        previous_cursor=encode_cursor(rows[0]) if has_newer else None,
+    )
+
+
+def invalidate_feed_count():
+    cache.delete(FEED_COUNT_CACHE_KEY)
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Нумерованная пагинация для ленты: общее число предложений берётся
+    из кэша по `cache_key`, чтобы не выполнять COUNT(*) на каждой
+    странице. Ключ относится к одному конкретному queryset, поэтому
+    без него число считается как обычно.
+    """
+
+    def __init__(self, object_list, per_page, cache_key=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.cache_key = cache_key
+
+    @cached_property
+    def count(self):
+        if self.cache_key is None:
+            return super().count
+        return cache.get_or_set(
+            self.cache_key,
+            self.object_list.count,
+            FEED_COUNT_CACHE_TIMEOUT
+        )
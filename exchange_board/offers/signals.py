@@ -0,0 +1,22 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Offer
+from .order_book import discard_offer, sync_offer
+from .pagination import invalidate_feed_count
+
+
+@receiver(post_save, sender=Offer)
+def sync_order_book_on_save(sender, instance, created, **kwargs):
+    sync_offer(instance)
+    if created:
+        # После фиксации: иначе параллельный запрос успеет закэшировать
+        # число предложений без нового
+        transaction.on_commit(invalidate_feed_count)
+
+
+@receiver(post_delete, sender=Offer)
+def sync_order_book_on_delete(sender, instance, **kwargs):
+    discard_offer(instance.id)
+    transaction.on_commit(invalidate_feed_count)
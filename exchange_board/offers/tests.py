@@ -1,10 +1,27 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import Mock, patch
+
 from bank_details.models import BankDetail, Currency
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from exchange_rates.models import ExchangeRate
+from exchange_rates.views import get_required_amounts
+from transactions.models import Transaction
 from users.models import CustomUser
 
-from .models import Offer
+from . import order_book
+from .forms import OfferSearchForm
+from .models import CLOSED, OPEN, Offer
+from .order_book import (BookEntry, OrderBook, get_order_book,
+                         propose_matches, rebuild_order_book)
+from .pagination import (FEED_COUNT_CACHE_KEY, decode_cursor,
+                         encode_cursor)
+from .views import get_offers_feed
 
 
 class OfferModelTest(TestCase):
@@ -138,3 +155,483 @@ class OfferViewTests(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertTrue(Offer.objects.exists())
         self.assertEqual(Offer.objects.first().author, user)
+
+
+class OfferFeedQueryBudgetTests(TestCase):
+    # session, user, offers page
+    QUERY_BUDGET = 3
+
+    def setUp(self):
+        ExchangeRate.objects.create(
+            usd_to_rub=70.00,
+            mnt_to_rub=250.00,
+            mnt_to_usd=0.035,
+            usd_to_rub_alternative=74.5,
+        )
+        self.user = CustomUser.objects.create_user(
+            username='feeduser',
+            email='feed@email.com',
+            password='password',
+            referral_code='1-1'
+        )
+        self.client.login(username='feeduser', password='password')
+        self.usd = Currency.objects.create(code='USD', name='US Dollar')
+        self.rub = Currency.objects.create(code='RUB', name='Russian Ruble')
+
+    def create_offers(self, start, stop):
+        for i in range(start, stop):
+            author = CustomUser.objects.create_user(
+                username=f'author{i}',
+                email=f'author{i}@email.com',
+                password='password',
+                referral_code=f'1-2-{i}'
+            )
+            offer = Offer.objects.create(
+                author=author,
+                currency_offered=self.usd,
+                amount_offered=10,
+                currency_needed=self.rub
+            )
+            if i % 2:
+                Transaction.objects.create(
+                    offer=offer,
+                    accepting_user=self.user
+                )
+
+    def count_index_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_feed_stays_within_query_budget(self):
+        self.create_offers(0, 1)
+        single_offer_queries = self.count_index_queries()
+        self.create_offers(1, 25)
+        full_page_queries = self.count_index_queries()
+
+        self.assertLessEqual(full_page_queries, self.QUERY_BUDGET)
+        self.assertEqual(single_offer_queries, full_page_queries)
+
+
+class OfferFeedCursorPaginationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        ExchangeRate.objects.create(
+            usd_to_rub=70.00,
+            mnt_to_rub=250.00,
+            mnt_to_usd=0.035,
+            usd_to_rub_alternative=74.5,
+        )
+        self.user = CustomUser.objects.create_user(
+            username='feeduser',
+            email='feed@email.com',
+            password='password',
+            referral_code='1-1'
+        )
+        self.client.login(username='feeduser', password='password')
+        usd = Currency.objects.create(code='USD', name='US Dollar')
+        rub = Currency.objects.create(code='RUB', name='Russian Ruble')
+        for amount in range(1, 26):
+            Offer.objects.create(
+                author=self.user,
+                currency_offered=usd,
+                amount_offered=amount,
+                currency_needed=rub
+            )
+        # Одинаковая дата публикации проверяет разрешение ничьих по id
+        same_date = Offer.objects.order_by('id')[5].publishing_date
+        Offer.objects.filter(id__lte=Offer.objects.order_by('id')[12].id
+                             ).update(publishing_date=same_date)
+        self.expected_ids = list(Offer.objects.order_by(
+            '-publishing_date', '-id'
+        ).values_list('id', flat=True))
+
+    def fetch(self, **params):
+        response = self.client.get(reverse('offers_feed_api'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_cursor_roundtrip(self):
+        offer = Offer.objects.first()
+        self.assertEqual(
+            decode_cursor(encode_cursor(offer)),
+            (offer.publishing_date, offer.id)
+        )
+        self.assertIsNone(decode_cursor('not-a-cursor'))
+
+    def test_walks_feed_forward_and_back(self):
+        pages = [self.fetch()]
+        while pages[-1]['next']:
+            pages.append(self.fetch(after=pages[-1]['next']))
+        seen_ids = [offer['id'] for page in pages for offer in page['results']]
+        self.assertEqual(seen_ids, self.expected_ids)
+        self.assertEqual(len(pages), 3)
+        self.assertIsNone(pages[0]['previous'])
+
+        previous = self.fetch(before=pages[2]['previous'])
+        self.assertEqual(previous['results'], pages[1]['results'])
+        first = self.fetch(before=previous['previous'])
+        self.assertEqual(first['results'], pages[0]['results'])
+        self.assertIsNone(first['previous'])
+
+    def test_cursor_mode_skips_count_query(self):
+        with CaptureQueriesContext(connection) as context:
+            self.fetch()
+        self.assertFalse(any(
+            'COUNT(' in query['sql'] for query in context.captured_queries
+        ))
+
+    def test_numbered_mode_uses_cached_count(self):
+        first = self.fetch(page=1)
+        self.assertEqual(first['count'], 25)
+        self.assertEqual(first['num_pages'], 3)
+        with CaptureQueriesContext(connection) as context:
+            last = self.fetch(page=3)
+        self.assertFalse(any(
+            'COUNT(' in query['sql'] for query in context.captured_queries
+        ))
+        self.assertEqual(
+            [offer['id'] for offer in last['results']],
+            self.expected_ids[20:]
+        )
+
+    def test_anonymous_page_does_not_poison_count(self):
+        self.client.logout()
+        response = self.client.get(reverse('index'), {'page': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(cache.get(FEED_COUNT_CACHE_KEY))
+        self.client.login(username='feeduser', password='password')
+        page = self.fetch(page=2)
+        self.assertEqual(page['page'], 2)
+        self.assertEqual(
+            [offer['id'] for offer in page['results']],
+            self.expected_ids[10:20]
+        )
+
+    @patch('offers.signals.transaction.on_commit',
+           side_effect=lambda callback: callback())
+    def test_new_offer_resets_cached_count(self, mock_on_commit):
+        self.assertEqual(self.fetch(page=1)['count'], 25)
+        offer = Offer.objects.first()
+        Offer.objects.create(
+            author=self.user,
+            currency_offered=offer.currency_offered,
+            amount_offered=100,
+            currency_needed=offer.currency_needed
+        )
+        self.assertEqual(self.fetch(page=1)['count'], 26)
+        offer.delete()
+        self.assertEqual(self.fetch(page=1)['count'], 25)
+
+    def test_index_renders_cursor_links(self):
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, '?after=')
+        response = self.client.get(reverse('index'), {'page': 2})
+        self.assertContains(response, '?page=3')
+
+
+class OrderBookTests(TestCase):
+
+    def entry(self, offer_id, offered, needed, amount, author_id=None,
+              minutes_ago=0):
+        return BookEntry(
+            offer_id=offer_id,
+            author_id=author_id or offer_id,
+            currency_offered_id=offered,
+            currency_needed_id=needed,
+            amount=amount,
+            publishing_date=timezone.now() - timedelta(minutes=minutes_ago),
+        )
+
+    def test_match_uses_amount_then_time_priority(self):
+        book = OrderBook([
+            self.entry(1, 'MNT', 'RUB', 1000, minutes_ago=1),
+            self.entry(2, 'MNT', 'RUB', 1010, minutes_ago=5),
+            self.entry(3, 'MNT', 'RUB', 990, minutes_ago=10),
+            self.entry(4, 'MNT', 'RUB', 2000),
+            self.entry(5, 'MNT', 'USD', 1000),
+        ])
+        probe = self.entry(10, 'RUB', 'MNT', 50)
+
+        matches = book.match(probe, 1000, tolerance=0.05)
+
+        self.assertEqual([match.offer_id for match in matches], [1, 3, 2])
+
+    def test_match_skips_own_offers(self):
+        book = OrderBook([self.entry(1, 'MNT', 'RUB', 1000, author_id=7)])
+        probe = self.entry(10, 'RUB', 'MNT', 50, author_id=7)
+        self.assertEqual(book.match(probe, 1000), [])
+
+    def test_add_and_cancel(self):
+        book = OrderBook()
+        book.add(self.entry(1, 'MNT', 'RUB', 1000))
+        book.add(self.entry(1, 'MNT', 'RUB', 5000))
+        self.assertEqual(len(book), 1)
+        probe = self.entry(10, 'RUB', 'MNT', 50)
+        self.assertEqual(book.match(probe, 1000), [])
+        self.assertEqual(len(book.match(probe, 5000)), 1)
+
+        self.assertTrue(book.cancel(1))
+        self.assertFalse(book.cancel(1))
+        self.assertEqual(book.match(probe, 5000), [])
+
+
+class OrderBookSyncTests(TestCase):
+
+    def setUp(self):
+        self.usd = Currency.objects.create(code='USD', name='USD')
+        self.rub = Currency.objects.create(code='RUB', name='RUB')
+        self.author = CustomUser.objects.create_user(
+            username='author', email='author@email.com', password='password'
+        )
+        self.other = CustomUser.objects.create_user(
+            username='other', email='other@email.com', password='password'
+        )
+        self.offer = Offer.objects.create(
+            author=self.author,
+            currency_offered=self.usd,
+            amount_offered=10,
+            currency_needed=self.rub
+        )
+        rebuild_order_book()
+
+    def test_rebuild_loads_open_offers(self):
+        self.assertIn(self.offer.id, get_order_book())
+
+    def test_stale_book_is_rebuilt_in_background(self):
+        book = get_order_book()
+        self.addCleanup(setattr, order_book, '_rebuild_thread', None)
+        with patch('offers.order_book.ORDER_BOOK_MAX_AGE', -1):
+            with patch('offers.order_book.threading.Thread') as mock_thread:
+                with self.assertNumQueries(0):
+                    self.assertIs(get_order_book(), book)
+                    self.assertIs(get_order_book(), book)
+        # Пока идёт перестроение, второй поток не запускается
+        mock_thread.assert_called_once()
+        mock_thread.return_value.start.assert_called_once()
+
+    def test_warm_up_builds_book_before_first_request(self):
+        self.addCleanup(setattr, order_book, '_rebuild_thread', None)
+        order_book._order_book = None
+
+        def run_now(target, **kwargs):
+            thread = Mock()
+            thread.start.side_effect = target
+            return thread
+
+        # Фоновый поток закрывает своё соединение с БД; здесь сборка
+        # идёт в потоке теста, поэтому соединение не трогаем
+        with patch('offers.order_book.threading.Thread', side_effect=run_now):
+            with patch('offers.order_book.connection'):
+                self.assertTrue(order_book.schedule_order_book_rebuild())
+        with self.assertNumQueries(0):
+            self.assertIn(self.offer.id, get_order_book())
+
+    def test_signals_keep_book_in_sync(self):
+        counter_offer = Offer.objects.create(
+            author=self.other,
+            currency_offered=self.rub,
+            amount_offered=700,
+            currency_needed=self.usd
+        )
+        self.assertIn(counter_offer.id, get_order_book())
+        self.assertEqual(
+            propose_matches(self.offer, required_amount=710),
+            [counter_offer]
+        )
+
+        counter_offer.status = CLOSED
+        counter_offer.save()
+        self.assertNotIn(counter_offer.id, get_order_book())
+        self.assertEqual(propose_matches(self.offer, required_amount=710), [])
+
+        offer_id = self.offer.id
+        self.offer.delete()
+        self.assertNotIn(offer_id, get_order_book())
+
+
+class OfferSearchTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username='searcher', email='search@email.com', password='password'
+        )
+        self.author = CustomUser.objects.create_user(
+            username='author', email='author@email.com', password='password'
+        )
+        self.client.login(username='searcher', password='password')
+        self.usd = Currency.objects.create(code='USD', name='US Dollar')
+        self.rub = Currency.objects.create(code='RUB', name='Russian Ruble')
+        self.mnt = Currency.objects.create(code='MNT', name='Tugrik')
+        self.small = Offer.objects.create(
+            author=self.author, currency_offered=self.rub,
+            amount_offered=1000, currency_needed=self.mnt
+        )
+        self.large = Offer.objects.create(
+            author=self.user, currency_offered=self.rub,
+            amount_offered=4000, currency_needed=self.mnt
+        )
+        self.closed = Offer.objects.create(
+            author=self.author, currency_offered=self.usd,
+            amount_offered=40, currency_needed=self.rub, status=CLOSED
+        )
+        self.old = Offer.objects.create(
+            author=self.author, currency_offered=self.rub,
+            amount_offered=2000, currency_needed=self.mnt
+        )
+        Offer.objects.filter(id=self.old.id).update(
+            publishing_date=timezone.now() - timedelta(days=30)
+        )
+
+    def search(self, **params):
+        response = self.client.get(reverse('offers_search_api'), params)
+        return response
+
+    def found_ids(self, **params):
+        response = self.search(**params)
+        self.assertEqual(response.status_code, 200)
+        return {offer['id'] for offer in response.json()['results']}
+
+    def test_filters(self):
+        self.assertEqual(
+            self.found_ids(currency_offered='RUB', currency_needed='MNT'),
+            {self.small.id, self.large.id, self.old.id}
+        )
+        self.assertEqual(
+            self.found_ids(currency_offered='RUB', amount_min=1500,
+                           amount_max=5000),
+            {self.large.id, self.old.id}
+        )
+        self.assertEqual(self.found_ids(status=CLOSED), {self.closed.id})
+        self.assertEqual(
+            self.found_ids(author='author', status=OPEN),
+            {self.small.id, self.old.id}
+        )
+        week_ago = (timezone.localdate() - timedelta(days=7)).isoformat()
+        self.assertEqual(
+            self.found_ids(currency_offered='RUB', date_to=week_ago),
+            {self.old.id}
+        )
+        self.assertEqual(
+            self.found_ids(currency_offered='RUB', date_from=week_ago),
+            {self.small.id, self.large.id}
+        )
+
+    def test_invalid_filters(self):
+        response = self.search(amount_min=10, amount_max=5)
+        self.assertEqual(response.status_code, 400)
+        response = self.search(currency_offered='XXX')
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_page(self):
+        response = self.client.get(
+            reverse('search_offers'), {'currency_offered': 'USD'}
+        )
+        self.assertContains(response, 'Posted by Author')
+        self.assertContains(response, '40')
+
+
+class OfferIndexUsageTests(TestCase):
+
+    def setUp(self):
+        self.usd = Currency.objects.create(code='USD', name='US Dollar')
+        self.rub = Currency.objects.create(code='RUB', name='Russian Ruble')
+
+    def assertUsesIndex(self, queryset, index_name):
+        self.assertIn(index_name, queryset.explain())
+
+    def search(self, **params):
+        form = OfferSearchForm(params)
+        self.assertTrue(form.is_valid(), form.errors)
+        return form.filter(get_offers_feed())
+
+    def test_pair_and_status_filter_uses_composite_index(self):
+        self.assertUsesIndex(
+            self.search(status=OPEN, currency_offered='USD',
+                        currency_needed='RUB'),
+            'offer_status_pair_date_idx'
+        )
+
+    def test_amount_range_uses_pair_amount_index(self):
+        self.assertUsesIndex(
+            Offer.objects.filter(
+                currency_offered=self.usd, currency_needed=self.rub,
+                amount_offered__gte=10, amount_offered__lte=40
+            ),
+            'offer_pair_amount_idx'
+        )
+
+    def test_status_filter_uses_status_index(self):
+        self.assertUsesIndex(
+            self.search(status=OPEN), 'offer_status_date_idx'
+        )
+
+    def test_author_filter_uses_author_index(self):
+        self.assertUsesIndex(
+            self.search(author='someone'), 'offer_author_date_idx'
+        )
+
+
+class OfferRequiredAmountsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        ExchangeRate.invalidate_cache()
+        ExchangeRate.objects.create(
+            usd_to_rub=90,
+            mnt_to_rub=38,
+            mnt_to_usd=3420,
+            usd_to_rub_alternative=91,
+            base_currency='USD',
+            rates='{"RUB": "90", "MNT": "3420"}',
+        )
+        self.author = CustomUser.objects.create_user(
+            username='author', email='author@email.com', password='password'
+        )
+        self.user = CustomUser.objects.create_user(
+            username='reader', email='reader@email.com', password='password'
+        )
+        usd = Currency.objects.create(code='USD', name='US Dollar')
+        rub = Currency.objects.create(code='RUB', name='Russian Ruble')
+        mnt = Currency.objects.create(code='MNT', name='Tugrik')
+        self.usd_offer = Offer.objects.create(
+            author=self.author, currency_offered=usd,
+            amount_offered=10, currency_needed=rub
+        )
+        self.rub_offer = Offer.objects.create(
+            author=self.author, currency_offered=rub,
+            amount_offered=100, currency_needed=mnt
+        )
+
+    def test_batch_matches_pairs(self):
+        expected = {
+            self.usd_offer.id: Decimal(900),
+            self.rub_offer.id: Decimal(3800),
+        }
+        self.assertEqual(get_required_amounts(get_offers_feed()), expected)
+        self.assertEqual(get_required_amounts(list(get_offers_feed())),
+                         expected)
+
+    def test_queryset_batch_runs_one_query(self):
+        ExchangeRate.latest()
+        with self.assertNumQueries(1):
+            get_required_amounts(Offer.objects.all())
+
+    def test_missing_rate_leaves_amounts_empty(self):
+        ExchangeRate.objects.all().delete()
+        self.assertEqual(get_required_amounts(get_offers_feed()), {})
+
+    def test_feed_cards_show_required_amount(self):
+        self.client.login(username='reader', password='password')
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'You pay: <strong> 900.00 RUB')
+        self.assertContains(response, 'You pay: <strong> 3800.00 MNT')
+
+        data = self.client.get(reverse('offers_feed_api')).json()
+        self.assertEqual(
+            {offer['id']: Decimal(offer['required_amount'])
+             for offer in data['results']},
+            {self.usd_offer.id: Decimal(900), self.rub_offer.id: Decimal(3800)}
+        )
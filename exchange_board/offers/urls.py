@@ -5,6 +5,11 @@ from . import views
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('api/offers/', views.offers_feed_api, name='offers_feed_api'),
+    path('api/offers/search/',
+         views.offers_search_api,
+         name='offers_search_api'),
+    path('offer/search/', views.search_offers, name='search_offers'),
     path('offer/create/',
          views.create_offer,
          name='create_offer'),
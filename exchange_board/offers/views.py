@@ -2,45 +2,103 @@ from bank_details.forms import BankDetailForm
 from bank_details.models import BankDetail, Currency
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.db import transaction as db_transaction
 from django.db.models import Exists, OuterRef
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from exchange_rates.models import ExchangeRate
-from exchange_rates.views import (get_exchange_rate,
+from exchange_rates.views import (attach_required_amounts, get_exchange_rate,
                                   get_required_amount_to_be_exchanged,
-                                  update_exchange_rates)
+                                  schedule_exchange_rate_refresh)
 from logging_app.loguru_config import logger
+from notifications.inbox import fan_out_offer
 from notifications.views import notify_new_offer
 from requests_for_transaction.models import RequestForTransaction
 from transactions.models import Transaction
 from users.views import handshake_count
 
-from .forms import OfferForm
+from .forms import OfferForm, OfferSearchForm
 from .models import IN_PROGRESS, Offer
+from .order_book import propose_matches
+from .pagination import (FEED_COUNT_CACHE_KEY, CachedCountPaginator,
+                         CursorPage, paginate_by_cursor)
+
+FEED_PAGE_SIZE = 10
+
+
+def get_offers_feed():
+    return Offer.objects.select_related(
+        'author',
+        'currency_offered',
+        'currency_needed',
+        'transaction',
+        'transaction__accepting_user',
+    ).annotate(
+        has_requests=Exists(RequestForTransaction.objects.filter(
+            offer=OuterRef('pk')
+        ))
+    ).order_by('-publishing_date', '-id')
+
+
+def paginate_feed(request, offers_list):
+    if 'page' in request.GET:
+        paginator = CachedCountPaginator(
+            offers_list,
+            FEED_PAGE_SIZE,
+            cache_key=FEED_COUNT_CACHE_KEY
+        )
+        return paginator.get_page(request.GET.get('page'))
+    return paginate_by_cursor(
+        offers_list,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        per_page=FEED_PAGE_SIZE
+    )
+
+
+def serialize_offer(offer):
+    return {
+        'id': offer.id,
+        'author': offer.author.username,
+        'currency_offered': offer.currency_offered.code,
+        'amount_offered': str(offer.amount_offered),
+        'currency_needed': offer.currency_needed.code,
+        'publishing_date': offer.publishing_date.isoformat(),
+        'status': offer.status,
+        'has_requests': offer.has_requests,
+        'required_amount': (
+            str(offer.required_amount)
+            if getattr(offer, 'required_amount', None) is not None else None
+        ),
+    }
 
 
 def index(request):
     logger.info("Загрузка главной страницы предложений")
     if ExchangeRate.needs_update():
-        update_exchange_rates()
+        schedule_exchange_rate_refresh()
 
-    latest_rate = ExchangeRate.latest()
-    rub_to_usd = latest_rate.usd_to_rub
-    mnt_to_rub = latest_rate.mnt_to_rub
-    mnt_to_usd = latest_rate.mnt_to_usd
-    usd_to_rub_alternative = latest_rate.usd_to_rub_alternative
+    try:
+        latest_rate = ExchangeRate.latest()
+        rub_to_usd = latest_rate.usd_to_rub
+        mnt_to_rub = latest_rate.mnt_to_rub
+        mnt_to_usd = latest_rate.mnt_to_usd
+        usd_to_rub_alternative = latest_rate.usd_to_rub_alternative
+        matrix = latest_rate.get_matrix()
+    except ExchangeRate.DoesNotExist:
+        rub_to_usd = mnt_to_rub = mnt_to_usd = usd_to_rub_alternative = None
+        matrix = None
 
     if request.user.is_authenticated:
-        offers_list = Offer.objects.order_by('-publishing_date').annotate(
-            has_requests=Exists(RequestForTransaction.objects.filter(
-                offer=OuterRef('pk')
-            ))
-        )
+        offers = paginate_feed(request, get_offers_feed())
+        numbered_pages = 'page' in request.GET
     else:
-        offers_list = []
-    paginator = Paginator(offers_list, 10)
-    page = request.GET.get('page')
-    offers = paginator.get_page(page)
+        # Анонимам лента не показывается: пагинатор и кэш числа
+        # предложений не трогаем
+        offers = CursorPage([], None, None)
+        numbered_pages = False
+    if matrix is not None:
+        attach_required_amounts(offers, matrix)
 
     if not rub_to_usd or not mnt_to_rub:
         logger.error("Ошибка при получении курсов обмена валют")
@@ -49,6 +107,7 @@ def index(request):
 
     context = {
         'offers': offers,
+        'numbered_pages': numbered_pages,
         'rub_to_usd': rub_to_usd,
         'mnt_to_rub': mnt_to_rub,
         'mnt_to_usd': mnt_to_usd,
@@ -59,6 +118,73 @@ def index(request):
     return render(request, template, context)
 
 
+@login_required
+def offers_feed_api(request):
+    offers = paginate_feed(request, get_offers_feed())
+    attach_required_amounts(offers)
+    data = {'results': [serialize_offer(offer) for offer in offers]}
+    if 'page' in request.GET:
+        data['count'] = offers.paginator.count
+        data['num_pages'] = offers.paginator.num_pages
+        data['page'] = offers.number
+    else:
+        data['next'] = offers.next_cursor
+        data['previous'] = offers.previous_cursor
+    return JsonResponse(data)
+
+
+def search_query_string(request):
+    params = request.GET.copy()
+    for key in ('after', 'before', 'page'):
+        params.pop(key, None)
+    return params.urlencode()
+
+
+@login_required
+def search_offers(request):
+    logger.info("Поиск предложений по фильтрам")
+    form = OfferSearchForm(request.GET or None, user=request.user)
+    if form.is_valid():
+        offers_list = form.filter(get_offers_feed())
+    elif form.is_bound:
+        offers_list = Offer.objects.none()
+    else:
+        offers_list = get_offers_feed()
+    offers = paginate_by_cursor(
+        offers_list,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        per_page=FEED_PAGE_SIZE
+    )
+    attach_required_amounts(offers)
+    context = {
+        'form': form,
+        'offers': offers,
+        'query_string': search_query_string(request),
+    }
+    return render(request, 'offers/search.html', context)
+
+
+@login_required
+def offers_search_api(request):
+    form = OfferSearchForm(request.GET, user=request.user)
+    if not form.is_valid():
+        logger.error("Ошибка валидации фильтров поиска предложений")
+        return JsonResponse({'errors': form.errors}, status=400)
+    offers = paginate_by_cursor(
+        form.filter(get_offers_feed()),
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        per_page=FEED_PAGE_SIZE
+    )
+    attach_required_amounts(offers)
+    return JsonResponse({
+        'results': [serialize_offer(offer) for offer in offers],
+        'next': offers.next_cursor,
+        'previous': offers.previous_cursor,
+    })
+
+
 @login_required
 def create_offer(request):
     logger.info("Начало создания нового предложения")
@@ -81,16 +207,18 @@ def create_offer(request):
                 new_bank_detail = bank_detail_form.save(commit=False)
                 new_bank_detail.user = request.user
                 new_bank_detail.currency = currency_needed
-                new_bank_detail.save()
                 offer = offer_form.save(commit=False)
-                offer.bank_detail = new_bank_detail
                 offer.author = request.user
-                offer.save()
+                with db_transaction.atomic():
+                    new_bank_detail.save()
+                    offer.bank_detail = new_bank_detail
+                    offer.save()
+                    notify_new_offer(request, offer)
+                    fan_out_offer(offer)
                 messages.success(
                     request,
                     'Your offer has been successfully created.'
                 )
-                notify_new_offer(request, offer.id)
                 return redirect('offer_detail', offer_id=offer.id)
 
             elif selection == 'existing':
@@ -107,10 +235,12 @@ def create_offer(request):
                     offer = offer_form.save(commit=False)
                     offer.bank_detail = selected_bank_detail
                     offer.author = request.user
-                    offer.save()
+                    with db_transaction.atomic():
+                        offer.save()
+                        notify_new_offer(request, offer)
+                        fan_out_offer(offer)
                     messages.success(request, 'Your offer has been '
                                               'successfully created.')
-                    notify_new_offer(request, offer.id)
                     return redirect('offer_detail',
                                     offer_id=offer.id)
                 except BankDetail.DoesNotExist:
@@ -176,6 +306,10 @@ def offer_detail(request, offer_id):
     mnt_to_usd = exchange_data['mnt_to_usd']
     required_amount = exchange_data['required_amount']
 
+    matching_offers = []
+    if offer.author == request.user:
+        matching_offers = propose_matches(offer, required_amount)
+
     transaction = None
     try:
         transaction = offer.transaction
@@ -194,5 +328,6 @@ def offer_detail(request, offer_id):
         'mnt_to_usd': mnt_to_usd,
         'required_amount': required_amount,
         'transaction': transaction,
+        'matching_offers': matching_offers,
     }
     return render(request, 'offers/offer_detail.html', context)
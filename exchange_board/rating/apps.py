@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class RatingConfig(AppConfig):
     name = 'rating'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,69 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from exchange_rates.matrix import RateMatrix
+from rating.reputation import compute_reputation
+from users.invite_tree import InviteTree
+
+
+class Command(BaseCommand):
+    help = ("Measures the batch reputation computation on synthetic "
+            "ratings, invite tree and transaction sizes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ratings', type=int, default=1000000)
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        users = options['users']
+        now = timezone.now()
+
+        tree = InviteTree(
+            [(1, None)] + [(user_id, rng.randrange(max(1, user_id - 50),
+                                                   user_id))
+                           for user_id in range(2, users + 1)]
+        )
+        matrix = RateMatrix.from_vector('USD', {'RUB': 90, 'MNT': 3420})
+
+        def to_usd(amount, code):
+            converted = matrix.convert(amount, code, 'USD')
+            return float(converted) if converted is not None else None
+
+        codes = ('USD', 'RUB', 'MNT')
+        amounts = [Decimal(rng.randint(10, 500000)) for _ in range(5000)]
+        started = time.perf_counter()
+        rows = [
+            (
+                rng.randrange(1, users + 1),
+                rng.randrange(1, users + 1),
+                rng.choice((3, 4, 4, 5, 5, 5)),
+                now - timedelta(seconds=rng.randrange(0, 3 * 365 * 86400)),
+                rng.choice(amounts),
+                rng.choice(codes),
+            )
+            for _ in range(options['ratings'])
+        ]
+        self.stdout.write(
+            f"generated {len(rows)} ratings for {users} users in "
+            f"{time.perf_counter() - started:.2f}s"
+        )
+
+        for label, kwargs in (
+                ('decay + prior', {}),
+                ('+ transaction size', {'to_usd': to_usd}),
+                ('+ handshakes', {'to_usd': to_usd,
+                                  'distance': tree.distance})):
+            started = time.perf_counter()
+            reputation = compute_reputation(rows, now, **kwargs)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{label}: {len(reputation)} users in {elapsed:.2f}s "
+                f"({elapsed / len(rows) * 1e6:.2f}µs per rating)"
+            )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from rating.models import Rating
+
+
+class Command(BaseCommand):
+    help = ("Rebuilds rating_sum, rating_count and aggregated_rating "
+            "for all users from their ratings.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        updated = Rating.recompute_user_ratings(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Recomputed ratings, {updated} users updated."
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from rating.reputation import update_reputation
+
+
+class Command(BaseCommand):
+    help = ("Recomputes the time-decayed Bayesian reputation of all users "
+            "from ratings and transaction sizes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        updated = update_reputation(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Reputation updated for {updated} users."
+        ))
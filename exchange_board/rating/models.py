@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+from django.db.models.functions import Cast
 from users.models import CustomUser
 
 
@@ -10,14 +12,95 @@ class Rating(models.Model):
     comment = models.TextField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Сохранённые значения нужны, чтобы при редактировании
+        # применить к рейтингу получателя только разницу
+        instance._saved_score = instance.__dict__.get('score')
+        instance._saved_recipient_id = instance.__dict__.get('recipient_id')
+        return instance
+
     def save(self, *args, **kwargs):
-        from transactions.models import Transaction
-        super(Rating, self).save(*args, **kwargs)
-        self.update_user_rating(self.recipient)
+        with transaction.atomic():
+            saved_recipient_id, saved_score = self._saved_values()
+            super(Rating, self).save(*args, **kwargs)
+            if saved_recipient_id is None:
+                self.adjust_user_rating(self.recipient_id, self.score, 1)
+            elif saved_recipient_id != self.recipient_id:
+                self.adjust_user_rating(saved_recipient_id, -saved_score, -1)
+                self.adjust_user_rating(self.recipient_id, self.score, 1)
+            elif saved_score != self.score:
+                self.adjust_user_rating(
+                    self.recipient_id, self.score - saved_score, 0
+                )
+        self._saved_score = self.score
+        self._saved_recipient_id = self.recipient_id
+
+    def _saved_values(self):
+        if self.pk is None:
+            return None, None
+        if hasattr(self, '_saved_score'):
+            return self._saved_recipient_id, self._saved_score
+        saved = Rating.objects.filter(pk=self.pk).values_list(
+            'recipient_id', 'score'
+        ).first()
+        return saved if saved else (None, None)
+
+    @staticmethod
+    def adjust_user_rating(user_id, score_delta, count_delta):
+        """
+        Применяет изменение суммы и числа оценок одним UPDATE без чтения
+        всех оценок пользователя. aggregated_rating стоит первым: MySQL
+        вычисляет присваивания слева направо, и средняя должна считаться
+        от старых значений, как в PostgreSQL и SQLite.
+        """
+        new_count = F('rating_count') + count_delta
+        CustomUser.objects.filter(pk=user_id).update(
+            aggregated_rating=Case(
+                When(rating_count=-count_delta, then=Value(0.0)),
+                default=(Cast(F('rating_sum') + score_delta, FloatField())
+                         / new_count),
+                output_field=FloatField()
+            ),
+            rating_sum=F('rating_sum') + score_delta,
+            rating_count=new_count,
+        )
 
     @staticmethod
-    def update_user_rating(user):
-        ratings = Rating.objects.filter(recipient=user)
-        total_score = sum(rating.score for rating in ratings)
-        user.aggregated_rating = total_score / ratings.count()
-        user.save()
+    def recompute_user_ratings(batch_size=1000):
+        """
+        Пересчитывает сумму, число и среднюю оценок всех пользователей
+        одним агрегирующим запросом и пакетными bulk_update. Возвращает
+        число исправленных пользователей.
+        """
+        totals = {
+            row['recipient']: (row['total'], row['count'])
+            for row in Rating.objects.order_by().values('recipient').annotate(
+                total=Sum('score'), count=Count('id')
+            )
+        }
+        fields = ['rating_sum', 'rating_count', 'aggregated_rating']
+        changed = []
+        updated = 0
+        users = CustomUser.objects.only('id', *fields).order_by(
+            'id'
+        ).iterator(chunk_size=batch_size)
+        for user in users:
+            total, count = totals.get(user.id, (0, 0))
+            average = total / count if count else 0.0
+            if (user.rating_sum, user.rating_count,
+                    user.aggregated_rating) == (total, count, average):
+                continue
+            user.rating_sum = total
+            user.rating_count = count
+            user.aggregated_rating = average
+            changed.append(user)
+            if len(changed) >= batch_size:
+                CustomUser.objects.bulk_update(changed, fields)
+                updated += len(changed)
+                changed = []
+        if changed:
+            CustomUser.objects.bulk_update(changed, fields)
+            updated += len(changed)
+        return updated
@@ -0,0 +1,142 @@
+import math
+
+from django.utils import timezone
+from exchange_rates.models import ExchangeRate
+from logging_app.loguru_config import logger
+from users.invite_tree import catch_up, get_invite_tree
+from users.models import CustomUser
+
+from .models import Rating
+
+HALF_LIFE_DAYS = 180
+PRIOR_WEIGHT = 5.0
+DEFAULT_PRIOR_MEAN = 3.0
+SIZE_REFERENCE_USD = 100
+MAX_SIZE_WEIGHT = 3.0
+FULL_WEIGHT_HANDSHAKES = 3
+MIN_HANDSHAKE_WEIGHT = 0.25
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def size_weight(amount_usd):
+    """Крупная сделка весит больше, но логарифмически и с потолком."""
+    if amount_usd is None:
+        return 1.0
+    return min(MAX_SIZE_WEIGHT,
+               1.0 + math.log10(1.0 + amount_usd / SIZE_REFERENCE_USD))
+
+
+def handshake_weight(handshakes):
+    """
+    Оценки от ближайших в дереве приглашений весят меньше: пригласивший
+    и приглашённый чаще всего знакомы, и их взаимные оценки легко накрутить.
+    """
+    if handshakes is None:
+        return 1.0
+    return max(MIN_HANDSHAKE_WEIGHT,
+               min(1.0, handshakes / FULL_WEIGHT_HANDSHAKES))
+
+
+def compute_reputation(rows, now, distance=None, to_usd=None,
+                       prior_weight=PRIOR_WEIGHT):
+    """
+    Байесовская репутация за один проход по оценкам. `rows` — кортежи
+    (получатель, автор, оценка, дата, сумма сделки, код валюты). Вес
+    оценки — затухание по возрасту × размер сделки × рукопожатия;
+    средняя сглаживается к общей взвешенной средней с весом
+    `prior_weight`. Возвращает {user_id: репутация}.
+    """
+    decay_rate = math.log(2) / (HALF_LIFE_DAYS * SECONDS_PER_DAY)
+    weights = {}
+    weighted_scores = {}
+    size_weights = {}
+    for recipient_id, author_id, score, created_at, amount, code in rows:
+        age = max(0.0, (now - created_at).total_seconds())
+        weight = math.exp(-decay_rate * age)
+
+        size_key = (amount, code)
+        if size_key not in size_weights:
+            size_weights[size_key] = size_weight(
+                to_usd(amount, code) if to_usd else None
+            )
+        weight *= size_weights[size_key]
+        if distance is not None:
+            weight *= handshake_weight(distance(author_id, recipient_id))
+
+        weights[recipient_id] = weights.get(recipient_id, 0.0) + weight
+        weighted_scores[recipient_id] = (
+            weighted_scores.get(recipient_id, 0.0) + weight * score
+        )
+
+    total_weight = sum(weights.values())
+    prior_mean = (sum(weighted_scores.values()) / total_weight
+                  if total_weight else DEFAULT_PRIOR_MEAN)
+    return {
+        user_id: ((prior_weight * prior_mean + weighted_scores[user_id])
+                  / (prior_weight + weight))
+        for user_id, weight in weights.items()
+    }
+
+
+def load_rating_rows(chunk_size=5000):
+    return Rating.objects.order_by().values_list(
+        'recipient_id',
+        'author_id',
+        'score',
+        'created_at',
+        'transaction__offer__amount_offered',
+        'transaction__offer__currency_offered__code',
+    ).iterator(chunk_size=chunk_size)
+
+
+def get_usd_converter():
+    try:
+        matrix = ExchangeRate.latest().get_matrix()
+    except ExchangeRate.DoesNotExist:
+        logger.error("Курсы валют недоступны, размер сделок в репутации "
+                     "не учитывается")
+        return None
+
+    def to_usd(amount, code):
+        converted = matrix.convert(amount, code, 'USD')
+        return float(converted) if converted is not None else None
+    return to_usd
+
+
+def update_reputation(batch_size=1000):
+    """
+    Пересчитывает репутацию всех пользователей: один потоковый запрос
+    по оценкам с суммами сделок и пакетная запись bulk_update.
+    Возвращает число пользователей с изменившейся репутацией.
+    """
+    logger.info("Пересчёт репутации пользователей")
+    tree = catch_up(get_invite_tree())
+    reputation = compute_reputation(
+        load_rating_rows(),
+        timezone.now(),
+        distance=tree.distance,
+        to_usd=get_usd_converter(),
+    )
+
+    changed = []
+    updated = 0
+    users = CustomUser.objects.only('id', 'reputation').order_by(
+        'id'
+    ).iterator(chunk_size=batch_size)
+    for user in users:
+        value = reputation.get(user.id)
+        if value is not None:
+            value = round(value, 4)
+        if user.reputation == value:
+            continue
+        user.reputation = value
+        changed.append(user)
+        if len(changed) >= batch_size:
+            CustomUser.objects.bulk_update(changed, ['reputation'])
+            updated += len(changed)
+            changed = []
+    if changed:
+        CustomUser.objects.bulk_update(changed, ['reputation'])
+        updated += len(changed)
+    logger.info(f"Репутация пересчитана: обновлено {updated} пользователей")
+    return updated
@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Rating
+
+
+@receiver(post_delete, sender=Rating)
+def subtract_deleted_rating(sender, instance, **kwargs):
+    # Удаление приходит и каскадом от транзакции или автора оценки
+    Rating.adjust_user_rating(
+        getattr(instance, '_saved_recipient_id', instance.recipient_id),
+        -getattr(instance, '_saved_score', instance.score),
+        -1
+    )
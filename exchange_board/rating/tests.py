@@ -1,11 +1,19 @@
+from datetime import timedelta
+from io import StringIO
+
 from bank_details.models import Currency
+from django.core.management import call_command
+from django.db import connection
 from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from offers.models import Offer
 from transactions.models import NO, OPEN, Transaction
 from users.models import CustomUser
 
 from .models import Rating
+from .reputation import compute_reputation, handshake_weight, size_weight
 from .views import rate_after_transaction
 
 
@@ -75,3 +83,150 @@ class RateAfterTransactionViewTest(TestCase):
             recipient=self.user2
         ).exists()
                         )
+
+
+class RatingAggregateTest(TestCase):
+
+    def setUp(self):
+        self.author = CustomUser.objects.create_user(
+            username='author', email='author@example.com', password='pass'
+        )
+        self.recipient = CustomUser.objects.create_user(
+            username='recipient', email='recipient@example.com',
+            password='pass'
+        )
+        usd = Currency.objects.create(code='USD', name='US Dollar')
+        rub = Currency.objects.create(code='RUB', name='Russian Ruble')
+        self.transactions = []
+        for _ in range(3):
+            offer = Offer.objects.create(
+                author=self.author, currency_offered=usd,
+                amount_offered=100, currency_needed=rub
+            )
+            self.transactions.append(Transaction.objects.create(
+                offer=offer, accepting_user=self.recipient, status=OPEN
+            ))
+
+    def rate(self, transaction, score):
+        return Rating.objects.create(
+            transaction=transaction, author=self.author,
+            recipient=self.recipient, score=score
+        )
+
+    def assertRating(self, rating_sum, rating_count, aggregated_rating):
+        self.recipient.refresh_from_db()
+        self.assertEqual(
+            (self.recipient.rating_sum, self.recipient.rating_count),
+            (rating_sum, rating_count)
+        )
+        self.assertAlmostEqual(self.recipient.aggregated_rating,
+                               aggregated_rating)
+
+    def test_new_ratings_update_totals_without_reading_ratings(self):
+        self.rate(self.transactions[0], 5)
+        rating = Rating(transaction=self.transactions[1], author=self.author,
+                        recipient=self.recipient, score=2)
+        with CaptureQueriesContext(connection) as context:
+            rating.save()
+        self.assertFalse(any(
+            query['sql'].startswith('SELECT')
+            for query in context.captured_queries
+        ))
+        self.assertRating(7, 2, 3.5)
+
+    def test_score_edit_applies_delta(self):
+        self.rate(self.transactions[0], 5)
+        self.rate(self.transactions[1], 3)
+        rating = Rating.objects.get(transaction=self.transactions[1])
+        rating.score = 1
+        rating.save()
+        self.assertRating(6, 2, 3.0)
+        rating.save()
+        self.assertRating(6, 2, 3.0)
+
+    def test_deletes_subtract_including_cascades(self):
+        first = self.rate(self.transactions[0], 4)
+        self.rate(self.transactions[1], 2)
+        self.transactions[1].delete()
+        self.assertRating(4, 1, 4.0)
+        first.delete()
+        self.assertRating(0, 0, 0.0)
+
+    def test_recompute_ratings_command(self):
+        self.rate(self.transactions[0], 5)
+        self.rate(self.transactions[1], 4)
+        CustomUser.objects.update(rating_sum=0, rating_count=0,
+                                  aggregated_rating=1.0)
+        call_command('recompute_ratings', stdout=StringIO())
+        self.assertRating(9, 2, 4.5)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.aggregated_rating, 0.0)
+
+
+class ReputationTest(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+
+    def rows(self, recipient_id, scores, age=timedelta(0), author_id=100,
+             amount=100, code='USD'):
+        return [(recipient_id, author_id, score, self.now - age, amount, code)
+                for score in scores]
+
+    def test_many_good_ratings_beat_a_single_perfect_one(self):
+        rows = (self.rows(1, [5])
+                + self.rows(2, [5] * 30 + [4] * 10)
+                + self.rows(3, [2] * 20))
+        reputation = compute_reputation(rows, self.now)
+        self.assertGreater(reputation[2], reputation[1])
+        self.assertLess(reputation[1], 5)
+
+    def test_old_ratings_fade(self):
+        rows = (self.rows(1, [1], age=timedelta(days=720))
+                + self.rows(1, [5])
+                + self.rows(2, [5], age=timedelta(days=720))
+                + self.rows(2, [1]))
+        reputation = compute_reputation(rows, self.now)
+        self.assertGreater(reputation[1], reputation[2])
+
+    def test_weights_by_size_and_handshakes(self):
+        self.assertGreater(size_weight(10000), size_weight(10))
+        self.assertEqual(handshake_weight(None), 1.0)
+        self.assertLess(handshake_weight(1), handshake_weight(3))
+
+        rows = (self.rows(1, [5], author_id=10) + self.rows(1, [1]))
+        near = {10: 1, 100: 5}
+        reputation = compute_reputation(
+            rows, self.now,
+            distance=lambda author_id, recipient_id: near[author_id]
+        )
+        self.assertLess(reputation[1], 3)
+
+    def test_update_reputation_stores_scores_for_display(self):
+        author = CustomUser.objects.create_user(
+            username='author', email='author@example.com', password='pass'
+        )
+        recipient = CustomUser.objects.create_user(
+            username='recipient', email='recipient@example.com',
+            password='pass'
+        )
+        usd = Currency.objects.create(code='USD', name='US Dollar')
+        rub = Currency.objects.create(code='RUB', name='Russian Ruble')
+        offer = Offer.objects.create(author=recipient, currency_offered=usd,
+                                     amount_offered=100, currency_needed=rub)
+        transaction = Transaction.objects.create(
+            offer=offer, accepting_user=author, status=OPEN
+        )
+        Rating.objects.create(transaction=transaction, author=author,
+                              recipient=recipient, score=4)
+
+        call_command('update_reputation', stdout=StringIO())
+
+        recipient.refresh_from_db()
+        author.refresh_from_db()
+        self.assertAlmostEqual(recipient.reputation, 4.0)
+        self.assertIsNone(author.reputation)
+
+        self.client.login(username='author', password='pass')
+        self.assertContains(self.client.get(reverse('index')),
+                            'Reputation: 4.00')
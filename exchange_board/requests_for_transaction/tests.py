@@ -1,10 +1,19 @@
+import threading
+
 from bank_details.models import BankDetail
-from django.test import Client, TestCase
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from exchange_rates.models import ExchangeRate
-from offers.models import Currency, Offer
+from notifications.models import EMAIL, TELEGRAM, OutboxMessage
+from offers.models import IN_PROGRESS, OPEN, Currency, Offer
 from transactions.models import Transaction
+from users.handshakes import handshake_counts
 from users.models import CustomUser
+from users.views import handshake_count
 
 from .models import RequestForTransaction
 
@@ -155,3 +164,265 @@ class TransactionRequestTestCase(TestCase):
             accepting_user=self.other_user
         ).exists()
         self.assertTrue(transaction_exists)
+
+
+class ApplicantListTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        ExchangeRate.invalidate_cache()
+        ExchangeRate.objects.create(
+            usd_to_rub=74.50,
+            mnt_to_rub=0.025,
+            mnt_to_usd=0.00034,
+            usd_to_rub_alternative=74.45
+        )
+        self.author = CustomUser.objects.create_user(
+            username='author',
+            email='author@mail.com',
+            password='12345',
+            referral_code='1-1-1',
+        )
+        currency = Currency.objects.create(name="USD", code="840")
+        self.offer = Offer.objects.create(
+            author=self.author,
+            currency_offered=currency,
+            amount_offered=100.00,
+            currency_needed=currency
+        )
+        self.currency = currency
+        self.client.login(username='author', password='12345')
+
+    def add_applicants(self, start, stop):
+        for number in range(start, stop):
+            applicant = CustomUser.objects.create_user(
+                username=f'applicant{number}',
+                email=f'applicant{number}@mail.com',
+                password='12345',
+                referral_code=f'2-{number}',
+            )
+            RequestForTransaction.objects.create(
+                offer=self.offer,
+                applicant=applicant,
+                bank_detail=BankDetail.objects.create(
+                    user=applicant,
+                    bank_name=f"Bank {number}",
+                    currency=self.currency
+                )
+            )
+
+    def count_queries(self):
+        url = reverse('view_requests_for_transaction',
+                      kwargs={'request_id': self.offer.id})
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_query_count_does_not_grow_with_applicants(self):
+        self.add_applicants(0, 3)
+        few, response = self.count_queries()
+        self.add_applicants(3, 50)
+        many, response = self.count_queries()
+        self.assertEqual(few, many)
+        self.assertContains(response, 'Bank 49')
+        self.assertEqual(
+            [data['handshakes'] for data in response.context['applicants_data']],
+            [5] * 50
+        )
+
+    def test_batch_matches_single_handshake_count(self):
+        codes = ['1', '1-1', '1-1-1', '1-1-1-2', '1-2-3', '2', '2-1']
+        for anchor in codes:
+            self.assertEqual(
+                handshake_counts(anchor, codes),
+                {code: handshake_count(anchor, code) for code in codes}
+            )
+        self.assertEqual(handshake_counts(None, ['1']), {'1': None})
+        self.assertEqual(handshake_counts('1', [None]), {None: None})
+
+
+def create_competing_requests(offer, currency, count):
+    requests = []
+    for number in range(count):
+        applicant = CustomUser.objects.create_user(
+            username=f'applicant{number}',
+            email=f'applicant{number}@mail.com',
+            password='12345',
+            referral_code=f'2-{number}',
+        )
+        requests.append(RequestForTransaction.objects.create(
+            offer=offer,
+            applicant=applicant,
+            bank_detail=BankDetail.objects.create(
+                user=applicant,
+                bank_name=f"Bank {number}",
+                currency=currency
+            )
+        ))
+    return requests
+
+
+class AcceptRequestTestCase(TestCase):
+
+    def setUp(self):
+        self.author = CustomUser.objects.create_user(
+            username='author',
+            email='author@mail.com',
+            password='12345',
+            referral_code='1',
+        )
+        currency = Currency.objects.create(name="USD", code="840")
+        self.offer = Offer.objects.create(
+            author=self.author,
+            currency_offered=currency,
+            amount_offered=100.00,
+            currency_needed=currency
+        )
+        self.requests = create_competing_requests(self.offer, currency, 4)
+        self.client.login(username='author', password='12345')
+
+    def accept(self, request_for_transaction):
+        return self.client.post(reverse(
+            'accept_request',
+            kwargs={'request_id': request_for_transaction.id}
+        ))
+
+    def test_accept_rejects_competing_requests(self):
+        self.accept(self.requests[1])
+        self.assertEqual(
+            list(RequestForTransaction.objects.order_by('id')
+                 .values_list('status', flat=True)),
+            ['REJECTED', 'ACCEPTED', 'REJECTED', 'REJECTED']
+        )
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.status, IN_PROGRESS)
+        self.assertEqual(
+            Transaction.objects.get().accepting_user_id,
+            self.requests[1].applicant_id
+        )
+
+    def test_second_accept_is_refused(self):
+        self.accept(self.requests[0])
+        response = self.accept(self.requests[2])
+        self.assertRedirects(
+            response,
+            reverse('view_requests_for_transaction',
+                    kwargs={'request_id': self.offer.id}),
+            fetch_redirect_response=False
+        )
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.requests[2].refresh_from_db()
+        self.assertEqual(self.requests[2].status, 'REJECTED')
+
+    def test_decision_notifications_are_queued(self):
+        self.accept(self.requests[0])
+        emails = OutboxMessage.objects.filter(channel=EMAIL).order_by('id')
+        self.assertEqual(
+            [message.data['recipients'] for message in emails],
+            [['applicant0@mail.com'], ['applicant1@mail.com'],
+             ['applicant2@mail.com'], ['applicant3@mail.com']]
+        )
+        self.assertEqual(emails[0].data['subject'],
+                         'Your application has been accepted')
+        self.assertEqual(
+            OutboxMessage.objects.filter(channel=TELEGRAM).count(), 1
+        )
+        self.assertEqual(mail.outbox, [])
+
+    def test_accepting_declined_request_keeps_offer_open(self):
+        RequestForTransaction.objects.filter(
+            id=self.requests[1].id
+        ).update(status='REJECTED')
+        response = self.accept(self.requests[1])
+        self.assertRedirects(
+            response,
+            reverse('view_requests_for_transaction',
+                    kwargs={'request_id': self.offer.id}),
+            fetch_redirect_response=False
+        )
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.status, OPEN)
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(OutboxMessage.objects.exists())
+        # Предложение можно принять с другим запросом
+        self.accept(self.requests[0])
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.status, IN_PROGRESS)
+
+    def test_refused_accept_queues_nothing(self):
+        self.accept(self.requests[0])
+        queued = OutboxMessage.objects.count()
+        self.accept(self.requests[2])
+        self.assertEqual(OutboxMessage.objects.count(), queued)
+
+
+class ConcurrentAcceptTestCase(TransactionTestCase):
+    APPLICANTS = 6
+
+    def setUp(self):
+        # Общая in-memory база SQLite не ждёт блокировок, а сразу
+        # отвечает "table is locked"
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("Parallel writes need a file or server database.")
+        CustomUser.objects.create_user(
+            username='author',
+            email='author@mail.com',
+            password='12345',
+            referral_code='1',
+        )
+        currency = Currency.objects.create(name="USD", code="840")
+        self.offer = Offer.objects.create(
+            author=CustomUser.objects.get(username='author'),
+            currency_offered=currency,
+            amount_offered=100.00,
+            currency_needed=currency
+        )
+        self.requests = create_competing_requests(self.offer, currency,
+                                                  self.APPLICANTS)
+
+    def accept(self, client, request_for_transaction, barrier, responses):
+        try:
+            barrier.wait()
+            responses.append(client.post(reverse(
+                'accept_request',
+                kwargs={'request_id': request_for_transaction.id}
+            )))
+        finally:
+            connection.close()
+
+    def test_only_one_accept_wins(self):
+        barrier = threading.Barrier(self.APPLICANTS)
+        responses = []
+        clients = []
+        for request in self.requests:
+            clients.append(Client())
+            clients[-1].login(username='author', password='12345')
+        threads = [
+            threading.Thread(target=self.accept,
+                             args=(client, request, barrier, responses))
+            for client, request in zip(clients, self.requests)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(responses), self.APPLICANTS)
+        self.assertEqual(Transaction.objects.count(), 1)
+        statuses = list(RequestForTransaction.objects.values_list(
+            'status', flat=True
+        ))
+        self.assertEqual(statuses.count('ACCEPTED'), 1)
+        self.assertEqual(statuses.count('REJECTED'), self.APPLICANTS - 1)
+        winner = RequestForTransaction.objects.get(status='ACCEPTED')
+        self.assertEqual(Transaction.objects.get().accepting_user_id,
+                         winner.applicant_id)
+        # Уведомления только от победившей транзакции
+        self.assertEqual(
+            OutboxMessage.objects.filter(channel=EMAIL).count(),
+            self.APPLICANTS
+        )
+        self.assertEqual(
+            OutboxMessage.objects.filter(channel=TELEGRAM).count(), 1
+        )
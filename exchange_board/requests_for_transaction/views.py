@@ -1,20 +1,21 @@
 from bank_details.forms import BankDetailForm
-from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.core.mail import send_mail
+from django.db import transaction as db_transaction
 from django.http import HttpResponseForbidden, HttpResponseNotFound
 from django.shortcuts import get_object_or_404, redirect, render
 from exchange_rates.views import (get_exchange_rate,
                                   get_required_amount_to_be_exchanged,
                                   update_exchange_rates)
 from logging_app.loguru_config import logger
-from notifications.views import send_acceptance_notification
+from notifications.mail import queue_email
+from notifications.views import queue_request_decision_notifications
 from offers.forms import OfferForm
-from offers.models import IN_PROGRESS, Offer
+from offers.models import IN_PROGRESS, OPEN, Offer
+from offers.order_book import discard_offer
 from requests_for_transaction.forms import RequestForm
 from transactions.models import Transaction
-from users.views import handshake_count
+from users.handshakes import handshake_counts
 
 from .models import RequestForTransaction
 
@@ -81,23 +82,17 @@ def create_request_for_transaction(request, offer_id):
                                             'Please try again.')
 
             if bank_detail_to_use:
-                RequestForTransaction.objects.create(
-                    offer=offer,
-                    applicant=request.user,
-                    bank_detail=bank_detail_to_use
-                )
-                author_email = offer.author.email
-                send_mail(
-                    'New Application for Your Offer',
-                    f'User {request.user.username} has submitted an '
-                    f'application for your offer. Please check '
-                    f'your account for details.',
-
-                    settings.DEFAULT_FROM_EMAIL,
-                    [author_email],
-                )
-                logger.info("Отправка имейла о поступлении"
-                            "отклика на офер")
+                with db_transaction.atomic():
+                    RequestForTransaction.objects.create(
+                        offer=offer,
+                        applicant=request.user,
+                        bank_detail=bank_detail_to_use
+                    )
+                    queue_email('new_application',
+                                {'applicant': request.user.username},
+                                [offer.author.email])
+                logger.info("Имейл о поступлении отклика на офер "
+                            "поставлен в очередь")
 
                 return redirect('offer_detail', offer_id=offer.id)
             logger.info("Запрос на транзакцию успешно создан")
@@ -125,40 +120,46 @@ def create_request_for_transaction(request, offer_id):
 
 @login_required
 def view_requests_for_transaction(request, request_id):
-    requests_for_transaction = RequestForTransaction.objects.filter(
-        offer__id=request_id
-    ).exclude(status='REJECTED')
-    offer = get_object_or_404(Offer, id=request_id)
-    if not requests_for_transaction.exists():
+    offer = get_object_or_404(
+        Offer.objects.select_related('currency_offered', 'currency_needed'),
+        id=request_id
+    )
+    requests_for_transaction = list(RequestForTransaction.objects.filter(
+        offer=offer
+    ).exclude(status='REJECTED').select_related('applicant', 'bank_detail'))
+    if not requests_for_transaction:
         logger.error(f"Запросы на транзакцию для предложения "
                      f"с ID {request_id} не найдены")
         return HttpResponseNotFound(
             'No requests found for this offer. '
             '<a href="/">Return to home</a>.'
         )
-    if requests_for_transaction.first().offer.author != request.user:
+    if offer.author_id != request.user.id:
         return HttpResponseForbidden(
             'You don\'t have permission to perform this action. '
             '<a href="/">Return to home</a>.'
         )
 
+    # Код текущего пользователя разбирается один раз на весь список
+    handshakes_by_code = handshake_counts(
+        request.user.referral_code,
+        [request_for_transaction.applicant.referral_code
+         for request_for_transaction in requests_for_transaction]
+    )
     applicants_data = []
     for request_for_transaction in requests_for_transaction:
         applicant = request_for_transaction.applicant
-        applicant_code = request_for_transaction.applicant.referral_code
-        current_user_code = request.user.referral_code
-        handshakes = handshake_count(applicant_code, current_user_code)
-        bank_details = request_for_transaction.bank_detail
-        aggregated_rating = applicant.aggregated_rating
+        applicant_code = applicant.referral_code
+        handshakes = handshakes_by_code[applicant_code] or 0
+        bank_detail = request_for_transaction.bank_detail
         applicants_data.append({
-            'applicant': request_for_transaction.applicant,
+            'applicant': applicant,
             'referral_code': applicant_code,
             'handshakes': handshakes,
             'handshake_range': range(handshakes),
             'request_for_transaction': request_for_transaction,
-            'aggregated_rating': aggregated_rating,
-            'bank_details': (request_for_transaction.bank_detail.bank_name
-                             if request_for_transaction.bank_detail else None)
+            'aggregated_rating': applicant.aggregated_rating,
+            'bank_details': bank_detail.bank_name if bank_detail else None
         })
 
     exchange_data = get_required_amount_to_be_exchanged(offer)
@@ -187,7 +188,7 @@ def view_requests_for_transaction(request, request_id):
 def accept_request(request, request_id):
     logger.info(f"Принятие запроса на транзакцию с ID {request_id}")
     request_for_transaction = get_object_or_404(
-        RequestForTransaction,
+        RequestForTransaction.objects.select_related('offer', 'applicant'),
         id=request_id
     )
     offer = request_for_transaction.offer
@@ -197,27 +198,60 @@ def accept_request(request, request_id):
             "You don't have permission to perform this action."
         )
 
-    request_for_transaction.status = 'ACCEPTED'
-    request_for_transaction.save()
-
-    offer.status = IN_PROGRESS
-    offer.save()
-
-    transaction, created = Transaction.objects.get_or_create(
-        offer=offer,
-        accepting_user=request_for_transaction.applicant
-    )
-    applicant_email = request_for_transaction.applicant.email
-    send_mail(
-        'Your application has been accepted',
-        'Your transaction request has been accepted. '
-        'Please check the transaction details on the website.',
-        settings.DEFAULT_FROM_EMAIL,
-        [applicant_email],
-        fail_silently=False,
-    )
-    send_acceptance_notification(request_for_transaction.applicant, offer)
+    with db_transaction.atomic():
+        # Первым же запросом блокируем строку предложения условным
+        # UPDATE: параллельные принятия ждут фиксации, и побеждает только
+        # первое. На SQLite запись в начале транзакции сразу берёт
+        # блокировку на запись и не упирается в взаимоблокировку
+        # читателей, как SELECT ... FOR UPDATE
+        taken = Offer.objects.filter(id=offer.id, status=OPEN).update(
+            status=IN_PROGRESS
+        )
+        if not taken:
+            logger.warning(f"Запрос {request_id} не принят: предложение "
+                           f"{offer.id} уже в работе")
+            messages.error(request, 'Another request for this offer '
+                                    'has already been accepted.')
+            return redirect('view_requests_for_transaction',
+                            request_id=offer.id)
+
+        # Статус запроса проверяем тем же условным UPDATE, а не по
+        # загруженному объекту: запрос могли отклонить после чтения
+        accepted = RequestForTransaction.objects.filter(
+            id=request_id,
+            status='PENDING'
+        ).update(status='ACCEPTED')
+        if not accepted:
+            # Предложение уже переведено в работу — откатываем, иначе
+            # оно останется IN_PROGRESS без принятого запроса
+            db_transaction.set_rollback(True)
+            logger.warning(f"Запрос {request_id} не принят: запрос уже "
+                           f"не ожидает решения")
+            messages.error(request, 'This request is no longer pending.')
+            return redirect('view_requests_for_transaction',
+                            request_id=offer.id)
+
+        competing = RequestForTransaction.objects.filter(
+            offer=offer,
+            status='PENDING'
+        ).exclude(id=request_id)
+        rejected_user_ids = list(
+            competing.values_list('applicant_id', flat=True)
+        )
+        competing.update(status='REJECTED')
 
+        transaction, created = Transaction.start(
+            offer,
+            request_for_transaction.applicant,
+            actor=request.user
+        )
+        # update() не шлёт post_save, книгу заявок обновляем сами
+        discard_offer(offer.id)
+        queue_request_decision_notifications(
+            offer, request_for_transaction.applicant, rejected_user_ids
+        )
+    logger.info(f"Запрос {request_id} принят, отклонено "
+                f"{len(rejected_user_ids)} других запросов")
     return redirect('transaction_detail', transaction_id=transaction.id)
 
 
@@ -263,8 +297,9 @@ def start_transaction(request, offer_id):
     offer.status = IN_PROGRESS
     offer.save()
 
-    transaction, created = Transaction.objects.get_or_create(
-        offer=offer,
-        accepting_user=request.user
+    transaction, created = Transaction.start(
+        offer,
+        request.user,
+        actor=request.user
     )
     return redirect('transactions/transaction_detail', transaction_id=transaction.id)
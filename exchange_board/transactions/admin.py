@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Transaction
+from .models import Transaction, TransactionEvent
 
 
 class TransactionAdmin(admin.ModelAdmin):
@@ -17,3 +17,24 @@ class TransactionAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Transaction, TransactionAdmin)
+
+
+class TransactionEventAdmin(admin.ModelAdmin):
+    list_display = (
+        'transaction', 'name', 'actor', 'status', 'created_at'
+    )
+    list_filter = (
+        'name',
+    )
+    readonly_fields = (
+        'transaction', 'name', 'actor', 'status', 'created_at'
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+admin.site.register(TransactionEvent, TransactionEventAdmin)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from transactions.models import READY, Screenshot
+from transactions.screenshots import (get_executor, import_legacy_screenshots,
+                                      process_screenshot)
+
+
+class Command(BaseCommand):
+    help = ("Links screenshots uploaded before the image pipeline and "
+            "builds display versions and thumbnails for all screenshots "
+            "that are not processed yet.")
+
+    def handle(self, *args, **options):
+        linked = import_legacy_screenshots()
+        pending = list(Screenshot.objects.exclude(
+            status=READY
+        ).values_list('id', flat=True))
+        results = list(get_executor().map(process_screenshot, pending))
+        self.stdout.write(self.style.SUCCESS(
+            f"Linked {linked} legacy screenshots, processed "
+            f"{results.count(True)} of {len(pending)}."
+        ))
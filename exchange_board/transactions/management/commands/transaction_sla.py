@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from transactions.timeline import close_time_summary
+
+
+class Command(BaseCommand):
+    help = ("Reports the time from request acceptance to close for "
+            "transactions closed in the last N days.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30)
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options['days'])
+        summary = close_time_summary(since=since)
+        if summary is None:
+            self.stdout.write("No transactions closed in this period.")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Closed transactions: {summary['count']}, median time to close: "
+            f"{summary['median'] / 3600:.1f} h, 90th percentile: "
+            f"{summary['p90'] / 3600:.1f} h, "
+            f"max: {summary['max'] / 3600:.1f} h"
+        ))
@@ -0,0 +1,42 @@
+# Generated by Django 2.2.19 on 2026-10-18 10:01
+
+from django.db import migrations, models
+
+CONFIRMATION_FIELDS = (
+    'author_asserts_transfer_done',
+    'accepting_user_confirms_money_received',
+    'accepting_user_asserts_transfer_done',
+    'author_confirms_money_received',
+)
+# Старые представления писали статусы в верхнем регистре, а 'IN_PROGRESS'
+# в колонку из 8 символов MySQL мог сохранить обрезанным
+LEGACY_STATUSES = {
+    'IN_PROGRESS': 'in progress',
+    'IN_PROGR': 'in progress',
+    'in progr': 'in progress',
+    'CLOSED': 'closed',
+}
+
+
+def normalize_values(apps, schema_editor):
+    Transaction = apps.get_model('transactions', 'Transaction')
+    for field in CONFIRMATION_FIELDS:
+        Transaction.objects.filter(**{field: 'YES'}).update(**{field: 'yes'})
+    for legacy, status in LEGACY_STATUSES.items():
+        Transaction.objects.filter(status=legacy).update(status=status)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0002_auto_20231102_0446'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='status',
+            field=models.CharField(choices=[('open', 'Transaction Opened'), ('in progress', 'In Process'), ('closed', 'Closed'), ('dispute', 'Dispute Opened')], default='open', max_length=11),
+        ),
+        migrations.RunPython(normalize_values, migrations.RunPython.noop),
+    ]
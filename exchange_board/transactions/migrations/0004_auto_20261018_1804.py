@@ -0,0 +1,35 @@
+# Generated by Django 2.2.19 on 2026-10-18 10:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('transactions', '0003_auto_20261018_1801'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(choices=[('accepted', 'Request accepted'), ('author_asserts_transfer_done', 'Author asserts transfer done'), ('accepting_user_confirms_money_received', 'Accepting user confirms money received'), ('accepting_user_asserts_transfer_done', 'Accepting user asserts transfer done'), ('author_confirms_money_received', 'Author confirms money received')], max_length=40)),
+                ('status', models.CharField(choices=[('open', 'Transaction Opened'), ('in progress', 'In Process'), ('closed', 'Closed'), ('dispute', 'Dispute Opened')], max_length=11)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transaction_events', to=settings.AUTH_USER_MODEL)),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='transactions.Transaction')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='transactionevent',
+            index=models.Index(fields=['transaction', 'created_at'], name='transaction_event_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionevent',
+            index=models.Index(fields=['created_at'], name='transaction_event_created_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.19 on 2026-10-18 10:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0004_auto_20261018_1804'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Screenshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('original', models.ImageField(upload_to='screenshots/originals/')),
+                ('display', models.ImageField(blank=True, null=True, upload_to='screenshots/display/')),
+                ('thumbnail', models.ImageField(blank=True, null=True, upload_to='screenshots/thumbnails/')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=7)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='accepting_user_screenshot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='transactions.Screenshot'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='author_screenshot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='transactions.Screenshot'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.19 on 2026-10-18 10:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0005_auto_20261018_1806'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transactionevent',
+            name='transaction',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='events', to='transactions.Transaction'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from offers.models import CLOSED as OFFER_CLOSED
 from offers.models import Offer
+from offers.order_book import discard_offer
 
 OPEN = 'open'
 IN_PROGRESS = 'in progress'
@@ -22,6 +24,102 @@ CONFIRMATION_CHOICES = [
     (NO, 'No')
 ]
 
+ACCEPTED = 'accepted'
+
+AUTHOR = 'author'
+ACCEPTING_USER = 'accepting_user'
+
+# Таблица переходов сделки: кто выполняет шаг, в каком состоянии должна
+# находиться строка ('source') и что в неё записывается ('target').
+# Шаг выполняется одним условным UPDATE, поэтому повторный клик или
+# одновременное действие второй стороны не может затереть чужую запись.
+TRANSITIONS = {
+    'author_asserts_transfer_done': {
+        'actor': AUTHOR,
+        'source': {
+            'status': OPEN,
+            'author_asserts_transfer_done': NO,
+        },
+        'target': {
+            'status': IN_PROGRESS,
+            'author_asserts_transfer_done': YES,
+        },
+    },
+    'accepting_user_confirms_money_received': {
+        'actor': ACCEPTING_USER,
+        'source': {
+            'status': IN_PROGRESS,
+            'author_asserts_transfer_done': YES,
+            'accepting_user_confirms_money_received': NO,
+        },
+        'target': {
+            'accepting_user_confirms_money_received': YES,
+        },
+    },
+    'accepting_user_asserts_transfer_done': {
+        'actor': ACCEPTING_USER,
+        'source': {
+            'status': IN_PROGRESS,
+            'accepting_user_confirms_money_received': YES,
+            'accepting_user_asserts_transfer_done': NO,
+        },
+        'target': {
+            'accepting_user_asserts_transfer_done': YES,
+        },
+    },
+    'author_confirms_money_received': {
+        'actor': AUTHOR,
+        'source': {
+            'status': IN_PROGRESS,
+            'accepting_user_confirms_money_received': YES,
+            'author_confirms_money_received': NO,
+        },
+        'target': {
+            'status': CLOSED,
+            'author_confirms_money_received': YES,
+        },
+    },
+}
+
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'failed'
+
+SCREENSHOT_STATUS_CHOICES = [
+    (PENDING, 'Pending'),
+    (READY, 'Ready'),
+    (FAILED, 'Failed'),
+]
+
+
+class Screenshot(models.Model):
+    """
+    Загруженный скриншот перевода. Одинаковые файлы хранятся один раз
+    (ключ — sha256 содержимого), сжатая версия и миниатюра создаются
+    в фоне, после чего статус становится READY.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    original = models.ImageField(upload_to='screenshots/originals/')
+    display = models.ImageField(
+        upload_to='screenshots/display/',
+        blank=True,
+        null=True
+    )
+    thumbnail = models.ImageField(
+        upload_to='screenshots/thumbnails/',
+        blank=True,
+        null=True
+    )
+    status = models.CharField(
+        max_length=7,
+        choices=SCREENSHOT_STATUS_CHOICES,
+        default=PENDING
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Screenshot {self.sha256[:12]} ({self.status})"
+
 
 class Transaction(models.Model):
     offer = models.OneToOneField(
@@ -44,6 +142,13 @@ class Transaction(models.Model):
         blank=True,
         null=True
     )
+    author_screenshot = models.ForeignKey(
+        Screenshot,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='+'
+    )
     accepting_user_confirms_money_received = models.CharField(
         max_length=3,
         choices=CONFIRMATION_CHOICES,
@@ -59,16 +164,153 @@ class Transaction(models.Model):
         blank=True,
         null=True
     )
+    accepting_user_screenshot = models.ForeignKey(
+        Screenshot,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='+'
+    )
     author_confirms_money_received = models.CharField(
         max_length=3,
         choices=CONFIRMATION_CHOICES,
         default=NO
     )
     status = models.CharField(
-        max_length=8,
+        max_length=11,
         choices=STATUS_CHOICES_TRANSACTION,
         default=OPEN
     )
 
     def __str__(self):
         return f"Transaction {self.offer} - {self.status}"
+
+    @classmethod
+    def start(cls, offer, accepting_user, actor=None):
+        """
+        Открывает сделку по предложению и в той же транзакции БД пишет
+        событие ACCEPTED — от него считается время до закрытия.
+        """
+        with transaction.atomic():
+            deal, created = cls.objects.get_or_create(
+                offer=offer,
+                accepting_user=accepting_user
+            )
+            if created:
+                TransactionEvent.objects.create(
+                    transaction=deal,
+                    name=ACCEPTED,
+                    actor=actor,
+                    status=deal.status,
+                )
+        return deal, created
+
+    def is_actor(self, user, name):
+        """Может ли `user` выполнить переход `name` в этой сделке."""
+        if TRANSITIONS[name]['actor'] == AUTHOR:
+            return self.offer.author_id == user.id
+        return self.accepting_user_id == user.id
+
+    def apply_transition(self, name, actor=None):
+        """
+        Выполняет переход `name` одним UPDATE ... WHERE по исходному
+        состоянию из TRANSITIONS. В той же транзакции БД пишется событие
+        в журнал, а закрытие сделки закрывает и предложение. Возвращает
+        False, если строка уже не в исходном состоянии, — тогда ничего
+        не меняется.
+        """
+        rule = TRANSITIONS[name]
+        with transaction.atomic():
+            applied = Transaction.objects.filter(
+                pk=self.pk, **rule['source']
+            ).update(**rule['target'])
+            if applied:
+                TransactionEvent.objects.create(
+                    transaction_id=self.pk,
+                    name=name,
+                    actor=actor,
+                    status=rule['target'].get('status',
+                                              rule['source']['status']),
+                )
+            if applied and rule['target'].get('status') == CLOSED:
+                Offer.objects.filter(pk=self.offer_id).update(
+                    status=OFFER_CLOSED
+                )
+                # update() не шлёт post_save, книгу заявок чистим сами
+                discard_offer(self.offer_id)
+        if applied:
+            for field, value in rule['target'].items():
+                setattr(self, field, value)
+        return bool(applied)
+
+
+EVENT_CHOICES = [
+    (ACCEPTED, 'Request accepted'),
+    ('author_asserts_transfer_done', 'Author asserts transfer done'),
+    ('accepting_user_confirms_money_received',
+     'Accepting user confirms money received'),
+    ('accepting_user_asserts_transfer_done',
+     'Accepting user asserts transfer done'),
+    ('author_confirms_money_received', 'Author confirms money received'),
+]
+
+
+class TransactionEventQuerySet(models.QuerySet):
+    """Запрещает массовые update() и delete() для журнала событий."""
+
+    def update(self, **kwargs):
+        raise ValueError("Transaction events are append-only.")
+
+    def delete(self):
+        raise ValueError("Transaction events are append-only.")
+
+
+class TransactionEvent(models.Model):
+    """
+    Журнал шагов сделки, только на добавление: событие пишется в той же
+    транзакции БД, что и сам шаг, и больше не меняется. Сделку с
+    событиями удалить нельзя — каскад стёр бы историю.
+    """
+    transaction = models.ForeignKey(
+        Transaction,
+        on_delete=models.PROTECT,
+        related_name='events'
+    )
+    name = models.CharField(max_length=40, choices=EVENT_CHOICES)
+    actor = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='transaction_events'
+    )
+    status = models.CharField(
+        max_length=11,
+        choices=STATUS_CHOICES_TRANSACTION
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = TransactionEventQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['transaction', 'created_at'],
+                name='transaction_event_time_idx'
+            ),
+            models.Index(
+                fields=['created_at'],
+                name='transaction_event_created_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.transaction_id}: {self.name} ({self.created_at})"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Transaction events are append-only.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Transaction events are append-only.")
@@ -0,0 +1,116 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import (FileResponse, Http404, HttpResponse,
+                         HttpResponseNotModified, StreamingHttpResponse)
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+NGINX = 'nginx'
+APACHE = 'apache'
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """
+    Один диапазон из заголовка Range: (начало, конец включительно).
+    None — отдать файл целиком (нет заголовка или несколько диапазонов),
+    ValueError — диапазон за пределами файла.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        # bytes=-N — последние N байт
+        start, end = max(0, size - int(end)), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+def read_range(file, length):
+    try:
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def stream_file(request, path, content_type):
+    """
+    Запасной вариант для разработки: файл отдаёт сам Django,
+    с поддержкой If-Modified-Since и одного диапазона Range.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404("File not found.")
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'),
+                              stat.st_mtime, stat.st_size):
+        return HttpResponseNotModified()
+
+    try:
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), stat.st_size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+
+    file = open(path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, end = byte_range
+        file.seek(start)
+        response = StreamingHttpResponse(
+            read_range(file, end - start + 1),
+            status=206,
+            content_type=content_type
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    return response
+
+
+def protected_file_response(request, name, max_age):
+    """
+    Ответ с файлом `name` из MEDIA_ROOT после проверки прав. В продакшене
+    файл отдаёт веб-сервер (диапазоны и условные запросы тоже на нём),
+    а воркер Django освобождается сразу:
+
+    - 'nginx': X-Accel-Redirect на internal location, например
+      location /protected-media/ { internal; alias <MEDIA_ROOT>/; }
+    - 'apache': X-Sendfile с абсолютным путём (mod_xsendfile).
+    """
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    server = getattr(settings, 'PROTECTED_MEDIA_SERVER', '')
+    if server == NGINX:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = (settings.PROTECTED_MEDIA_INTERNAL_URL
+                                        + quote(name))
+    elif server == APACHE:
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = default_storage.path(name)
+    else:
+        response = stream_file(request, default_storage.path(name),
+                               content_type)
+    # Файлы доступны только участникам сделки: общим кэшам их хранить нельзя
+    patch_cache_control(response, private=True, max_age=max_age)
+    patch_vary_headers(response, ('Cookie',))
+    return response
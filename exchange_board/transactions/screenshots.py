@@ -0,0 +1,193 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, connection, transaction
+from logging_app.loguru_config import logger
+from PIL import Image, ImageOps
+
+from .models import FAILED, READY, Screenshot, Transaction
+
+DISPLAY_SIZE = (1600, 1600)
+DISPLAY_QUALITY = 80
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_QUALITY = 75
+IMAGE_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif',
+                    'WEBP': '.webp', 'BMP': '.bmp'}
+
+# Поле с файлом и ссылка на обработанный скриншот для каждой стороны
+SCREENSHOT_FIELDS = {
+    'author': ('author_uploads_transfer_screenshot', 'author_screenshot'),
+    'accepting_user': ('accepting_user_uploads_transfer_screenshot',
+                       'accepting_user_screenshot'),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def content_hash(upload):
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def storage_name(folder, sha256, extension):
+    return f'screenshots/{folder}/{sha256[:2]}/{sha256}{extension}'
+
+
+def store_upload(upload):
+    """
+    Сохраняет загруженный файл по хэшу содержимого. Файл читается и
+    пишется кусками (большие загрузки Django уже держит во временном
+    файле на диске); повторная загрузка того же файла возвращает
+    существующий Screenshot без копии на диске.
+    """
+    sha256 = content_hash(upload)
+    screenshot = Screenshot.objects.filter(sha256=sha256).first()
+    if screenshot is not None:
+        logger.info(f"Скриншот {sha256[:12]} уже загружен, используем его")
+        return screenshot
+
+    # ImageField формы уже проверил файл и оставил открытое изображение
+    image_format = getattr(getattr(upload, 'image', None), 'format', None)
+    extension = (IMAGE_EXTENSIONS.get(image_format)
+                 or os.path.splitext(upload.name)[1].lower())
+    upload.seek(0)
+    name = default_storage.save(
+        storage_name('originals', sha256, extension), upload
+    )
+    try:
+        with transaction.atomic():
+            screenshot = Screenshot.objects.create(sha256=sha256,
+                                                   original=name)
+    except IntegrityError:
+        # Тот же файл одновременно загрузили в другом запросе
+        default_storage.delete(name)
+        return Screenshot.objects.get(sha256=sha256)
+    schedule_processing(screenshot.id)
+    return screenshot
+
+
+def attach_screenshot(deal, role, upload):
+    """Привязывает загрузку стороны `role` к сделке `deal`."""
+    file_field, screenshot_field = SCREENSHOT_FIELDS[role]
+    screenshot = store_upload(upload)
+    setattr(deal, file_field, screenshot.original.name)
+    setattr(deal, screenshot_field, screenshot)
+    deal.save(update_fields=[file_field, screenshot_field])
+    return screenshot
+
+
+def flatten(image):
+    """RGB без прозрачности: JPEG не умеет альфа-канал."""
+    if image.mode == 'RGB':
+        return image
+    rgba = image.convert('RGBA')
+    background = Image.new('RGB', rgba.size, 'white')
+    background.paste(rgba, mask=rgba.getchannel('A'))
+    return background
+
+
+def render_jpeg(image, size, quality):
+    """
+    Уменьшенная копия в JPEG. Новое изображение сохраняется без EXIF
+    и прочих метаданных исходного файла.
+    """
+    copy = image.copy()
+    copy.thumbnail(size, Image.LANCZOS)
+    buffer = BytesIO()
+    copy.save(buffer, 'JPEG', quality=quality, optimize=True,
+              progressive=True)
+    return ContentFile(buffer.getvalue())
+
+
+def process_screenshot(screenshot_id):
+    """Создаёт сжатую версию и миниатюру. Возвращает True при успехе."""
+    screenshot = Screenshot.objects.get(pk=screenshot_id)
+    try:
+        with screenshot.original.open('rb') as original:
+            with Image.open(original) as image:
+                image = flatten(ImageOps.exif_transpose(image))
+        display = default_storage.save(
+            storage_name('display', screenshot.sha256, '.jpg'),
+            render_jpeg(image, DISPLAY_SIZE, DISPLAY_QUALITY)
+        )
+        thumbnail = default_storage.save(
+            storage_name('thumbnails', screenshot.sha256, '.jpg'),
+            render_jpeg(image, THUMBNAIL_SIZE, THUMBNAIL_QUALITY)
+        )
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        logger.error(f"Не удалось обработать скриншот {screenshot_id}: "
+                     f"{error}")
+        Screenshot.objects.filter(pk=screenshot_id).update(status=FAILED)
+        return False
+    Screenshot.objects.filter(pk=screenshot_id).update(
+        display=display, thumbnail=thumbnail, status=READY
+    )
+    logger.info(f"Скриншот {screenshot_id} обработан")
+    return True
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'SCREENSHOT_WORKERS', 2),
+                thread_name_prefix='screenshot'
+            )
+        return _executor
+
+
+def _process_in_background(screenshot_id):
+    try:
+        process_screenshot(screenshot_id)
+    except Exception:
+        logger.exception(f"Ошибка фоновой обработки скриншота "
+                         f"{screenshot_id}")
+    finally:
+        connection.close()
+
+
+def schedule_processing(screenshot_id):
+    """Обработка уходит в пул потоков после фиксации транзакции БД."""
+    transaction.on_commit(
+        lambda: get_executor().submit(_process_in_background, screenshot_id)
+    )
+
+
+def import_legacy_screenshots():
+    """
+    Заводит Screenshot для файлов, загруженных до появления обработки:
+    файл остаётся на месте, сделка получает ссылку на запись.
+    Возвращает число привязанных файлов.
+    """
+    linked = 0
+    for file_field, screenshot_field in SCREENSHOT_FIELDS.values():
+        deals = Transaction.objects.filter(
+            **{f'{screenshot_field}__isnull': True,
+               f'{file_field}__gt': ''}
+        )
+        for deal in deals.iterator():
+            field_file = getattr(deal, file_field)
+            try:
+                with field_file.open('rb') as legacy:
+                    sha256 = content_hash(legacy)
+            except OSError:
+                logger.error(f"Файл {field_file.name} сделки {deal.id} "
+                             f"не найден")
+                continue
+            screenshot, created = Screenshot.objects.get_or_create(
+                sha256=sha256, defaults={'original': field_file.name}
+            )
+            setattr(deal, screenshot_field, screenshot)
+            deal.save(update_fields=[screenshot_field])
+            linked += 1
+    return linked
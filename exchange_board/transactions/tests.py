@@ -1,12 +1,67 @@
+import hashlib
+import json
+import random
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
 from bank_details.models import BankDetail, Currency
-from django.test import TestCase
+from comments.models import TransactionComment
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import ProtectedError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from exchange_rates.models import ExchangeRate
-from transactions.models import Transaction
+from offers.models import CLOSED as OFFER_CLOSED
+from offers.models import IN_PROGRESS as OFFER_IN_PROGRESS
+from PIL import Image
+from rating.models import Rating
+from requests_for_transaction.models import RequestForTransaction
+from transactions.models import (ACCEPTED, CLOSED, FAILED, IN_PROGRESS, NO,
+                                 OPEN, READY, TRANSITIONS, YES, Screenshot,
+                                 Transaction, TransactionEvent)
+from transactions.screenshots import (import_legacy_screenshots,
+                                      process_screenshot)
+from transactions.timeline import close_durations, median_time_to_close
 from users.models import CustomUser
 
 from .models import Offer
 
+STATE_FIELDS = (
+    'status',
+    'author_asserts_transfer_done',
+    'accepting_user_confirms_money_received',
+    'accepting_user_asserts_transfer_done',
+    'author_confirms_money_received',
+)
+
+
+def legal_states():
+    """Все состояния, достижимые из начального по таблице переходов."""
+    initial = (OPEN, NO, NO, NO, NO)
+    states = {initial}
+    queue = [initial]
+    while queue:
+        state = dict(zip(STATE_FIELDS, queue.pop()))
+        for rule in TRANSITIONS.values():
+            if all(state[field] == value
+                   for field, value in rule['source'].items()):
+                target = tuple({**state, **rule['target']}[field]
+                               for field in STATE_FIELDS)
+                if target not in states:
+                    states.add(target)
+                    queue.append(target)
+    return states
+
 
 class TransactionViewTests(TestCase):
 
@@ -92,7 +147,10 @@ class TransactionViewTests(TestCase):
     def test_author_confirms_money_received(self):
         transaction = Transaction.objects.create(
             offer=self.offer,
-            accepting_user=self.user2
+            accepting_user=self.user2,
+            status=IN_PROGRESS,
+            author_asserts_transfer_done=YES,
+            accepting_user_confirms_money_received=YES,
         )
         self.client.login(username='testuser1', password='password1')
 
@@ -102,7 +160,10 @@ class TransactionViewTests(TestCase):
         )
         self.assertEqual(response.status_code, 302)
         transaction.refresh_from_db()
-        self.assertEqual(transaction.author_confirms_money_received, 'YES')
+        self.assertEqual(transaction.author_confirms_money_received, YES)
+        self.assertEqual(transaction.status, CLOSED)
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.status, OFFER_CLOSED)
 
     def test_offer_detail_view(self):
         self.client.login(username='testuser1', password='password1')
@@ -155,12 +216,16 @@ class TransactionViewTests(TestCase):
         )
         self.assertEqual(response.status_code, 302)
         transaction.refresh_from_db()
-        self.assertEqual(transaction.author_asserts_transfer_done, 'YES')
+        self.assertEqual(transaction.author_asserts_transfer_done, YES)
+        self.assertEqual(transaction.status, IN_PROGRESS)
 
     def test_accepting_user_asserts_transfer_done(self):
         transaction = Transaction.objects.create(
             offer=self.offer,
-            accepting_user=self.user2
+            accepting_user=self.user2,
+            status=IN_PROGRESS,
+            author_asserts_transfer_done=YES,
+            accepting_user_confirms_money_received=YES,
         )
         self.client.login(username='testuser2', password='password2')
         response = self.client.get(reverse(
@@ -171,5 +236,596 @@ class TransactionViewTests(TestCase):
         transaction.refresh_from_db()
         self.assertEqual(
             transaction.accepting_user_asserts_transfer_done,
-            'YES'
+            YES
+        )
+
+
+class TransactionStateMachineTests(TestCase):
+
+    def setUp(self):
+        self.author = CustomUser.objects.create_user(
+            username='author', email='author@email.com',
+            password='password1'
+        )
+        self.accepting_user = CustomUser.objects.create_user(
+            username='accepting', email='accepting@email.com',
+            password='password2'
+        )
+        usd, created = Currency.objects.get_or_create(code='USD')
+        rub, created = Currency.objects.get_or_create(code='RUB')
+        self.offer = Offer.objects.create(
+            author=self.author,
+            currency_offered=usd,
+            amount_offered=50,
+            currency_needed=rub,
+            status=OFFER_IN_PROGRESS,
+        )
+        self.transaction = Transaction.objects.create(
+            offer=self.offer,
+            accepting_user=self.accepting_user
+        )
+
+    def state(self):
+        return tuple(Transaction.objects.filter(
+            pk=self.transaction.pk
+        ).values_list(*STATE_FIELDS).get())
+
+    def test_full_flow_closes_offer(self):
+        for name in ('author_asserts_transfer_done',
+                     'accepting_user_confirms_money_received',
+                     'accepting_user_asserts_transfer_done',
+                     'author_confirms_money_received'):
+            self.assertTrue(self.transaction.apply_transition(name))
+        self.assertEqual(self.state(), (CLOSED, YES, YES, YES, YES))
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.status, OFFER_CLOSED)
+
+    def test_repeated_step_is_rejected(self):
+        self.assertTrue(
+            self.transaction.apply_transition('author_asserts_transfer_done')
+        )
+        stale = Transaction.objects.get(pk=self.transaction.pk)
+        stale.status = OPEN
+        stale.author_asserts_transfer_done = NO
+        self.assertFalse(stale.apply_transition('author_asserts_transfer_done'))
+        self.assertEqual(self.state(), (IN_PROGRESS, YES, NO, NO, NO))
+
+    def test_step_out_of_order_is_rejected(self):
+        self.assertFalse(self.transaction.apply_transition(
+            'author_confirms_money_received'
+        ))
+        self.assertEqual(self.state(), (OPEN, NO, NO, NO, NO))
+        self.offer.refresh_from_db()
+        self.assertEqual(self.offer.status, OFFER_IN_PROGRESS)
+
+    def test_other_party_is_forbidden(self):
+        self.client.login(username='accepting', password='password2')
+        response = self.client.get(reverse(
+            'author_confirms_money_received', args=[self.transaction.id]
+        ))
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.state(), (OPEN, NO, NO, NO, NO))
+
+
+class ConcurrentTransitionsTestCase(TransactionTestCase):
+    THREADS = 8
+    ROUNDS = 20
+
+    def setUp(self):
+        # Общая in-memory база SQLite не ждёт блокировок, а сразу
+        # отвечает "table is locked"
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("Parallel writes need a file or server database.")
+        author = CustomUser.objects.create_user(
+            username='author', email='author@email.com',
+            password='password1'
+        )
+        accepting_user = CustomUser.objects.create_user(
+            username='accepting', email='accepting@email.com',
+            password='password2'
+        )
+        usd, created = Currency.objects.get_or_create(code='USD')
+        rub, created = Currency.objects.get_or_create(code='RUB')
+        self.offers = [
+            Offer.objects.create(
+                author=author,
+                currency_offered=usd,
+                amount_offered=50,
+                currency_needed=rub,
+                status=OFFER_IN_PROGRESS,
+            )
+            for _ in range(self.ROUNDS)
+        ]
+        self.transactions = [
+            Transaction.objects.create(offer=offer,
+                                       accepting_user=accepting_user)
+            for offer in self.offers
+        ]
+
+    def fire(self, seed, barrier, applied):
+        names = list(TRANSITIONS)
+        shuffle = random.Random(seed).shuffle
+        try:
+            for transaction in self.transactions:
+                shuffle(names)
+                barrier.wait()
+                for name in names:
+                    # Каждый поток работает со своей, устаревшей копией строки
+                    copy = Transaction(pk=transaction.pk,
+                                       offer_id=transaction.offer_id)
+                    if copy.apply_transition(name):
+                        applied.append((transaction.pk, name))
+        finally:
+            connection.close()
+
+    def test_final_state_is_always_legal(self):
+        barrier = threading.Barrier(self.THREADS)
+        applied = []
+        threads = [
+            threading.Thread(target=self.fire,
+                             args=(seed, barrier, applied))
+            for seed in range(self.THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Каждый шаг выполнен не больше одного раза
+        self.assertEqual(len(applied), len(set(applied)))
+        allowed = legal_states()
+        rows = Transaction.objects.filter(
+            pk__in=[transaction.pk for transaction in self.transactions]
+        ).values_list('offer__status', *STATE_FIELDS)
+        for offer_status, *state in rows:
+            self.assertIn(tuple(state), allowed)
+            self.assertEqual(offer_status == OFFER_CLOSED,
+                             state[0] == CLOSED)
+
+
+class TransactionEventTests(TestCase):
+
+    def setUp(self):
+        self.author = CustomUser.objects.create_user(
+            username='author', email='author@email.com',
+            password='password1'
+        )
+        self.accepting_user = CustomUser.objects.create_user(
+            username='accepting', email='accepting@email.com',
+            password='password2'
+        )
+        usd, created = Currency.objects.get_or_create(code='USD')
+        rub, created = Currency.objects.get_or_create(code='RUB')
+        self.offer = Offer.objects.create(
+            author=self.author,
+            currency_offered=usd,
+            amount_offered=50,
+            currency_needed=rub,
+            status=OFFER_IN_PROGRESS,
+        )
+        self.transaction, created = Transaction.start(
+            self.offer, self.accepting_user, actor=self.author
+        )
+
+    def run_flow(self):
+        for name in TRANSITIONS:
+            actor = (self.author if TRANSITIONS[name]['actor'] == 'author'
+                     else self.accepting_user)
+            self.assertTrue(self.transaction.apply_transition(name, actor))
+
+    def test_each_step_is_logged(self):
+        self.run_flow()
+        self.assertFalse(self.transaction.apply_transition(
+            'author_confirms_money_received', self.author
+        ))
+        events = list(self.transaction.events.order_by('created_at', 'id')
+                      .values_list('name', 'actor', 'status'))
+        self.assertEqual(events, [
+            (ACCEPTED, self.author.id, OPEN),
+            ('author_asserts_transfer_done', self.author.id, IN_PROGRESS),
+            ('accepting_user_confirms_money_received',
+             self.accepting_user.id, IN_PROGRESS),
+            ('accepting_user_asserts_transfer_done',
+             self.accepting_user.id, IN_PROGRESS),
+            ('author_confirms_money_received', self.author.id, CLOSED),
+        ])
+
+    def backdate(self, name, created_at):
+        # Журнал запрещает update() через objects; в тестах сдвигаем
+        # время событий в обход запрета
+        TransactionEvent._base_manager.filter(name=name).update(
+            created_at=created_at
+        )
+
+    def test_events_are_append_only(self):
+        event = self.transaction.events.get()
+        with self.assertRaises(ValueError):
+            event.save()
+        with self.assertRaises(ValueError):
+            event.delete()
+
+    def test_event_querysets_are_append_only(self):
+        events = TransactionEvent.objects.filter(
+            transaction=self.transaction
+        )
+        with self.assertRaises(ValueError):
+            events.update(status=CLOSED)
+        with self.assertRaises(ValueError):
+            events.delete()
+        with self.assertRaises(ValueError):
+            self.transaction.events.all().delete()
+        with self.assertRaises(ProtectedError):
+            self.transaction.delete()
+        self.assertEqual(events.count(), 1)
+
+    def test_timeline_api_streams_events_to_parties(self):
+        self.run_flow()
+        self.client.login(username='accepting', password='password2')
+        response = self.client.get(reverse(
+            'transaction_timeline_api', args=[self.transaction.id]
+        ))
+        self.assertEqual(response.status_code, 200)
+        events = [json.loads(line) for line in
+                  b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([event['name'] for event in events],
+                         [ACCEPTED] + list(TRANSITIONS))
+
+        CustomUser.objects.create_user(
+            username='other', email='other@email.com', password='password3'
+        )
+        self.client.login(username='other', password='password3')
+        response = self.client.get(reverse(
+            'transaction_timeline_api', args=[self.transaction.id]
+        ))
+        self.assertEqual(response.status_code, 403)
+
+    def test_range_api_filters_by_time(self):
+        self.run_flow()
+        now = timezone.now()
+        self.backdate(ACCEPTED, now - timedelta(days=2))
+        CustomUser.objects.create_superuser(
+            username='admin', email='admin@email.com', password='password3'
+        )
+        self.client.login(username='admin', password='password3')
+        response = self.client.get(reverse('events_timeline_api'), {
+            'since': (now - timedelta(days=1)).isoformat(),
+        })
+        names = [json.loads(line)['name'] for line in
+                 b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(names, list(TRANSITIONS))
+
+        response = self.client.get(reverse('events_timeline_api'),
+                                   {'until': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+        self.client.login(username='author', password='password1')
+        response = self.client.get(reverse('events_timeline_api'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_median_time_to_close(self):
+        self.run_flow()
+        now = timezone.now()
+        self.backdate(ACCEPTED, now - timedelta(hours=3))
+        self.backdate('author_confirms_money_received',
+                      now - timedelta(hours=1))
+        self.assertEqual(close_durations(), {self.transaction.id: 7200.0})
+        self.assertEqual(median_time_to_close(), 7200.0)
+        self.assertIsNone(median_time_to_close(since=now))
+
+        out = StringIO()
+        call_command('transaction_sla', stdout=out)
+        self.assertIn('median time to close: 2.0 h', out.getvalue())
+
+
+class TransactionDetailQueryTests(TestCase):
+
+    def setUp(self):
+        self.author = CustomUser.objects.create_user(
+            username='author', email='author@email.com',
+            password='password1', referral_code='1'
+        )
+        self.accepting_user = CustomUser.objects.create_user(
+            username='accepting', email='accepting@email.com',
+            password='password2', referral_code='1-1'
+        )
+        CustomUser.objects.create_user(
+            username='other', email='other@email.com',
+            password='password3', referral_code='2'
+        )
+        usd, created = Currency.objects.get_or_create(code='USD')
+        rub, created = Currency.objects.get_or_create(code='RUB')
+        ExchangeRate.objects.create(
+            usd_to_rub=70.00,
+            mnt_to_rub=250.00,
+            mnt_to_usd=0.035,
+            usd_to_rub_alternative=74.5,
+        )
+        self.offer = Offer.objects.create(
+            author=self.author,
+            currency_offered=usd,
+            amount_offered=50,
+            currency_needed=rub,
+            status=OFFER_IN_PROGRESS,
+            bank_detail=BankDetail.objects.create(
+                user=self.author, currency=rub, bank_name='Author bank'
+            ),
+        )
+        RequestForTransaction.objects.create(
+            offer=self.offer,
+            applicant=self.accepting_user,
+            bank_detail=BankDetail.objects.create(
+                user=self.accepting_user, currency=usd,
+                bank_name='Accepting bank'
+            ),
+        )
+        self.transaction, created = Transaction.start(
+            self.offer, self.accepting_user, actor=self.author
         )
+        self.url = reverse('transaction_detail', args=[self.transaction.id])
+
+    def add_comments(self, count):
+        TransactionComment.objects.bulk_create(
+            TransactionComment(
+                transaction=self.transaction,
+                author=(self.author, self.accepting_user)[number % 2],
+                content=f'comment {number}'
+            )
+            for number in range(count)
+        )
+
+    def test_query_count_does_not_grow_with_comments(self):
+        self.client.login(username='author', password='password1')
+        self.add_comments(2)
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get(self.url)
+        self.assertContains(response, 'Accepting bank')
+
+        self.add_comments(8)
+        Rating.objects.create(transaction=self.transaction,
+                              author=self.author,
+                              recipient=self.accepting_user, score=5)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(self.url)
+        self.assertContains(response, 'comment 7')
+        self.assertEqual(len(few), len(many))
+        # Сессия и пользователь, сделка, реквизиты заявки, комментарии
+        self.assertLessEqual(len(many), 6)
+
+    def test_forbidden_user_is_rejected_after_one_query(self):
+        self.client.login(username='other', password='password3')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+        # Сессия и пользователь, затем только сама сделка
+        self.assertEqual(len(context), 3)
+
+    def test_forbidden_user_cannot_comment(self):
+        self.client.login(username='other', password='password3')
+        response = self.client.post(self.url, {'content': 'spam'})
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(TransactionComment.objects.exists())
+
+
+def make_image(size=(2000, 1200), mode='RGBA', image_format='PNG', **params):
+    buffer = BytesIO()
+    Image.new(mode, size, (200, 30, 30, 128)[:len(mode)]).save(
+        buffer, image_format, **params
+    )
+    return buffer.getvalue()
+
+
+class ScreenshotPipelineTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.author = CustomUser.objects.create_user(
+            username='author', email='author@email.com',
+            password='password1', referral_code='1'
+        )
+        self.accepting_user = CustomUser.objects.create_user(
+            username='accepting', email='accepting@email.com',
+            password='password2', referral_code='1-1'
+        )
+        ExchangeRate.objects.create(
+            usd_to_rub=70.00,
+            mnt_to_rub=250.00,
+            mnt_to_usd=0.035,
+            usd_to_rub_alternative=74.5,
+        )
+        usd, created = Currency.objects.get_or_create(code='USD')
+        rub, created = Currency.objects.get_or_create(code='RUB')
+        offer = Offer.objects.create(
+            author=self.author,
+            currency_offered=usd,
+            amount_offered=50,
+            currency_needed=rub,
+            status=OFFER_IN_PROGRESS,
+        )
+        self.transaction, created = Transaction.start(
+            offer, self.accepting_user, actor=self.author
+        )
+
+    def upload(self, content, username='author', password='password1',
+               url='author_uploads_screenshot',
+               field='author_uploads_transfer_screenshot'):
+        self.client.login(username=username, password=password)
+        return self.client.post(
+            reverse(url, args=[self.transaction.id]),
+            {field: SimpleUploadedFile('IMG_0001.PNG', content)}
+        )
+
+    @patch('transactions.screenshots.schedule_processing')
+    def test_identical_uploads_are_stored_once(self, mock_schedule):
+        content = make_image()
+        self.assertEqual(self.upload(content).status_code, 302)
+        self.assertEqual(self.upload(
+            content, 'accepting', 'password2',
+            'accepting_user_uploads_screenshot',
+            'accepting_user_uploads_transfer_screenshot'
+        ).status_code, 302)
+
+        screenshot = Screenshot.objects.get()
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.author_screenshot, screenshot)
+        self.assertEqual(self.transaction.accepting_user_screenshot,
+                         screenshot)
+        self.assertEqual(
+            self.transaction.author_uploads_transfer_screenshot.name,
+            screenshot.original.name
+        )
+        self.assertTrue(screenshot.original.name.endswith(
+            f'{hashlib.sha256(content).hexdigest()}.png'
+        ))
+        mock_schedule.assert_called_once_with(screenshot.id)
+
+    @patch('transactions.screenshots.schedule_processing')
+    def test_processing_builds_stripped_renditions(self, mock_schedule):
+        exif = Image.Exif()
+        exif[0x010F] = 'PhoneMaker'
+        self.upload(make_image(mode='RGB', image_format='JPEG',
+                               exif=exif.tobytes()))
+        screenshot = Screenshot.objects.get()
+
+        self.assertTrue(process_screenshot(screenshot.id))
+        screenshot.refresh_from_db()
+        self.assertEqual(screenshot.status, READY)
+        with Image.open(screenshot.thumbnail.path) as thumbnail:
+            self.assertLessEqual(max(thumbnail.size), 320)
+            self.assertEqual(dict(thumbnail.getexif()), {})
+        with Image.open(screenshot.display.path) as display:
+            self.assertEqual(display.size, (1600, 960))
+            self.assertEqual(display.format, 'JPEG')
+
+        self.client.login(username='accepting', password='password2')
+        Transaction.objects.filter(pk=self.transaction.pk).update(
+            author_asserts_transfer_done=YES, status=IN_PROGRESS
+        )
+        response = self.client.get(reverse('transaction_detail',
+                                           args=[self.transaction.id]))
+        self.assertContains(response, screenshot.thumbnail.url)
+        self.assertContains(response, screenshot.original.url)
+
+    def test_broken_image_is_marked_failed(self):
+        screenshot = Screenshot.objects.create(
+            sha256='0' * 64,
+            original=default_storage.save('screenshots/broken.png',
+                                          ContentFile(b'not an image'))
+        )
+        self.assertFalse(process_screenshot(screenshot.id))
+        screenshot.refresh_from_db()
+        self.assertEqual(screenshot.status, FAILED)
+
+    def test_legacy_uploads_are_linked(self):
+        name = default_storage.save('screenshots/legacy.png',
+                                    ContentFile(make_image()))
+        Transaction.objects.filter(pk=self.transaction.pk).update(
+            author_uploads_transfer_screenshot=name
+        )
+        self.assertEqual(import_legacy_screenshots(), 1)
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.author_screenshot.original.name,
+                         name)
+        self.assertEqual(import_legacy_screenshots(), 0)
+
+
+class ProtectedMediaTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root,
+                                              PROTECTED_MEDIA_SERVER='')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        author = CustomUser.objects.create_user(
+            username='author', email='author@email.com', password='password1'
+        )
+        accepting_user = CustomUser.objects.create_user(
+            username='accepting', email='accepting@email.com',
+            password='password2'
+        )
+        CustomUser.objects.create_user(
+            username='other', email='other@email.com', password='password3'
+        )
+        usd, created = Currency.objects.get_or_create(code='USD')
+        rub, created = Currency.objects.get_or_create(code='RUB')
+        offer = Offer.objects.create(
+            author=author,
+            currency_offered=usd,
+            amount_offered=50,
+            currency_needed=rub,
+            status=OFFER_IN_PROGRESS,
+        )
+        self.content = make_image(size=(20, 20))
+        sha256 = hashlib.sha256(self.content).hexdigest()
+        self.name = default_storage.save(
+            f'screenshots/originals/{sha256[:2]}/{sha256}.png',
+            ContentFile(self.content)
+        )
+        screenshot = Screenshot.objects.create(sha256=sha256,
+                                               original=self.name)
+        Transaction.objects.create(
+            offer=offer,
+            accepting_user=accepting_user,
+            author_uploads_transfer_screenshot=self.name,
+            author_screenshot=screenshot,
+        )
+        self.url = screenshot.original.url
+
+    def test_parties_get_the_file(self):
+        self.client.login(username='accepting', password='password2')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        response = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_other_users_are_forbidden(self):
+        self.client.login(username='other', password='password3')
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        response = self.client.get('/media/screenshots/../db.sqlite3')
+        self.assertEqual(response.status_code, 404)
+
+    def test_range_requests(self):
+        self.client.login(username='author', password='password1')
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content),
+                         self.content[:10])
+        self.assertEqual(response['Content-Range'],
+                         f'bytes 0-9/{len(self.content)}')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content),
+                         self.content[-5:])
+
+        response = self.client.get(
+            self.url, HTTP_RANGE=f'bytes={len(self.content)}-'
+        )
+        self.assertEqual(response.status_code, 416)
+
+    def test_front_end_server_sends_the_file(self):
+        self.client.login(username='author', password='password1')
+        with self.settings(PROTECTED_MEDIA_SERVER='nginx'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'],
+                         f'/protected-media/{self.name}')
+        self.assertEqual(response.content, b'')
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+
+        with self.settings(PROTECTED_MEDIA_SERVER='apache'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'],
+                         default_storage.path(self.name))
@@ -0,0 +1,87 @@
+import json
+import statistics
+
+from .models import ACCEPTED, TransactionEvent
+
+CLOSING_EVENT = 'author_confirms_money_received'
+EVENT_FIELDS = ('id', 'transaction_id', 'name', 'actor_id', 'status',
+                'created_at')
+
+
+def events_between(since=None, until=None):
+    """
+    События всех сделок за полуинтервал [since, until) в порядке
+    времени. Запрос идёт по индексу created_at.
+    """
+    events = TransactionEvent.objects.all()
+    if since is not None:
+        events = events.filter(created_at__gte=since)
+    if until is not None:
+        events = events.filter(created_at__lt=until)
+    return events.order_by('created_at', 'id')
+
+
+def transaction_events(transaction_id):
+    """События одной сделки по индексу (transaction_id, created_at)."""
+    return TransactionEvent.objects.filter(
+        transaction_id=transaction_id
+    ).order_by('created_at', 'id')
+
+
+def stream_events(events, chunk_size=2000):
+    """
+    Построчный JSON (по событию на строку) без загрузки всей выборки
+    в память — подходит для StreamingHttpResponse.
+    """
+    rows = events.values_list(*EVENT_FIELDS).iterator(chunk_size=chunk_size)
+    for row in rows:
+        event = dict(zip(EVENT_FIELDS, row))
+        event['created_at'] = event['created_at'].isoformat()
+        yield json.dumps(event) + '\n'
+
+
+def close_durations(since=None, until=None):
+    """
+    Время от принятия заявки до закрытия сделки в секундах для сделок,
+    закрытых в [since, until). Один запрос по журналу событий.
+    """
+    closing = events_between(since, until).filter(name=CLOSING_EVENT)
+    rows = TransactionEvent.objects.filter(
+        name__in=(ACCEPTED, CLOSING_EVENT),
+        transaction_id__in=closing.values('transaction_id')
+    ).order_by().values_list('transaction_id', 'name', 'created_at')
+
+    accepted_at = {}
+    closed_at = {}
+    for transaction_id, name, created_at in rows.iterator():
+        if name == ACCEPTED:
+            accepted_at[transaction_id] = created_at
+        else:
+            closed_at[transaction_id] = created_at
+    return {
+        transaction_id: (closed - accepted_at[transaction_id]).total_seconds()
+        for transaction_id, closed in closed_at.items()
+        if transaction_id in accepted_at
+    }
+
+
+def close_time_summary(since=None, until=None):
+    """
+    Сводка по времени закрытия сделок в [since, until) в секундах:
+    число сделок, медиана, 90-й перцентиль и максимум; None без данных.
+    """
+    durations = sorted(close_durations(since, until).values())
+    if not durations:
+        return None
+    return {
+        'count': len(durations),
+        'median': statistics.median(durations),
+        'p90': durations[min(len(durations) - 1, int(len(durations) * 0.9))],
+        'max': durations[-1],
+    }
+
+
+def median_time_to_close(since=None, until=None):
+    """Медиана времени от принятия до закрытия или None без данных."""
+    summary = close_time_summary(since, until)
+    return summary['median'] if summary else None
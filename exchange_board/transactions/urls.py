@@ -31,4 +31,12 @@ urlpatterns = [
          views.accepting_user_asserts_transfer_done,
          name='accepting_user_asserts_transfer_done'
          ),
+    path('<int:transaction_id>/events/',
+         views.transaction_timeline_api,
+         name='transaction_timeline_api'
+         ),
+    path('events/',
+         views.events_timeline_api,
+         name='events_timeline_api'
+         ),
 ]
@@ -1,11 +1,20 @@
+import posixpath
+import re
+
 from comments.forms import TransactionCommentForm
 from comments.models import TransactionComment
 from django.conf import settings
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.mail import send_mail
 from django.core.paginator import Paginator
-from django.http import HttpResponseForbidden, HttpResponseRedirect
+from django.db.models import Exists, OuterRef, Q
+from django.http import (Http404, HttpResponseBadRequest,
+                         HttpResponseForbidden, HttpResponseRedirect,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from exchange_rates.views import get_required_amount_to_be_exchanged
 from logging_app.loguru_config import logger
 from rating.models import Rating
@@ -13,88 +22,113 @@ from requests_for_transaction.models import RequestForTransaction
 from users.views import handshake_count
 
 from .forms import UploadScreenshotForm
-from .models import CLOSED, Transaction
+from .models import NO, YES, Transaction
+from .protected_media import protected_file_response
+from .screenshots import SCREENSHOT_FIELDS, attach_screenshot
+from .timeline import events_between, stream_events, transaction_events
+
+# Файлы конвейера скриншотов названы по sha256 содержимого и не меняются
+HASHED_SCREENSHOT_RE = re.compile(
+    r'^screenshots/(?:originals|display|thumbnails)/[0-9a-f]{2}/'
+    r'(?P<sha256>[0-9a-f]{64})(?:_\w+)?\.\w+$'
+)
+HASHED_SCREENSHOT_MAX_AGE = 60 * 60 * 24 * 365
+LEGACY_SCREENSHOT_MAX_AGE = 60 * 60
 
 
 @login_required
 def transaction_detail(request, transaction_id):
     logger.info(f"Детали транзакции с ID {transaction_id} запрашиваются")
-    transaction = get_object_or_404(Transaction, id=transaction_id)
-
+    transaction = get_object_or_404(
+        Transaction.objects.select_related(
+            'accepting_user',
+            'offer__author',
+            'offer__currency_offered',
+            'offer__currency_needed',
+            'offer__bank_detail__currency',
+            'author_screenshot',
+            'accepting_user_screenshot',
+        ).annotate(
+            has_rating=Exists(Rating.objects.filter(
+                transaction=OuterRef('pk'),
+                author=request.user
+            ))
+        ),
+        id=transaction_id
+    )
     offer = transaction.offer
     accepting_user = transaction.accepting_user
 
-    offer_user_code = transaction.offer.author.referral_code
-    accepting_user_code = transaction.accepting_user.referral_code
-    handshakes = handshake_count(offer_user_code, accepting_user_code)
+    # Права проверяются сразу после основного запроса, до остальной работы
+    current_user_is_author = request.user.id == offer.author_id
+    current_user_is_accepting_user = (
+            request.user.id == transaction.accepting_user_id
+    )
+    if not (request.user.is_superuser
+            or current_user_is_author
+            or current_user_is_accepting_user):
+        logger.error(f"Доступ к деталям транзакции с ID {transaction_id} запрещен")
+        return HttpResponseForbidden("You are not allowed to view this transaction.")
+
+    comment_form = TransactionCommentForm(request.POST or None)
+    if request.method == 'POST' and comment_form.is_valid():
+        new_comment = comment_form.save(commit=False)
+        new_comment.transaction = transaction
+        new_comment.author = request.user
+        new_comment.save()
+        return redirect(
+            'transaction_detail',
+            transaction_id=transaction_id
+        )
+
+    handshakes = handshake_count(offer.author.referral_code,
+                                 accepting_user.referral_code)
 
     offer_bank_detail = offer.bank_detail
     request_for_transaction = RequestForTransaction.objects.filter(
         offer=offer,
         applicant=accepting_user
-    ).first()
+    ).select_related('bank_detail').first()
     accepting_user_bank_detail = (request_for_transaction.bank_detail
                                   if request_for_transaction else None)
 
     author_not_asserts_paid = (
-            transaction.author_asserts_transfer_done == 'no'
+            transaction.author_asserts_transfer_done == NO
     )
     accepting_user_not_confirmed = (
-            transaction.accepting_user_confirms_money_received == 'no'
+            transaction.accepting_user_confirms_money_received == NO
     )
     author_asserts_paid = (
-            transaction.author_asserts_transfer_done == 'YES'
+            transaction.author_asserts_transfer_done == YES
     )
 
     accepting_user_confirmed_but_not_paid_back = (
-            transaction.accepting_user_confirms_money_received == 'YES'
-            and transaction.author_confirms_money_received == 'no'
-            and transaction.accepting_user_asserts_transfer_done == 'no'
+            transaction.accepting_user_confirms_money_received == YES
+            and transaction.author_confirms_money_received == NO
+            and transaction.accepting_user_asserts_transfer_done == NO
     )
 
     accepting_user_paid_back_author_not_confirmed = (
-            transaction.accepting_user_confirms_money_received == 'YES'
-            and transaction.author_confirms_money_received == 'no'
-            and transaction.accepting_user_asserts_transfer_done == 'YES'
+            transaction.accepting_user_confirms_money_received == YES
+            and transaction.author_confirms_money_received == NO
+            and transaction.accepting_user_asserts_transfer_done == YES
     )
 
     accepting_user_author_both_confirmed = (
-            transaction.accepting_user_confirms_money_received == 'YES'
-            and transaction.author_confirms_money_received == 'YES'
-    )
-
-    current_user_is_author = (
-            request.user == transaction.offer.author
-    )
-    current_user_is_accepting_user = (
-            request.user == transaction.accepting_user
+            transaction.accepting_user_confirms_money_received == YES
+            and transaction.author_confirms_money_received == YES
     )
 
     exchange_data = get_required_amount_to_be_exchanged(offer)
     required_amount = exchange_data['required_amount']
-    existing_rating = Rating.objects.filter(
-        transaction=transaction,
-        author=request.user
-    ).first()
 
     comments_list = TransactionComment.objects.filter(
         transaction=transaction
-    ).order_by('-created_at')
+    ).select_related('author').order_by('-created_at')
     paginator = Paginator(comments_list, 10)
     page_number = request.GET.get('page')
     comments = paginator.get_page(page_number)
 
-    comment_form = TransactionCommentForm(request.POST or None)
-    if request.method == 'POST' and comment_form.is_valid():
-        new_comment = comment_form.save(commit=False)
-        new_comment.transaction = transaction
-        new_comment.author = request.user
-        new_comment.save()
-        return redirect(
-            'transaction_detail',
-            transaction_id=transaction_id
-        )
-
     context = {
         'transaction': transaction,
         'offer': offer,
@@ -118,18 +152,12 @@ def transaction_detail(request, transaction_id):
         'offer_bank_detail': offer_bank_detail,
         'accepting_user_bank_detail': accepting_user_bank_detail,
         'required_amount': required_amount,
-        'existing_rating': existing_rating,
+        'existing_rating': transaction.has_rating,
 
         'comments': comments,
         'comment_form': comment_form,
     }
-    if (request.user.is_superuser
-            or request.user == transaction.offer.author
-            or request.user == transaction.accepting_user):
-        return render(request, 'transactions/transaction_detail.html', context)
-    else:
-        logger.error(f"Доступ к деталям транзакции с ID {transaction_id} запрещен")
-        return HttpResponseForbidden("You are not allowed to view this transaction.")
+    return render(request, 'transactions/transaction_detail.html', context)
 
 
 @login_required
@@ -157,9 +185,13 @@ def upload_screenshot(request, transaction_id, user_role):
             instance=transaction
         )
         if form.is_valid():
-            logger.info(f"Скриншот для транзакции с "
-                        f"ID {transaction_id} успешно загружен")
-            form.save()
+            file_field = SCREENSHOT_FIELDS[user_role][0]
+            if file_field in request.FILES:
+                # Файл сохраняется по хэшу, сжатие идёт в фоне
+                attach_screenshot(transaction, user_role,
+                                  form.cleaned_data[file_field])
+                logger.info(f"Скриншот для транзакции с "
+                            f"ID {transaction_id} успешно загружен")
             return redirect(
                 'transaction_detail',
                 transaction_id=transaction.id
@@ -186,21 +218,37 @@ def accepting_user_uploads_screenshot(request, transaction_id):
     return upload_screenshot(request, transaction_id, "accepting_user")
 
 
-@login_required
-def accepting_user_confirms_money_received(request, transaction_id):
-    logger.info(f"Принимающий пользователь пытается подтвердить "
-                f"получение денег для транзакции {transaction_id}")
-    transaction = get_object_or_404(Transaction, id=transaction_id)
-    if transaction.accepting_user != request.user:
-        logger.error(
-            f"Пользователь {request.user} не имеет права подтвердить "
-            f"получение денег для транзакции {transaction_id}")
+def run_transition(request, transaction_id, name):
+    """
+    Общий обработчик шагов сделки: проверка прав по TRANSITIONS и один
+    условный UPDATE. Если шаг уже выполнен или сделка ушла в другое
+    состояние, пользователь просто возвращается на страницу сделки.
+    """
+    transaction = get_object_or_404(
+        Transaction.objects.select_related('offer'),
+        id=transaction_id
+    )
+    if not transaction.is_actor(request.user, name):
+        logger.error(f"Пользователь {request.user} не имеет права выполнить "
+                     f"шаг {name} для транзакции {transaction_id}")
         return HttpResponseForbidden(
             "You don't have permission to perform this action."
         )
+    if transaction.apply_transition(name, actor=request.user):
+        logger.info(f"Шаг {name} для транзакции {transaction_id} выполнен, "
+                    f"статус: {transaction.status}")
+    else:
+        logger.warning(f"Шаг {name} для транзакции {transaction_id} "
+                       f"отклонён: сделка не в исходном состоянии")
+        messages.error(request, 'This step is not available '
+                                'for the transaction anymore.')
+    return redirect('transaction_detail', transaction_id=transaction.id)
 
-    transaction.accepting_user_confirms_money_received = 'YES'
-    transaction.save()
+
+@login_required
+def accepting_user_confirms_money_received(request, transaction_id):
+    logger.info(f"Принимающий пользователь пытается подтвердить "
+                f"получение денег для транзакции {transaction_id}")
     # author_email = transaction.offer.author.email
     # send_mail(
     #     'Payment Confirmation',
@@ -209,24 +257,14 @@ def accepting_user_confirms_money_received(request, transaction_id):
     #     [author_email],
     #     fail_silently=False,
     # )
-    logger.info(f"Принимающий пользователь успешно подтвердил получение "
-                f"денег для транзакции {transaction_id}")
-    return redirect('transaction_detail', transaction_id=transaction.id)
+    return run_transition(request, transaction_id,
+                          'accepting_user_confirms_money_received')
 
 
 @login_required
 def author_confirms_money_received(request, transaction_id):
     logger.info(f"Автор транзакции {transaction_id} пытается "
                 f"подтвердить получение денег")
-    transaction = get_object_or_404(Transaction, id=transaction_id)
-    transaction.author_confirms_money_received = 'YES'
-    transaction.status = 'CLOSED'
-    transaction.save()
-
-    offer = transaction.offer
-    offer.status = CLOSED
-    offer.save()
-
     # accepting_user_email = transaction.accepting_user.email
     # send_mail(
     #     'Payment Confirmation',
@@ -235,9 +273,8 @@ def author_confirms_money_received(request, transaction_id):
     #     [accepting_user_email],
     #     fail_silently=False,
     # )
-    logger.info(f"Автор транзакции {transaction_id} успешно подтвердил "
-                f"получение денег и транзакция закрыта")
-    return redirect('transaction_detail', transaction_id=transaction.id)
+    return run_transition(request, transaction_id,
+                          'author_confirms_money_received')
 
 
 @login_required
@@ -245,17 +282,6 @@ def accepting_user_asserts_transfer_done(request, transaction_id):
     logger.info(
         f"Принимающий пользователь {request.user} пытается утвердить "
         f"выполнение перевода для транзакции {transaction_id}")
-    transaction = get_object_or_404(Transaction, id=transaction_id)
-    if transaction.accepting_user != request.user:
-        logger.error(
-            f"Пользователь {request.user} не имеет права утвердить "
-            f"выполнение перевода для транзакции {transaction_id}")
-        return HttpResponseForbidden(
-            "You don't have permission to perform this action."
-        )
-    transaction.accepting_user_asserts_transfer_done = 'YES'
-    transaction.save()
-
     # author_email = transaction.offer.author.email
     # send_mail(
     #     'Payment Confirmation',
@@ -265,10 +291,8 @@ def accepting_user_asserts_transfer_done(request, transaction_id):
     #     [author_email],
     #     fail_silently=False,
     # )
-    logger.info(
-        f"Принимающий пользователь {request.user} успешно утвердил "
-        f"выполнение перевода для транзакции {transaction_id}")
-    return redirect('transaction_detail', transaction_id=transaction.id)
+    return run_transition(request, transaction_id,
+                          'accepting_user_asserts_transfer_done')
 
 
 @login_required
@@ -276,22 +300,95 @@ def author_asserts_transfer_done(request, transaction_id):
     logger.info(
         f"Автор транзакции {request.user} заявляет о "
         f"выполнении перевода для транзакции {transaction_id}")
-    transaction = get_object_or_404(Transaction, id=transaction_id)
-    if transaction.offer.author == request.user:
-        transaction.author_asserts_transfer_done = 'YES'
-        transaction.status = 'IN_PROGRESS'
-        transaction.save()
-
-        # accepting_user_email = transaction.accepting_user.email
-        # send_mail(
-        #     'Payment Confirmation',
-        #     'The author of the transaction asserts that the transfer has been completed. '
-        #     'Please check and confirm the receipt of funds.',
-        #     settings.DEFAULT_FROM_EMAIL,
-        #     [accepting_user_email],
-        #     fail_silently=False,
-        # )
-        logger.info(
-            f"Автор транзакции {request.user} успешно утвердил выполнение "
-            f"перевода для транзакции {transaction_id}")
-    return redirect('transaction_detail', transaction_id=transaction.id)
+    # accepting_user_email = transaction.accepting_user.email
+    # send_mail(
+    #     'Payment Confirmation',
+    #     'The author of the transaction asserts that the transfer has been completed. '
+    #     'Please check and confirm the receipt of funds.',
+    #     settings.DEFAULT_FROM_EMAIL,
+    #     [accepting_user_email],
+    #     fail_silently=False,
+    # )
+    return run_transition(request, transaction_id,
+                          'author_asserts_transfer_done')
+
+
+def events_response(events):
+    return StreamingHttpResponse(
+        stream_events(events),
+        content_type='application/x-ndjson'
+    )
+
+
+@login_required
+def transaction_timeline_api(request, transaction_id):
+    parties = get_object_or_404(
+        Transaction.objects.values_list('offer__author_id',
+                                        'accepting_user_id'),
+        id=transaction_id
+    )
+    if not request.user.is_superuser and request.user.id not in parties:
+        logger.error(f"Доступ к журналу транзакции с ID "
+                     f"{transaction_id} запрещен")
+        return HttpResponseForbidden(
+            "You are not allowed to view this transaction."
+        )
+    return events_response(transaction_events(transaction_id))
+
+
+@login_required
+def events_timeline_api(request):
+    """
+    Журнал событий всех сделок за период ?since=&until= (ISO 8601)
+    для аналитики сроков. Доступен только администраторам.
+    """
+    if not request.user.is_superuser:
+        return HttpResponseForbidden(
+            "You are not allowed to view the transaction timeline."
+        )
+    bounds = {}
+    for name in ('since', 'until'):
+        value = request.GET.get(name)
+        if not value:
+            continue
+        try:
+            bounds[name] = parse_datetime(value)
+        except ValueError:
+            bounds[name] = None
+        if bounds[name] is None:
+            return HttpResponseBadRequest(f"Invalid '{name}' datetime.")
+        if timezone.is_naive(bounds[name]):
+            bounds[name] = timezone.make_aware(bounds[name])
+    return events_response(events_between(**bounds))
+
+
+@login_required
+def protected_screenshot(request, path):
+    """
+    Скриншоты отдаются только участникам сделки и администраторам —
+    то же правило, что и в transaction_detail. Сам файл передаёт
+    веб-сервер, см. protected_file_response.
+    """
+    name = f'screenshots/{path}'
+    if posixpath.normpath(name) != name:
+        raise Http404("File not found.")
+
+    match = HASHED_SCREENSHOT_RE.match(name)
+    if match:
+        sha256 = match.group('sha256')
+        deals = (Q(author_screenshot__sha256=sha256)
+                 | Q(accepting_user_screenshot__sha256=sha256))
+        max_age = HASHED_SCREENSHOT_MAX_AGE
+    else:
+        deals = (Q(author_uploads_transfer_screenshot=name)
+                 | Q(accepting_user_uploads_transfer_screenshot=name))
+        max_age = LEGACY_SCREENSHOT_MAX_AGE
+
+    if not request.user.is_superuser and not Transaction.objects.filter(
+            deals,
+            Q(offer__author=request.user) | Q(accepting_user=request.user)
+    ).exists():
+        logger.error(f"Доступ пользователя {request.user} к файлу "
+                     f"{name} запрещен")
+        return HttpResponseForbidden("You are not allowed to view this file.")
+    return protected_file_response(request, name, max_age)
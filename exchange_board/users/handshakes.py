@@ -0,0 +1,76 @@
+from django.db.models import (ExpressionWrapper, F, IntegerField, OuterRef,
+                              Subquery)
+from django.db.models.functions import Coalesce
+
+from .models import InviteTreePath
+
+
+def handshake_counts(anchor_code, target_codes):
+    """
+    Пакетный вариант handshake_count: код `anchor_code` разбирается один
+    раз, расстояние до каждого кода из `target_codes` считается по длине
+    общего префикса. Для пустых кодов возвращается None.
+    """
+    anchor_parts = anchor_code.split('-') if anchor_code else None
+    counts = {}
+    for code in target_codes:
+        if code in counts:
+            continue
+        if anchor_parts is None or not code:
+            counts[code] = None
+            continue
+        parts = code.split('-')
+        common_base = 0
+        for anchor_part, part in zip(anchor_parts, parts):
+            if anchor_part != part:
+                break
+            common_base += 1
+        counts[code] = (len(anchor_parts) - common_base
+                        + len(parts) - common_base)
+    return counts
+
+
+def handshake_distance(user, user_field='pk'):
+    """
+    Выражение с числом рукопожатий между `user` и пользователем из поля
+    `user_field` внешнего запроса ('pk' для пользователей, 'author' для
+    предложений). Считается так же, как handshake_count по referral_code:
+    через ближайшего общего предка, а для разных деревьев — через общий
+    корень над ними.
+    """
+    my_paths = InviteTreePath.objects.filter(descendant=user.pk)
+    my_depth = my_paths.filter(ancestor=OuterRef('ancestor')).values('depth')
+
+    through_common_ancestor = InviteTreePath.objects.filter(
+        descendant=OuterRef(user_field),
+        ancestor__in=my_paths.values('ancestor')
+    ).annotate(
+        total=ExpressionWrapper(
+            F('depth') + Subquery(my_depth),
+            output_field=IntegerField()
+        )
+    ).order_by('total').values('total')[:1]
+
+    their_height = InviteTreePath.objects.filter(
+        descendant=OuterRef(user_field)
+    ).order_by('-depth').values('depth')[:1]
+    my_height = my_paths.order_by('-depth').values('depth')[:1]
+
+    return Coalesce(
+        Subquery(through_common_ancestor, output_field=IntegerField()),
+        ExpressionWrapper(
+            Subquery(their_height) + Subquery(my_height) + 2,
+            output_field=IntegerField()
+        )
+    )
+
+
+def with_handshakes(queryset, user, user_field='pk'):
+    """Добавляет к каждой строке `handshakes` — расстояние до `user`."""
+    return queryset.annotate(handshakes=handshake_distance(user, user_field))
+
+
+def within_handshakes(queryset, user, max_handshakes, user_field='pk'):
+    return with_handshakes(queryset, user, user_field).filter(
+        handshakes__lte=max_handshakes
+    )
@@ -0,0 +1,214 @@
+import threading
+import time
+from array import array
+
+from django.core.cache import cache
+from logging_app.loguru_config import logger
+
+from .models import CustomUser
+
+INVITE_TREE_CACHE_KEY = 'invite_tree:snapshot'
+INVITE_TREE_CACHE_TIMEOUT = 60 * 60 * 24
+INVITE_TREE_MAX_AGE = 60 * 60
+
+
+class InviteTree:
+    """
+    Дерево приглашений по CustomUser.invited_by с глубинами и таблицей
+    двоичных подъёмов: up[k][i] — предок узла i на 2**k уровней выше.
+    Расстояние между двумя пользователями считается через их LCA
+    за O(log глубины) без разбора referral_code.
+    """
+
+    def __init__(self, pairs=()):
+        self.index = {}
+        self.user_ids = array('l')
+        self.depth = array('l')
+        self.root = array('l')
+        self.up = [array('l')]
+        self.max_user_id = 0
+        self.build(pairs)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def __contains__(self, user_id):
+        return user_id in self.index
+
+    def build(self, pairs):
+        """
+        `pairs` — (user_id, inviter_id). Узлы нумеруются в порядке обхода
+        в ширину, поэтому пригласитель всегда получает индекс раньше.
+        """
+        children = {}
+        user_ids = set()
+        for user_id, inviter_id in pairs:
+            user_ids.add(user_id)
+            children.setdefault(inviter_id, []).append(user_id)
+        # Пользователи, чей пригласитель удалён или не загружен, — корни
+        queue = [
+            user_id
+            for inviter_id, invited in children.items()
+            if inviter_id is None or inviter_id not in user_ids
+            for user_id in invited
+        ]
+        for user_id in queue:
+            self._append_root(user_id)
+        position = 0
+        while position < len(queue):
+            parent = self.index[queue[position]]
+            for user_id in children.get(queue[position], ()):
+                if user_id not in self.index:
+                    self._append(user_id, parent)
+                    queue.append(user_id)
+            position += 1
+
+        levels = max(1, max(self.depth, default=0).bit_length())
+        for level in range(1, levels):
+            previous = self.up[level - 1]
+            self.up.append(array('l', (previous[node] for node in previous)))
+
+    def add(self, user_id, inviter_id=None):
+        """Инкрементальное добавление за O(log глубины)."""
+        if user_id in self.index:
+            return
+        parent = self.index.get(inviter_id)
+        if parent is None:
+            node = self._append_root(user_id)
+            for level in self.up[1:]:
+                level.append(node)
+            return
+
+        node = self._append(user_id, parent)
+        for level in range(1, len(self.up)):
+            previous = self.up[level - 1]
+            self.up[level].append(previous[previous[node]])
+        if self.depth[node].bit_length() > len(self.up):
+            # Дерево стало глубже: достраиваем ещё один уровень для всех
+            previous = self.up[-1]
+            self.up.append(array('l', (previous[other] for other in previous)))
+
+    def _append_root(self, user_id):
+        node = len(self.user_ids)
+        self.index[user_id] = node
+        self.user_ids.append(user_id)
+        self.max_user_id = max(self.max_user_id, user_id)
+        self.depth.append(0)
+        self.root.append(node)
+        self.up[0].append(node)
+        return node
+
+    def _append(self, user_id, parent):
+        node = len(self.user_ids)
+        self.index[user_id] = node
+        self.user_ids.append(user_id)
+        self.max_user_id = max(self.max_user_id, user_id)
+        self.depth.append(self.depth[parent] + 1)
+        self.root.append(self.root[parent])
+        self.up[0].append(parent)
+        return node
+
+    def lca(self, first, second):
+        depth, up = self.depth, self.up
+        if depth[first] < depth[second]:
+            first, second = second, first
+        difference = depth[first] - depth[second]
+        level = 0
+        while difference:
+            if difference & 1:
+                first = up[level][first]
+            difference >>= 1
+            level += 1
+        if first == second:
+            return first
+        for level in range(len(up) - 1, -1, -1):
+            if up[level][first] != up[level][second]:
+                first = up[level][first]
+                second = up[level][second]
+        return up[0][first]
+
+    def distance(self, first_id, second_id):
+        """
+        Число рукопожатий между двумя пользователями или None, если кого-то
+        из них нет в дереве. Для разных корней, как и в handshake_count,
+        деревья считаются соединёнными общим корнем над ними.
+        """
+        first = self.index.get(first_id)
+        second = self.index.get(second_id)
+        if first is None or second is None:
+            return None
+        if self.root[first] != self.root[second]:
+            return self.depth[first] + self.depth[second] + 2
+        common = self.lca(first, second)
+        return (self.depth[first] + self.depth[second]
+                - 2 * self.depth[common])
+
+
+_invite_tree = None
+_invite_tree_built_at = 0
+_invite_tree_lock = threading.Lock()
+
+
+def load_invite_pairs(min_user_id=0):
+    return CustomUser.objects.filter(id__gt=min_user_id).values_list(
+        'id', 'invited_by_id'
+    ).order_by('id').iterator()
+
+
+def rebuild_invite_tree(publish=True):
+    """
+    Строит дерево из БД одним запросом и кладёт снимок в общий кэш,
+    откуда его подхватывают остальные процессы.
+    """
+    global _invite_tree, _invite_tree_built_at
+    logger.info("Перестроение дерева приглашений из базы данных")
+    tree = InviteTree(load_invite_pairs())
+    if publish:
+        cache.set(INVITE_TREE_CACHE_KEY, tree, INVITE_TREE_CACHE_TIMEOUT)
+    with _invite_tree_lock:
+        _invite_tree = tree
+        _invite_tree_built_at = time.monotonic()
+    logger.info(f"Дерево приглашений перестроено: {len(tree)} пользователей, "
+                f"{len(tree.up)} уровней подъёма")
+    return tree
+
+
+def catch_up(tree):
+    """Добавляет пользователей, зарегистрированных после снимка."""
+    for user_id, inviter_id in load_invite_pairs(tree.max_user_id):
+        tree.add(user_id, inviter_id)
+    return tree
+
+
+def get_invite_tree():
+    """
+    Дерево текущего процесса: снимок из общего кэша, дополненный новыми
+    пользователями, либо построенное из БД, если снимка нет.
+    """
+    global _invite_tree, _invite_tree_built_at
+    if (_invite_tree is not None
+            and time.monotonic() - _invite_tree_built_at <= INVITE_TREE_MAX_AGE):
+        return _invite_tree
+    tree = cache.get(INVITE_TREE_CACHE_KEY)
+    if tree is None:
+        return rebuild_invite_tree()
+    catch_up(tree)
+    with _invite_tree_lock:
+        _invite_tree = tree
+        _invite_tree_built_at = time.monotonic()
+    return tree
+
+
+def sync_user(user):
+    if _invite_tree is not None:
+        with _invite_tree_lock:
+            _invite_tree.add(user.id, user.invited_by_id)
+
+
+def invite_distance(first_user, second_user):
+    tree = get_invite_tree()
+    if first_user.id not in tree or second_user.id not in tree:
+        # Пользователь зарегистрирован в другом процессе
+        with _invite_tree_lock:
+            catch_up(tree)
+    return tree.distance(first_user.id, second_user.id)
@@ -0,0 +1,87 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.invite_tree import InviteTree
+from users.views import handshake_count
+
+
+def make_invite_tree(users, max_depth, rng):
+    """
+    Синтетическое дерево: каждый новый пользователь приглашён одним из
+    недавно зарегистрированных, поэтому ветки быстро достигают max_depth.
+    Коды строятся так же, как в users.views.register.
+    """
+    pairs = [(1, None)]
+    codes = {1: '1'}
+    depths = {1: 0}
+    invited_count = {}
+    recent = [1]
+    for user_id in range(2, users + 1):
+        inviter_id = rng.choice(recent)
+        invited_count[inviter_id] = invited_count.get(inviter_id, 0) + 1
+        pairs.append((user_id, inviter_id))
+        codes[user_id] = f"{codes[inviter_id]}-{invited_count[inviter_id]}"
+        depths[user_id] = depths[inviter_id] + 1
+        if depths[user_id] < max_depth:
+            recent.append(user_id)
+            if len(recent) > 64:
+                recent.pop(rng.randrange(len(recent)))
+    return pairs, codes
+
+
+class Command(BaseCommand):
+    help = ("Compares referral code handshake counting with the binary "
+            "lifting index on a synthetic invite tree.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000000)
+        parser.add_argument('--depth', type=int, default=50)
+        parser.add_argument('--queries', type=int, default=100000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        pairs, codes = make_invite_tree(options['users'], options['depth'], rng)
+
+        started = time.perf_counter()
+        tree = InviteTree(pairs)
+        build_time = time.perf_counter() - started
+        self.stdout.write(
+            f"build: {len(tree)} users, max depth {max(tree.depth)}, "
+            f"{len(tree.up)} levels in {build_time:.2f}s"
+        )
+
+        # Самые глубокие пользователи — худший случай для сравнения кодов
+        deep = sorted(codes, key=lambda user_id: -len(codes[user_id]))[:1000]
+        probes = [(rng.choice(deep), rng.randrange(1, len(pairs) + 1))
+                  for _ in range(options['queries'])]
+        for first, second in probes[:1000]:
+            if tree.distance(first, second) != handshake_count(
+                    codes[first], codes[second]):
+                self.stderr.write(f"Mismatch for users {first} and {second}")
+                return
+
+        for label, distance in (
+                ('referral codes', lambda first, second: handshake_count(
+                    codes[first], codes[second])),
+                ('binary lifting', tree.distance)):
+            timings = []
+            for first, second in probes:
+                query_started = time.perf_counter()
+                distance(first, second)
+                timings.append(time.perf_counter() - query_started)
+            self.stdout.write(
+                f"{label}: median {statistics.median(timings) * 1e6:.2f}µs, "
+                f"p99 {sorted(timings)[int(len(timings) * 0.99)] * 1e6:.2f}µs"
+            )
+
+        started = time.perf_counter()
+        for user_id in range(len(pairs) + 1, len(pairs) + 10001):
+            tree.add(user_id, rng.choice(deep))
+        self.stdout.write(
+            f"incremental add: "
+            f"{(time.perf_counter() - started) / 10000 * 1e6:.2f}µs per user"
+        )
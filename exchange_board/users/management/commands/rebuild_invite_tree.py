@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.invite_tree import rebuild_invite_tree
+
+
+class Command(BaseCommand):
+    help = ("Rebuilds the invite tree LCA index from CustomUser.invited_by "
+            "and publishes it to the shared cache.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        tree = rebuild_invite_tree()
+        self.stdout.write(self.style.SUCCESS(
+            f"Invite tree rebuilt: {len(tree)} users, "
+            f"max depth {max(tree.depth, default=0)}, "
+            f"{len(tree.up)} lifting levels "
+            f"in {time.perf_counter() - started:.2f}s"
+        ))
@@ -0,0 +1,59 @@
+# Generated by Django 2.2.19 on 2026-10-18 09:49
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_invite_tree_paths(apps, schema_editor):
+    # Обход дерева приглашений от корней: пути потомка — это пути
+    # пригласителя, удлинённые на один шаг, плюс путь к самому себе
+    CustomUser = apps.get_model('users', 'CustomUser')
+    InviteTreePath = apps.get_model('users', 'InviteTreePath')
+    children = {}
+    for user_id, inviter_id in CustomUser.objects.values_list(
+            'id', 'invited_by_id'):
+        children.setdefault(inviter_id, []).append(user_id)
+
+    paths = []
+    stack = [(user_id, ()) for user_id in children.get(None, [])]
+    while stack:
+        user_id, ancestors = stack.pop()
+        ancestors = ancestors + (user_id,)
+        for depth, ancestor_id in enumerate(reversed(ancestors)):
+            paths.append(InviteTreePath(
+                ancestor_id=ancestor_id, descendant_id=user_id, depth=depth
+            ))
+        stack.extend(
+            (child_id, ancestors) for child_id in children.get(user_id, [])
+        )
+    InviteTreePath.objects.bulk_create(paths, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_auto_20231109_1344'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InviteTreePath',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_paths', to=settings.AUTH_USER_MODEL)),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_paths', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='invitetreepath',
+            index=models.Index(fields=['descendant', 'depth'], name='invite_path_descendant_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='invitetreepath',
+            unique_together={('ancestor', 'descendant')},
+        ),
+        migrations.RunPython(build_invite_tree_paths,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 2.2.19 on 2026-10-18 09:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+
+
+def fill_referral_sequences(apps, schema_editor):
+    # Счётчик продолжает нумерацию с наибольшего уже выданного номера,
+    # включая коды приглашённых, чья связь invited_by была обнулена
+    CustomUser = apps.get_model('users', 'CustomUser')
+    ReferralSequence = apps.get_model('users', 'ReferralSequence')
+    user_ids = dict(CustomUser.objects.exclude(
+        referral_code__isnull=True
+    ).values_list('referral_code', 'id'))
+    last_numbers = dict(CustomUser.objects.annotate(
+        referrals_count=Count('referrals')
+    ).filter(referrals_count__gt=0).values_list('id', 'referrals_count'))
+    for code in user_ids:
+        parent_code, _, number = code.rpartition('-')
+        if parent_code in user_ids and number.isdigit():
+            inviter_id = user_ids[parent_code]
+            last_numbers[inviter_id] = max(
+                last_numbers.get(inviter_id, 0), int(number)
+            )
+    ReferralSequence.objects.bulk_create([
+        ReferralSequence(inviter_id=inviter_id, last_number=last_number)
+        for inviter_id, last_number in last_numbers.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_auto_20261018_1749'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralSequence',
+            fields=[
+                ('inviter', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='referral_sequence', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('last_number', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_referral_sequences,
+                             migrations.RunPython.noop),
+    ]
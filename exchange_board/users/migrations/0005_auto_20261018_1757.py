@@ -0,0 +1,46 @@
+# Generated by Django 2.2.19 on 2026-10-18 09:57
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_rating_totals(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    Rating = apps.get_model('rating', 'Rating')
+    totals = Rating.objects.order_by().values('recipient').annotate(
+        total=Sum('score'), count=Count('id')
+    )
+    users = []
+    for row in totals:
+        users.append(CustomUser(
+            id=row['recipient'],
+            rating_sum=row['total'],
+            rating_count=row['count'],
+            aggregated_rating=row['total'] / row['count'],
+        ))
+    CustomUser.objects.bulk_update(
+        users, ['rating_sum', 'rating_count', 'aggregated_rating'],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_referralsequence'),
+        ('rating', '0002_auto_20231102_0446'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_rating_totals, migrations.RunPython.noop),
+    ]
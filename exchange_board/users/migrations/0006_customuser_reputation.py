@@ -0,0 +1,18 @@
+# Generated by Django 2.2.19 on 2026-10-18 09:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_auto_20261018_1757'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='reputation',
+            field=models.FloatField(blank=True, help_text='Bayesian time-decayed score, updated by update_reputation.', null=True),
+        ),
+    ]
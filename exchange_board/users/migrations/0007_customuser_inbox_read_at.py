@@ -0,0 +1,18 @@
+# Generated by Django 2.2.19 on 2026-10-18 10:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_customuser_reputation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='inbox_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.19 on 2026-10-18 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_customuser_inbox_read_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='missed_offers_sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -3,7 +3,8 @@ import string
 import uuid
 
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 
 
 class CustomUser(AbstractUser):
@@ -29,6 +30,15 @@ class CustomUser(AbstractUser):
 
     invitation_code_used = models.UUIDField(null=True, blank=True)
     aggregated_rating = models.FloatField(default=0.0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    reputation = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="Bayesian time-decayed score, updated by update_reputation."
+    )
+    inbox_read_at = models.DateTimeField(null=True, blank=True)
+    missed_offers_sent_at = models.DateTimeField(null=True, blank=True)
 
     def save(self, *args, **kwargs):
         if self.is_superuser and not self.pk:
@@ -44,6 +54,84 @@ class CustomUser(AbstractUser):
         super(CustomUser, self).save(*args, **kwargs)
 
 
+class InviteTreePath(models.Model):
+    """
+    Таблица замыканий дерева приглашений: строка на каждую пару
+    предок/потомок, `depth` — число шагов по invited_by между ними
+    (0 — сам пользователь). Позволяет считать рукопожатия в SQL.
+    """
+    ancestor = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='descendant_paths',
+    )
+    descendant = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='ancestor_paths',
+    )
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        indexes = [
+            models.Index(fields=['descendant', 'depth'],
+                         name='invite_path_descendant_idx'),
+        ]
+
+    @classmethod
+    def add_user(cls, user):
+        """Пути нового пользователя: к себе и ко всем предкам пригласителя."""
+        paths = [cls(ancestor=user, descendant=user, depth=0)]
+        if user.invited_by_id:
+            paths += [
+                cls(ancestor_id=ancestor_id, descendant=user, depth=depth + 1)
+                for ancestor_id, depth in cls.objects.filter(
+                    descendant_id=user.invited_by_id
+                ).values_list('ancestor_id', 'depth')
+            ]
+        cls.objects.bulk_create(paths)
+
+
+class ReferralSequence(models.Model):
+    """
+    Счётчик номеров приглашённых для каждого пригласителя. Вынесен
+    из CustomUser, чтобы полное сохранение пользователя не затирало
+    значение, выданное параллельной регистрации.
+    """
+    inviter = models.OneToOneField(
+        CustomUser,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='referral_sequence',
+    )
+    last_number = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def next_number(cls, inviter):
+        """
+        Номер увеличивается одним UPDATE: строка счётчика блокируется
+        до конца транзакции, поэтому параллельные регистрации получают
+        разные номера без COUNT по приглашённым.
+        """
+        with transaction.atomic():
+            updated = cls.objects.filter(inviter=inviter).update(
+                last_number=F('last_number') + 1
+            )
+            if not updated:
+                sequence, created = cls.objects.get_or_create(
+                    inviter=inviter, defaults={'last_number': 1}
+                )
+                if created:
+                    return sequence.last_number
+                cls.objects.filter(inviter=inviter).update(
+                    last_number=F('last_number') + 1
+                )
+            return cls.objects.filter(inviter=inviter).values_list(
+                'last_number', flat=True
+            ).get()
+
+
 class UserFollow(models.Model):
     user = models.ForeignKey(
         CustomUser,
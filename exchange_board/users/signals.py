@@ -0,0 +1,17 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .invite_tree import sync_user
+from .models import CustomUser, InviteTreePath
+
+
+@receiver(post_save, sender=CustomUser)
+def add_invite_tree_paths(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        InviteTreePath.add_user(instance)
+
+
+@receiver(post_save, sender=CustomUser)
+def add_user_to_invite_tree(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        sync_user(instance)
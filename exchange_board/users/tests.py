@@ -1,7 +1,22 @@
-from django.test import Client, TestCase
+import threading
+from datetime import timedelta
+from unittest.mock import patch
+
+from bank_details.models import Currency
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-
-from .models import CustomUser, Invitation, UserFollow
+from django.utils import timezone
+from notifications.models import OutboxMessage
+from offers.models import Offer
+
+from .handshakes import with_handshakes, within_handshakes
+from .invite_tree import (InviteTree, get_invite_tree, invite_distance,
+                          rebuild_invite_tree)
+from .models import (CustomUser, EmailConfirmation, Invitation,
+                     InviteTreePath, ReferralSequence, UserFollow)
 from .views import handshake_count
 
 
@@ -42,6 +57,26 @@ class RegistrationViewTestCase(TestCase):
         })
         # self.assertEqual(response.status_code, 302)
         self.assertRedirects(response, reverse('users:instructions'))
+        confirmation = OutboxMessage.objects.get()
+        self.assertEqual(confirmation.data['recipients'], ['test@email.com'])
+        code = EmailConfirmation.objects.get().confirmation_code
+        self.assertIn(code, confirmation.data['body'])
+
+    def test_resend_confirmation(self):
+        self.client.post(self.valid_register_url, {
+            'username': 'testuser',
+            'email': 'test@email.com',
+            'password1': 'testpassword123',
+            'password2': 'testpassword123',
+        })
+        EmailConfirmation.objects.update(
+            timestamp=timezone.now() - timedelta(minutes=5)
+        )
+        response = self.client.post(reverse('users:resend_confirmation'),
+                                    {'email': 'test@email.com'})
+        self.assertTemplateUsed(response,
+                                'users/resend_confirmation_done.html')
+        self.assertEqual(OutboxMessage.objects.count(), 2)
 
     def test_invalid_invitation_registration(self):
         response = self.client.post(self.invalid_register_url, {
@@ -132,6 +167,215 @@ class HandshakeCountTestCase(TestCase):
         # Add more test cases as required.
 
 
+class ReferralSequenceTestCase(TestCase):
+
+    def setUp(self):
+        self.inviter = CustomUser.objects.create_user(
+            username="inviter",
+            email="inviter@email.com",
+            password="testpassword123",
+            referral_code="1-4",
+        )
+
+    def test_numbers_are_sequential_without_counting_referrals(self):
+        self.assertEqual(ReferralSequence.next_number(self.inviter), 1)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(ReferralSequence.next_number(self.inviter), 2)
+        statements = [query['sql'].split()[0]
+                      for query in context.captured_queries]
+        self.assertEqual(statements.count('UPDATE'), 1)
+        self.assertNotIn('COUNT(', ' '.join(
+            query['sql'] for query in context.captured_queries
+        ))
+
+    def test_registration_uses_sequence(self):
+        ReferralSequence.objects.create(inviter=self.inviter, last_number=7)
+        invitation = Invitation.objects.create(inviter=self.inviter)
+        self.client.post(
+            reverse('users:register_with_invite', args=[invitation.code]),
+            {
+                'username': 'testuser',
+                'email': 'test@email.com',
+                'password1': 'testpassword123',
+                'password2': 'testpassword123',
+            }
+        )
+        self.assertEqual(
+            CustomUser.objects.get(username='testuser').referral_code, '1-4-8'
+        )
+
+
+class ConcurrentRegistrationTestCase(TransactionTestCase):
+    REGISTRATIONS = 8
+
+    def setUp(self):
+        # Общая in-memory база SQLite не ждёт блокировок, а сразу
+        # отвечает "table is locked"
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("Parallel writes need a file or server database.")
+        self.inviter = CustomUser.objects.create_user(
+            username="inviter",
+            email="inviter@email.com",
+            password="testpassword123",
+            referral_code="1",
+            invites_left=self.REGISTRATIONS,
+        )
+        self.invitations = [
+            Invitation.objects.create(inviter=self.inviter)
+            for _ in range(self.REGISTRATIONS)
+        ]
+
+    def register(self, number, barrier, responses):
+        try:
+            barrier.wait()
+            responses.append(Client().post(
+                reverse('users:register_with_invite',
+                        args=[self.invitations[number].code]),
+                {
+                    'username': f'user{number}',
+                    'email': f'user{number}@email.com',
+                    'password1': 'testpassword123',
+                    'password2': 'testpassword123',
+                }
+            ))
+        finally:
+            connection.close()
+
+    def test_parallel_registrations_get_unique_codes(self):
+        barrier = threading.Barrier(self.REGISTRATIONS)
+        responses = []
+        threads = [
+            threading.Thread(target=self.register,
+                             args=(number, barrier, responses))
+            for number in range(self.REGISTRATIONS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([response.status_code for response in responses],
+                         [302] * self.REGISTRATIONS)
+        codes = list(CustomUser.objects.filter(
+            invited_by=self.inviter
+        ).values_list('referral_code', flat=True))
+        self.assertEqual(
+            sorted(codes),
+            sorted(f'1-{number}'
+                   for number in range(1, self.REGISTRATIONS + 1))
+        )
+
+
+class InviteTreeHandshakesTestCase(TestCase):
+
+    def setUp(self):
+        # Дерево: 1 → 1-1 → 1-1-1, 1 → 1-2, отдельный корень 2 → 2-1
+        self.users = {}
+        for code, inviter_code in (('1', None), ('1-1', '1'),
+                                   ('1-1-1', '1-1'), ('1-2', '1'),
+                                   ('2', None), ('2-1', '2')):
+            self.users[code] = CustomUser.objects.create_user(
+                username=f'user{code}',
+                email=f'user{code}@email.com',
+                password='password',
+                referral_code=code,
+                invited_by=self.users.get(inviter_code)
+            )
+
+    def test_distances_match_referral_codes(self):
+        for code, user in self.users.items():
+            distances = dict(with_handshakes(
+                CustomUser.objects.all(), user
+            ).values_list('referral_code', 'handshakes'))
+            self.assertEqual(distances, {
+                other_code: handshake_count(code, other_code)
+                for other_code in self.users
+            })
+
+    def test_offers_filtered_and_sorted_by_trust(self):
+        usd = Currency.objects.create(code='USD', name='US Dollar')
+        rub = Currency.objects.create(code='RUB', name='Russian Ruble')
+        for user in self.users.values():
+            Offer.objects.create(author=user, currency_offered=usd,
+                                 amount_offered=10, currency_needed=rub)
+        me = self.users['1-1-1']
+
+        with self.assertNumQueries(1):
+            nearby = list(within_handshakes(
+                Offer.objects.all(), me, 2, user_field='author'
+            ).order_by('handshakes', 'id').values_list(
+                'author__referral_code', 'handshakes'
+            ))
+        self.assertEqual(nearby, [('1-1-1', 0), ('1-1', 1), ('1', 2)])
+
+        search = self.client
+        search.login(username='user1-1-1', password='password')
+        response = search.get(reverse('offers_search_api'),
+                              {'max_handshakes': 3})
+        self.assertEqual(
+            {offer['author'] for offer in response.json()['results']},
+            {'user1-1-1', 'user1-1', 'user1', 'user1-2'}
+        )
+
+
+class InviteTreeIndexTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.users = {}
+        for code, inviter_code in (('1', None), ('1-1', '1'),
+                                   ('1-1-1', '1-1'), ('1-2', '1'),
+                                   ('2', None), ('2-1', '2')):
+            self.users[code] = CustomUser.objects.create_user(
+                username=f'user{code}',
+                email=f'user{code}@email.com',
+                password='password',
+                referral_code=code,
+                invited_by=self.users.get(inviter_code)
+            )
+        rebuild_invite_tree()
+
+    def test_distances_match_referral_codes(self):
+        for code, user in self.users.items():
+            for other_code, other in self.users.items():
+                self.assertEqual(invite_distance(user, other),
+                                 handshake_count(code, other_code))
+
+    def test_registration_updates_index_incrementally(self):
+        user = CustomUser.objects.create_user(
+            username='new', email='new@email.com', password='password',
+            invited_by=self.users['1-2']
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(invite_distance(user, self.users['1-1-1']), 4)
+
+    def test_snapshot_catches_up_with_new_users(self):
+        user = CustomUser.objects.create_user(
+            username='new', email='new@email.com', password='password',
+            invited_by=self.users['2-1']
+        )
+        with patch('users.invite_tree._invite_tree', None):
+            tree = get_invite_tree()
+            self.assertIn(user.id, tree)
+            self.assertEqual(tree.distance(user.id, self.users['2'].id), 2)
+
+    def test_incremental_adds_match_full_build(self):
+        pairs = [(1, None)] + [(user_id, user_id - 1)
+                               for user_id in range(2, 40)]
+        pairs += [(100, 20), (101, 100), (200, None), (201, 200)]
+        built = InviteTree(pairs)
+        grown = InviteTree()
+        for user_id, inviter_id in pairs:
+            grown.add(user_id, inviter_id)
+        self.assertEqual(len(grown.up), len(built.up))
+        for first, _ in pairs:
+            for second, _ in pairs:
+                self.assertEqual(grown.distance(first, second),
+                                 built.distance(first, second))
+        self.assertEqual(built.distance(39, 101), 19 + 2)
+        self.assertEqual(built.distance(39, 201), 38 + 1 + 2)
+
+
 class FollowViewsTestCase(TestCase):
 
     def setUp(self):
@@ -221,6 +465,13 @@ class RegisterViewTestCase(TestCase):
         )
         self.inviter.refresh_from_db()
         self.assertEqual(self.inviter.invites_left, 4)
+        user = CustomUser.objects.get(username='testuser')
+        self.assertEqual(
+            set(InviteTreePath.objects.filter(descendant=user).values_list(
+                'ancestor', 'depth'
+            )),
+            {(user.id, 0), (self.inviter.id, 1)}
+        )
 
     def test_invalid_form_registration(self):
         response = self.client.post(self.register_url, {
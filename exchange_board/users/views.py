@@ -1,16 +1,18 @@
-from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.core.mail import send_mail
+from django.db import transaction
 from django.db.models import Count
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 from django.utils import timezone
 from logging_app.loguru_config import logger
+from notifications.inbox import following_changed
+from notifications.mail import queue_email
 
 from .forms import CustomUserCreationForm
-from .models import CustomUser, EmailConfirmation, Invitation, UserFollow
+from .models import (CustomUser, EmailConfirmation, Invitation,
+                     ReferralSequence, UserFollow)
 
 from offers.models import Offer
 from rating.models import Rating
@@ -49,70 +51,29 @@ def register(request, invite_code):
             user.invitation_code_used = invite_code
             logger.info(f"user.invitation_code_used = invite_code")
 
-            next_sub_code = (
-                    CustomUser.objects.filter(invited_by=inviter).count() + 1
-            )
-            logger.info(f"next_sub_code")
-            user.referral_code = f"{inviter.referral_code}-{next_sub_code}"
-            logger.info(f"user.referral_code {user.referral_code}")
-            user.save()
-            logger.info(f"user.save()")
-            email_conf = EmailConfirmation(user=user)
-            logger.info(f"email_conf")
-            email_conf.save()
-            logger.info(f"email_conf.save()")
-            email_subject = "Complete Your Registration with Ashignet"
-            email_body = f"""
-            
-            Сайн байна уу {user.username},
-            
-            Ашигнет-д бүртгүүлсэнд баярлалаа! Бүртгэлээ дуусгаж, имэйл 
-            хаягаа баталгаажуулахын тулд, дараах баталгаажуулах кодыг 
-            ашиглана уу:
-            
-            {email_conf.confirmation_code}
-            
-            Та бүртгэлээ идэвхжүүлэхийн тулд баталгаажуулах хуудсанд 
-            энэ кодыг оруулах хэрэгтэй.
-            
-            Тавтай морилно уу,
-            Ашигнет баг
-
-            Hello {user.username},
-            
-            Thank you for signing up with Ashignet! We're excited to have 
-            you join our community where you can connect, share, and engage 
-            with others.
-
-            To complete your registration and verify your email address, 
-            please use the following confirmation code: 
-            
-            {email_conf.confirmation_code}
-
-            Enter this code on the confirmation page to activate your account. 
-            This verification helps to keep your account secure and ensures 
-            that you can recover your account if you ever lose access.
-
-            If you didn't sign up for Ashignet, you can safely ignore 
-            this email.
-
-            Welcome aboard,
-            The Ashignet Team
-            """
-            send_mail(
-                email_subject,
-                email_body,
-                settings.DEFAULT_FROM_EMAIL,
-                [user.email],
-                fail_silently=False,
-            )
-
-            invitation.used = True
-            invitation.invited_user = user
-            invitation.save()
-            if not inviter.is_superuser and inviter.invites_left > 0:
-                inviter.invites_left -= 1
-                inviter.save()
+            with transaction.atomic():
+                next_sub_code = ReferralSequence.next_number(inviter)
+                user.referral_code = f"{inviter.referral_code}-{next_sub_code}"
+                logger.info(f"user.referral_code {user.referral_code}")
+                user.save()
+                logger.info(f"user.save()")
+                email_conf = EmailConfirmation(user=user)
+                logger.info(f"email_conf")
+                email_conf.save()
+                logger.info(f"email_conf.save()")
+                # Письмо уйдёт через воркер run_outbox только после
+                # фиксации регистрации
+                queue_email('confirmation', {
+                    'username': user.username,
+                    'confirmation_code': email_conf.confirmation_code,
+                }, [user.email])
+
+                invitation.used = True
+                invitation.invited_user = user
+                invitation.save()
+                if not inviter.is_superuser and inviter.invites_left > 0:
+                    inviter.invites_left -= 1
+                    inviter.save(update_fields=['invites_left'])
             return redirect('users:instructions')
     else:
         form = CustomUserCreationForm()
@@ -129,7 +90,7 @@ def confirm_email(request, token):
         )
         conf.confirmed = True
         conf.user.is_email_confirmed = True
-        conf.user.save()
+        conf.user.save(update_fields=['is_email_confirmed'])
         conf.save()
         return redirect('users:login')
     except EmailConfirmation.DoesNotExist:
@@ -178,7 +139,7 @@ def generate_invite_link(request):
         new_invite = Invitation.objects.create(inviter=user)
         if not user.is_superuser:
             user.invites_left -= 1
-            user.save()
+            user.save(update_fields=['invites_left'])
         invite_link = request.build_absolute_uri(
             reverse(
                 'users:register_with_invite',
@@ -273,6 +234,7 @@ def profile_follow(request, username):
         user=request.user, author=author
     ).exists():
         UserFollow.objects.create(user=request.user, author=author)
+        following_changed(request.user.id)
     return redirect("users:user_profile", username=username)
 
 
@@ -281,6 +243,7 @@ def profile_unfollow(request, username):
     author = get_object_or_404(CustomUser, username=username)
     if UserFollow.objects.filter(user=request.user, author=author).exists():
         UserFollow.objects.get(user=request.user, author=author).delete()
+        following_changed(request.user.id, unfollowed_author_id=author.id)
     return redirect("users:user_profile", username=username)
 
 
@@ -338,17 +301,14 @@ def resend_confirmation(request):
             time_diff = timezone.now() - email_confirmation.timestamp
 
             if time_diff > timezone.timedelta(minutes=2):
-                email_confirmation.timestamp = timezone.now()
-                email_confirmation.save()
-
-                send_mail(
-                    f'Welcome to Handshakes. Confirm Your Email '
-                    f'to Get Started. Your confirmation code: '
-                    f'{email_confirmation.confirmation_code}',
-                    settings.DEFAULT_FROM_EMAIL,
-                    [user.email],
-                    fail_silently=False,
-                )
+                with transaction.atomic():
+                    email_confirmation.timestamp = timezone.now()
+                    email_confirmation.save()
+                    queue_email('confirmation', {
+                        'username': user.username,
+                        'confirmation_code':
+                            email_confirmation.confirmation_code,
+                    }, [user.email])
 
                 return render(
                     request,
@@ -398,7 +358,7 @@ def confirm_email_code(request):
             )
             email_conf.confirmed = True
             email_conf.user.is_email_confirmed = True
-            email_conf.user.save()
+            email_conf.user.save(update_fields=['is_email_confirmed'])
             email_conf.save()
             logger.info(f"Email успешно подтвержден с кодом {code}")
             return redirect('users:email_confirmed')